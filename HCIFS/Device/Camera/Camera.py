@@ -1,6 +1,61 @@
 from HCIFS.Device.Device import Device
+from HCIFS.util.LabControl import array_from_com
+from HCIFS.util.DarkLibrary import DarkLibrary
 import numpy as np
-import matplotlib.pyplot as plt
+import time
+import threading
+import queue
+
+class FrameAccumulator(object):
+    """
+    Sums cropped images in place into preallocated buffers, and checks the 
+    saturation of each raw image. Used by Camera.stackFrames.
+    """
+    
+    def __init__(self, roi, dtype, saturation):
+        """
+        Inputs:
+            roi - cropping slices, see Camera.cropSlices (tuple of slices)
+            dtype - dtype of the accumulation buffers (numpy dtype)
+            saturation - saturation level of the camera (int)
+        """
+        self.roi = roi
+        self.dtype = np.dtype(dtype)
+        self.saturation = saturation
+        self.count = 0
+        self.saturated = False
+    
+    def add(self, frame):
+        """
+        Crops a raw image, then adds it to the sums
+        """
+        crop = frame[self.roi]
+        if self.count == 0:
+            self.total = np.zeros(crop.shape, self.dtype)
+            self.totalSq = np.zeros(crop.shape, self.dtype)
+            self.square = np.empty(crop.shape, self.dtype)
+        # checks saturation on each raw image
+        if not self.saturated and np.max(crop) >= self.saturation:
+            self.saturated = True
+        np.add(self.total, crop, out=self.total, casting='unsafe')
+        np.multiply(crop, crop, out=self.square, dtype=self.dtype)
+        np.add(self.totalSq, self.square, out=self.totalSq)
+        self.count += 1
+    
+    def result(self):
+        """
+        Returns the mean, the variance, and the saturation flag, computed in
+        place in the accumulation buffers
+        """
+        assert self.count >= 1, "No image was accumulated."
+        mean = np.divide(self.total, self.count, out=self.total, casting='unsafe')
+        variance = np.divide(self.totalSq, self.count, out=self.totalSq, casting='unsafe')
+        np.multiply(mean, mean, out=self.square)
+        np.subtract(variance, self.square, out=variance)
+        np.maximum(variance, 0, out=variance)
+        
+        return mean, variance, self.saturated
+
 
 class Camera(Device):
     """
@@ -8,7 +63,10 @@ class Camera(Device):
     """
     
     def __init__(self, originPix=[0,0], imgSize=[500,500], binPix=[4,4], 
-            ccdtemp=0, darkCam=None, saturation = 50000, **specs):
+            ccdtemp=0, darkCam=None, saturation = 50000, exposureTimeout=30,
+            pollMin=1e-3, pollMax=5e-2, frameDtype='int32', stackDtype='float64', 
+            pipeline=False, queueSize=2, readoutTime=None, darkLibrary=None, 
+            darkLibrarySize=2e9, numDark=30, **specs):
         """
         Constructor for the camera class. Uses the parent 'Device' class.
         Inputs:
@@ -18,6 +76,17 @@ class Camera(Device):
             ccdtemp - the celsius temperature the camera is set to (number)
             darkCam - image used to reduce dark current (np array)
             saturation - saturation value for the QSIrs61 (int)
+            exposureTimeout - time allowed for readout after the exposure, in seconds (num)
+            pollMin - shortest interval between two 'ImageReady' polls, in seconds (num)
+            pollMax - longest interval between two 'ImageReady' polls, in seconds (num)
+            frameDtype - dtype of the images downloaded from the camera (str)
+            stackDtype - dtype of the buffers used to average images (str)
+            pipeline - if True, overlaps exposures with image processing (bool)
+            queueSize - number of downloaded images waiting to be processed (int)
+            readoutTime - readout time in seconds, measured if None (num)
+            darkLibrary - directory of the dark library, not used if None (str)
+            darkLibrarySize - maximum size of the dark library in bytes (num)
+            numDark - number of images averaged for a new library dark (int)
         """
         
         # call the Device constructor
@@ -31,6 +100,25 @@ class Camera(Device):
         self.ccdtemp = int(specs.get('ccdtemp', ccdtemp))
         self.darkCam = specs.get('darkCam', darkCam)
         self.saturation = int(specs.get('saturation', saturation))
+        self.exposureTimeout = float(specs.get('exposureTimeout', exposureTimeout))
+        self.pollMin = float(specs.get('pollMin', pollMin))
+        self.pollMax = float(specs.get('pollMax', pollMax))
+        self.frameDtype = np.dtype(specs.get('frameDtype', frameDtype))
+        self.stackDtype = np.dtype(specs.get('stackDtype', stackDtype))
+        self.varImg = None                  # variance of the last averaged image
+        self.pipeline = bool(specs.get('pipeline', pipeline))
+        self.queueSize = int(specs.get('queueSize', queueSize))
+        self.readoutTime = specs.get('readoutTime', readoutTime)
+        # frame rates of the last multi-image acquisition (see stackFrames)
+        self.acquisitionStats = dict()
+        # library of darks, used when darkCam is None
+        self.readoutFlag = None
+        self.numDark = int(specs.get('numDark', numDark))
+        darkLibrary = specs.get('darkLibrary', darkLibrary)
+        self.darkLibrary = DarkLibrary(darkLibrary, float(specs.get('darkLibrarySize', 
+                darkLibrarySize))) if darkLibrary is not None else None
+        # counters of the exposure waits (see waitForImage)
+        self.waitStats = {'exposures': 0, 'polls': 0, 'waitTime': 0., 'wastedTime': 0.}
     
     def avgImg(self, expTime, numIm, Xc = None, Yc = None, Rx = None,
                Ry = None, Source = None):
@@ -59,12 +147,172 @@ class Camera(Device):
         print("Turn 'labExperiment = True' to run the lab.")
         return np.zeros(self.imgSize), False
     
-    def exposure(self, exptime):
+    def cropSlices(self, Xc, Yc, Rx, Ry):
+        """
+        Returns the slices of the rectangle used for cropping, centered on (Xc, Yc)
+        with radii (Rx, Ry) in pixels of the downloaded image.
+        """
+        return (slice(int(Xc - Rx), int(Xc + Rx)), slice(int(Yc - Ry), int(Yc + Ry)))
+    
+    def darkConfig(self):
+        """
+        Returns the camera configuration used as key of the dark library
+        """
+        return {'serial': str(getattr(self, 'serialnum', self.name)), 
+                'binPix': [int(b) for b in self.binPix],
+                'originPix': [int(o) for o in self.originPix],
+                'imgSize': [int(n) for n in self.imgSize],
+                'readout': self.readoutFlag, 'ccdtemp': self.ccdtemp}
+    
+    def libraryDark(self, expTime, Source=None):
+        """
+        Gets the full-frame dark for an exposure time from the dark library. 
+        If the library has no dark close enough, numDark images are taken and 
+        stored. The darkCam attribute stays None, so that the next averaged 
+        image gets its dark from the library again.
+        
+        Inputs:
+            expTime - the exposure time in seconds (num)
+            Source - used only for taking Starlight's dark image (Source)
+        Output:
+            dark - the dark image (np array)
+        """
+        config = self.darkConfig()
+        dark = self.darkLibrary.get(config, expTime)
+        if dark is None:
+            dark = self.takeDarkCam(expTime, self.numDark, Source=Source)
+            self.darkCam = None
+            self.darkLibrary.put(config, expTime, dark)
+        
+        return dark
+    
+    def cropDark(self, roi, frameShape, dark=None):
+        """
+        Returns the dark over the cropped region (0 if no darkCam is used).
+        The dark can either be a full image, or be already cropped.
+        
+        Inputs:
+            roi - cropping slices, see cropSlices (tuple of slices)
+            frameShape - shape of the downloaded images (tuple len. 2)
+            dark - the dark image, defaults to darkCam (np array)
+        """
+        dark = np.asarray(self.darkCam if dark is None else dark)
+        if dark.ndim == 0:
+            return dark
+        if dark.shape == tuple(frameShape):
+            return dark[roi]
+        if dark.shape == np.empty(frameShape, dtype='bool')[roi].shape:
+            return dark
+        # darkCam properties and current image size don't match. Raises an
+        # errror
+        raise Exception("Provided dark cam image does not have the same "
+                        "dimensions as the exposure properties. Change one "
+                        "or the other, or take a new dark cam.")
+    
+    def stackFrames(self, expTime, numIm, roi=(slice(None), slice(None)), dtype=None,
+            pipeline=None):
+        """
+        Takes numIm images and accumulates the cropped region in place. Each image
+        is downloaded into the same buffer, cropped first, then summed into
+        preallocated buffers: the peak memory is a few image buffers whatever 
+        numIm, and the work per image scales with the size of the cropped region.
+        
+        In pipeline mode, the calling thread only drives the camera: it starts
+        the next exposure as soon as the previous image is downloaded, while a 
+        worker thread converts, crops and accumulates the downloaded images 
+        from a bounded queue. The camera connection stays on the calling thread.
+        
+        Inputs:
+            expTime - the exposure time in seconds for each image taken (num)
+            numIm - the number of images to take and then average (int)
+            roi - cropping slices, see cropSlices (tuple of slices)
+            dtype - dtype of the accumulation buffers, defaults to stackDtype
+            pipeline - overlap exposures and processing, defaults to self.pipeline (bool)
+        
+        Outputs:
+            mean - the averaged cropped image (np array)
+            variance - the per-pixel variance of the cropped images (np array)
+            saturated - True if any image has reached saturation level (bool)
+        """
+        assert numIm >= 1, "'numIm' must be at least 1."
+        dtype = self.stackDtype if dtype is None else np.dtype(dtype)
+        pipeline = self.pipeline if pipeline is None else pipeline
+        stack = FrameAccumulator(roi, dtype, self.saturation)
+        readouts = []
+        start = time.perf_counter()
+        if not pipeline:
+            frame = None
+            for i in range(numIm):
+                self.startExposure(expTime)
+                self.waitForImage(expTime)
+                t0 = time.perf_counter()
+                frame = self.readImage(out=frame)
+                readouts.append(time.perf_counter() - t0)
+                stack.add(frame)
+        else:
+            frames = queue.Queue(maxsize=max(self.queueSize, 1))
+            errors = []
+            def process():
+                frame = None
+                while True:
+                    raw = frames.get()
+                    if raw is None:
+                        break
+                    try:
+                        if not errors:
+                            frame = array_from_com(raw, self.frameDtype, out=frame, 
+                                    shape=self.frameShape())
+                            stack.add(frame)
+                    except Exception as ex:
+                        errors.append(ex)
+            worker = threading.Thread(target=process, name='%s-stack'%self.name, daemon=True)
+            worker.start()
+            try:
+                for i in range(numIm):
+                    if errors:
+                        break
+                    self.startExposure(expTime)
+                    self.waitForImage(expTime)
+                    t0 = time.perf_counter()
+                    raw = self.connection.query('ImageArray')
+                    readouts.append(time.perf_counter() - t0)
+                    # blocks when the worker is queueSize images behind
+                    frames.put(raw)
+            finally:
+                frames.put(None)
+                worker.join()
+            if errors:
+                raise errors[0]
+        elapsed = time.perf_counter() - start
+        # achieved frame rate versus exposure time plus readout
+        readoutTime = self.readoutTime if self.readoutTime is not None \
+                else float(np.median(readouts))
+        self.acquisitionStats = {'frames': numIm, 'elapsed': elapsed, 
+                'fps': numIm / elapsed, 'readoutTime': readoutTime,
+                'maxFps': 1. / (expTime + readoutTime) if expTime + readoutTime > 0 
+                else float('inf'), 'pipeline': pipeline}
+        self.acquisitionStats['efficiency'] = \
+                self.acquisitionStats['fps'] / self.acquisitionStats['maxFps']
+        
+        return stack.result()
+    
+    def startExposure(self, expTime):
+        """
+        Dummy function for starting an exposure, see waitForImage and readImage
+        
+        Inputs:
+            expTime - exposure time in seconds for the image
+        """
+        assert not self.labExperiment, "Can't use 'startExposure' with default 'Camera' class."
+        print("Turn 'labExperiment = True' to run the lab.")
+    
+    def exposure(self, exptime, out=None):
         """
         Dummy function for taking an image
         
         Inputs:
             exptime - exposure time in seconds for the image
+            out - optional preallocated array the image is written into
         
         Outputs:
             image - a numpy array with properties corresponding to the values passed to exposureProperties
@@ -73,6 +321,75 @@ class Camera(Device):
         print("Turn 'labExperiment = True' to run the lab.")
         return np.zeros(self.imgSize)
 
+    def waitForImage(self, expTime, timeout=None, attribute='ImageReady'):
+        """
+        Waits for the end of an exposure started by the camera driver.
+        
+        Sleeps through most of the exposure, then polls the ready flag with an
+        exponential backoff, from pollMin up to a tenth of the exposure time (at 
+        most pollMax). Short exposures are polled at a fine interval, long ones 
+        don't flood the camera interface. The waitStats counters are updated 
+        with the number of polls, the time spent waiting, and the wasted time
+        (the last sleep interval, upper bound of the delay to notice the image).
+        
+        Inputs:
+            expTime - exposure time in seconds (num)
+            timeout - maximum wait in seconds, defaults to expTime + exposureTimeout (num)
+            attribute - name of the camera ready flag (str)
+        Output:
+            elapsed - time waited in seconds (num)
+        """
+        if timeout is None:
+            timeout = expTime + self.exposureTimeout
+        start = time.perf_counter()
+        deadline = start + timeout
+        # no need to ask the camera before the end of the exposure
+        time.sleep(max(0.9 * expTime - self.pollMin, 0))
+        interval = self.pollMin
+        maxInterval = min(self.pollMax, max(self.pollMin, 0.1 * expTime))
+        polls, slept = 0, 0.
+        while True:
+            polls += 1
+            if self.connection.query(attribute) == True:
+                break
+            now = time.perf_counter()
+            if now > deadline:
+                self.waitStats['polls'] += polls
+                raise TimeoutError('Camera exposure not ready after %.3g s.'%(now - start))
+            # back off, but never sleep past the deadline
+            slept = min(interval, deadline - now)
+            time.sleep(slept)
+            interval = min(2 * interval, maxInterval)
+        elapsed = time.perf_counter() - start
+        self.waitStats['exposures'] += 1
+        self.waitStats['polls'] += polls
+        self.waitStats['waitTime'] += elapsed
+        self.waitStats['wastedTime'] += slept
+        
+        return elapsed
+    
+    def readImage(self, out=None):
+        """
+        Downloads the last image from the camera as a contiguous array of 
+        dtype frameDtype.
+        
+        Inputs:
+            out - optional preallocated array the image is written into (np array)
+        Outputs:
+            image - the downloaded image (numpy array)
+        """
+        if self.connection == None:
+            raise Exception('Camera not connected.')
+        return self.connection.queryArray('ImageArray', dtype=self.frameDtype, out=out,
+                shape=self.frameShape())
+    
+    def frameShape(self):
+        """
+        Shape of the downloaded images, used to reshape flat image buffers: by
+        default the binned image size, drivers return the NumX and NumY they set
+        """
+        return tuple(int(n) for n in np.asarray(self.imgSize) // np.asarray(self.binPix))
+    
     def exposureProperties(self, originPix, imgSize, binPix):
         """
         A dummy function for changing the exposure properties of the camera
@@ -104,25 +421,24 @@ class Camera(Device):
         assert not self.labExperiment, "Can't use 'readoutSpeed' with default 'Camera' class."
         print("Turn 'labExperiment = True' to run the lab.")
 
-    def realTime(self):
+    def realTime(self, expTime=0.0003, maxPix=800, interval=0.02, block=True):
         """
-        Dummy function for creating a realtime feed of the camera in a separate figure window.
-        Pauses execution until the figure is closed.
+        Creates a realtime feed of the camera in a separate figure window, see 
+        LiveView. By default, pauses execution until the figure is closed.
+        
+        Inputs:
+            expTime - exposure time in seconds of each image (num)
+            maxPix - maximum number of displayed pixels along each axis (int)
+            interval - refresh interval of the display in seconds (num)
+            block - if False, returns the running LiveView (bool)
         """
         if self.labExperiment == True:
             if self.connection == None:
                 raise Exception('Camera not connected.')
-            # creates the figure
-            plt.figure(100)
-            plt.title('Real Time Picture')
-            plt.tight_layout()
-            # updates the figure with the current image until the figure is closed
-            while plt.fignum_exists(100):
-                img = self.exposure(0.0003)
-                plt.imshow(img, origin = 'lower')
-                cb = plt.colorbar()
-                plt.pause(.1)
-                cb.remove()
+            from HCIFS.util.visualization import LiveView
+            view = LiveView(self, expTime, maxPix, interval)
+            view.start(block)
+            return view
         else:
             raise Exception("Can't use 'realTime' with default 'Camera' class.")
             print("Turn 'labExperiment = True' to run the lab.")
@@ -127,47 +127,32 @@ class QSIrs61(Camera):
                 Rx = self.imgSize[0] / 2
             if Ry is None:
                 Ry = self.imgSize[1] / 2
-            # takes new dark image if needed
-            if np.array(self.darkCam).all() == None:
+            self.readoutSpeed(1)
+            # gets the dark image from the library, or takes one if needed
+            dark = None
+            if self.darkCam is None and self.darkLibrary is not None:
+                dark = self.libraryDark(expTime)
+            elif np.array(self.darkCam).all() == None:
                 # takes new darkCam
                 self.darkCam = self.takeDarkCam(.1, 30, Xc = Xc, Yc = Yc,
                                                 Rx = Rx, Ry = Ry )
-            elif np.array(self.darkCam).all() == 0:
-                pass
-            elif list(np.shape(self.darkCam)) != self.imgSize.tolist():
-                # darkCam properties and current image size don't match. Raises an
-                # errror
-                raise Exception("Provided dark cam image does not have the same "
-                                "dimensions as the exposure properties. Change one "
-                                "or the other, or take a new dark cam.")
-            self.readoutSpeed(1)
-            # creates a blank image as a placeholder
-            img = np.zeros((int(self.imgSize[0]),
-                               int(self.imgSize[1])), np.int32)
-            saturated = False
-            # takes numIm images and adds them together
-            for i in range(numIm):
-                img = img + self.exposure(expTime)
-            # calculates the average image
-            avgImg = img/numIm
+            # crops the darkCam (checks that it matches the image size)
+            roi = self.cropSlices(Xc, Yc, Rx, Ry)
+            dark = self.cropDark(roi, (int(self.imgSize[0]), int(self.imgSize[1])), dark)
+            # takes numIm images and averages the cropped region in place
+            avgImgCropped, self.varImg, saturated = self.stackFrames(expTime, numIm, roi)
             # subtracts the darkCam from the image
-            avgImgCorrected = avgImg - self.darkCam
-            # crops the image
-            avgImgCropped = avgImgCorrected[int(Xc - Rx) : int(Xc + Rx),
-                                            int(Yc - Ry) : int(Yc + Ry)]
-            # checks to see if image is saturated
-            saturated = False
-            if np.max(avgImgCropped) >= self.saturation:
-                saturated = True
+            avgImgCropped -= dark
 
             return avgImgCropped, saturated
 
-    def exposure(self, expTime):
+    def exposure(self, expTime, out=None):
         """
         Takes an image
         
         Inputs:
             exptime - exposure time in seconds for the image (num)
+            out - optional preallocated array the image is written into (np array)
             
         Outputs:
             image - image captured by camera (numpy array)
@@ -176,16 +161,25 @@ class QSIrs61(Camera):
             super().exposure(expTime)
         else:
             # Starts an exposure on the camera
-            StartExposure = self.connection.query('StartExposure')
-            StartExposure(expTime, self.shutterStatus)
+            self.startExposure(expTime)
             # Wait for the exposure to complete
-            done = self.connection.query('ImageReady')
-            while done != True:
-                done = self.connection.query('ImageReady')
+            self.waitForImage(expTime)
             # it's a nested tuple of size 2758
             # converts it to  an int32 array (2758, 2208)
-            exp = self.connection.query('ImageArray')
-            return np.array(exp)
+            return self.readImage(out)
+
+    def startExposure(self, expTime):
+        """
+        Starts an exposure, without waiting for the image
+        
+        Inputs:
+            exptime - exposure time in seconds for the image (num)
+        """
+        if not self.labExperiment:
+            super().startExposure(expTime)
+        else:
+            StartExposure = self.connection.query('StartExposure')
+            StartExposure(expTime, self.shutterStatus)
 
     def exposureproperties(self, originPix, imgSize, binPix):
         """
@@ -211,6 +205,13 @@ class QSIrs61(Camera):
             self.originPix = originPix
             self.binPix = binPix
 
+    def frameShape(self):
+        """
+        Shape of the downloaded images: NumX and NumY are set to imgSize, in
+        binned pixels
+        """
+        return (int(self.imgSize[0]), int(self.imgSize[1]))
+
     def readoutSpeed(self, readout_flag):
         """
         Changes the readout speed of the camera
@@ -223,6 +224,7 @@ class QSIrs61(Camera):
         else:
             # sends the readout speed to the camera
             self.connection.command('ReadoutSpeed', readout_flag)
+            self.readoutFlag = readout_flag
 
     def shutter(self, openflag):
         """
@@ -300,8 +302,8 @@ class QSIrs61(Camera):
         self.darkCam = darkCam[0]
         # display image if flag is not false
         if display != False:
-            import matplotlib.pyplot as plt
-            plt.imshow(darkCam)
+            from HCIFS.util.visualization import show_image
+            show_image(self.darkCam, display, 'Dark image, %g s'%expTime)
         self.shutter(True)
         self.shutterPriority(1)
         self.readoutSpeed(1)
@@ -1,6 +1,5 @@
 from HCIFS.Device.Camera.Camera import Camera
 import numpy as np
-import time
 
 class SXvrh9(Camera):
     """
@@ -118,8 +117,11 @@ class SXvrh9(Camera):
             else:
                 Ry = Ry / self.binPix[1]
                 
-            # takes new dark image if needed
-            if np.array(self.darkCam).all() == None:
+            # gets the dark image from the library, or takes one if needed
+            dark = None
+            if self.darkCam is None and self.darkLibrary is not None:
+                dark = self.libraryDark(expTime, Source = Source)
+            elif np.array(self.darkCam).all() == None:
                 assert Source != None, 'Must pass a source to take new dark image'
                 # takes new darkCam
                 self.darkCam = self.takeDarkCam(.1, 30, Source = Source,
@@ -127,46 +129,47 @@ class SXvrh9(Camera):
                                                 Yc = Yc * self.binPix[1],
                                                 Rx = Rx * self.binPix[0],
                                                 Ry = Ry * self.binPix[1])
-            elif np.array(self.darkCam).all() == 0:
-                pass
-            elif list(np.shape(self.darkCam)) != self.imgSize.tolist():
-                # darkCam properties and current image size don't match. Raises an
-                # errror
-                raise Exception("Provided dark cam image does not have the same "
-                                "dimensions as the exposure properties. Change one "
-                                "or the other, or take a new dark cam.")
-            # creates a blank image as a placeholder
-            img = np.zeros((int(self.binnedImgSize[0]), int(self.binnedImgSize[1])),
-                           np.int32)
-            # takes numIm images and adds them together
-            for i in range(numIm):
-                img = img + self.exposure(expTime)
-            # calculates the average image
-            avgImg = img/numIm
+            # crops the darkCam (checks that it matches the binned image size)
+            roi = self.cropSlices(Xc, Yc, Rx, Ry)
+            dark = self.cropDark(roi, (int(self.binnedImgSize[0]), int(self.binnedImgSize[1])),
+                                 dark)
+            # takes numIm images and averages the cropped region in place
+            avgImgCropped, self.varImg, saturated = self.stackFrames(expTime, numIm, roi)
             # subtracts the darkCam from the image
-            avgImgCorrected = avgImg - self.darkCam
-            # crops the image
-            avgImgCropped = avgImgCorrected[int(Xc - Rx) : int(Xc + Rx),
-                                            int(Yc - Ry) : int(Yc + Ry)]
-            # checks to see if image is saturated
-            saturated = False
-            if np.max(avgImgCropped) >= self.saturation:
-                saturated = True
+            avgImgCropped -= dark
 
             return avgImgCropped, saturated
 
-    def exposure(self, expTime):
+    def exposure(self, expTime, out=None):
         """
         Takes an image
         
         Inputs:
             exptime - exposure time in seconds for the image (num)
+            out - optional preallocated array the image is written into (np array)
         
         Outputs:
             image - image captured by camera (numpy array)
         """
         if not self.labExperiment:
             super().exposure(expTime)
+        else:
+            # takes a single exposure
+            self.startExposure(expTime)
+            # downloads image once the camera has finished
+            self.waitForImage(expTime)
+            # returns the image
+            return self.readImage(out)
+
+    def startExposure(self, expTime):
+        """
+        Starts an exposure, without waiting for the image
+        
+        Inputs:
+            exptime - exposure time in seconds for the image (num)
+        """
+        if not self.labExperiment:
+            super().startExposure(expTime)
         else:
             if self.connection == None:
                 raise Exception('Camera not connected.')
@@ -177,12 +180,6 @@ class SXvrh9(Camera):
             status = expose(expTimeMS, 1, 0)
             # ensures image was successfully taken
             assert status is True, "Image capture failed."
-            # downloads image once the camera has finished
-            while self.connection.query('ImageReady') is False:
-                time.sleep(0.1)
-            exp = self.connection.query('ImageArray')
-            # returns the image
-            return np.array(exp)
 
     def exposureProperties(self, originPix, imgSize, binPix):
         """
@@ -215,6 +212,15 @@ class SXvrh9(Camera):
             self.connection.command('StartY', int(self.binnedOriginPix[1]))
             self.connection.command('NumX', int(self.binnedImgSize[0]))
             self.connection.command('NumY', int(self.binnedImgSize[1]))
+
+    def frameShape(self):
+        """
+        Shape of the downloaded images: NumX and NumY are set to the binned
+        image size
+        """
+        if not hasattr(self, 'binnedImgSize'):
+            return super().frameShape()
+        return (int(self.binnedImgSize[0]), int(self.binnedImgSize[1]))
     
     def setTemperature(self, temperature):
         """
@@ -241,6 +247,7 @@ class SXvrh9(Camera):
         Inputs:
         display - if True displays the darkCam after it is taken (bool)
         """
+        assert Source != None, 'Must pass a source to take new dark image'
         # set the properties necessary to take dark image
         # turns current of laser to 0
         current = Source.current
@@ -255,6 +262,6 @@ class SXvrh9(Camera):
         Source.changeCurrent(current)
         # displays image if flag is not false
         if display != False:
-            import matplotlib.pyplot as plt
-            plt.imshow(darkCam)
+            from HCIFS.util.visualization import show_image
+            show_image(self.darkCam, display, 'Dark image, %g s'%expTime)
         return darkCam[0]
@@ -1,5 +1,7 @@
 from HCIFS.Device.DM.DM import DM
 import numpy as np
+import os.path
+import time
 from HCIFS.util.LabControl import BMC
 
 class BM1k(DM):
@@ -9,8 +11,14 @@ class BM1k(DM):
     DM2 serial number: '25CW018#040'
     """
     
+    # BMC flat map files of the lab DMs, by serial
+    flatMapFiles = {'25CW004#014': 'C25CW004#14_CLOSED_LOOP_200nm_Voltages_DM#1.txt',
+                    '25CW018#040': 'C25CW018#40_CLOSED_LOOP_200nm_Voltages_DM#2.txt'}
+    
     def __init__(self, numAct=952, numActProfile=2048, maxVoltage=185,
-                 DMserial=0, **specs):
+                 DMserial=0, gridSize=34, 
+                 flatMapDir='C:/Program Files/Boston Micromachines/Shapes', 
+                 flatMapCache='~/.HCIFS/FlatMaps', flatMapVersion=None, **specs):
         """
         BM1k constructor.
         Inputs:
@@ -18,9 +26,16 @@ class BM1k(DM):
             numAct - real number of actuators on DM (int)
             numActProfile - the number of actuators included in the profile (int)
             DMserial - the serial number of the DM (str (11 characters))
+            gridSize - actuators across the grid, numAct are inside a circle (int)
+            flatMapDir - directory of the BMC flat map files (str)
+            flatMapCache - directory of the binary flat map cache (str)
+            flatMapVersion - flat map version loaded when enabled, defaults to
+                             the BMC file (str)
+        The 'flatMap' spec overrides the BMC flat map file of the DM serial.
         """
         # call the DM constructor
-        super().__init__(**specs)
+        super().__init__(numAct=numAct, numActProfile=numActProfile, 
+                maxVoltage=maxVoltage, gridSize=gridSize, **specs)
         
         # determine the correct DM
         self.allNums = {'25CW004#014': 1, '25CW018#040': 2}
@@ -32,16 +47,30 @@ class BM1k(DM):
         self.numAct = int(specs.get('numAct', numAct))
         self.maxVoltage = int(specs.get('maxVoltage', maxVoltage))
         
+        # flat map text source, cache directory and version
+        self.flatMapDir = specs.get('flatMapDir', flatMapDir)
+        if isinstance(self.flatMap, str):
+            self.flatMapSource = self.flatMap
+            self.flatMap = None
+        else:
+            filename = self.flatMapFiles.get(self.DMserial)
+            self.flatMapSource = None if filename is None else \
+                    os.path.join(self.flatMapDir, filename)
+        self.flatMapCache = specs.get('flatMapCache', flatMapCache)
+        self.flatMapVersion = specs.get('flatMapVersion', flatMapVersion)
+        self.flatMaps = None
+        
+        # profile indices of the actuators, and reusable profile buffer
+        self.actSlice, self.deadIdx = self.actuatorMap()
+        self.profile = np.zeros(self.numActProfile)
+        
         # connect to the DM and enable it if running experiment
         if self.labExperiment == True:
             self.connection = BMC()
             self.enable()
             assert self.DMnum != 0, 'Must provide a valid serial number when running lab experiment'
-            # get the flatmaps
-            if self.DMnum == 1:
-                self.flatMap = np.loadtxt('C:/Program Files/Boston Micromachines/Shapes/C25CW004#14_CLOSED_LOOP_200nm_Voltages_DM#1.txt')
-            elif self.DMnum == 2:
-                self.flatMap = np.loadtxt('C:/Program Files/Boston Micromachines/Shapes/C25CW018#40_CLOSED_LOOP_200nm_Voltages_DM#2.txt')
+            # get the flatmap, from the cache
+            self.setFlatMap(self.flatMapVersion)
     
     def enable(self):
         """
@@ -81,33 +110,130 @@ class BM1k(DM):
             assert actuator < self.numActProfile, 'actuator number must be less than 2048'
             assert actuator > 0, 'actuator number must be greater than 0'
             self.connection.command('poke', actuator, command/self.maxVoltage)
+            # update the command in memory, if the actuator belongs to this DM
+            if self.actSlice is not None and self.actSlice.start <= actuator < self.actSlice.stop:
+                data = self.current.copy()
+                data[actuator - self.actSlice.start] = command
+                self.recordCommand(data)
             
+    def getFlatMaps(self):
+        """
+        Returns the flat map cache of the DMs (FlatMapCache), opened on first use
+        """
+        if self.flatMaps is None:
+            from HCIFS.util.FlatMapCache import FlatMapCache
+            self.flatMaps = FlatMapCache(self.flatMapCache)
+        return self.flatMaps
+    
+    def setFlatMap(self, version=None):
+        """
+        Selects the flat map used by flatten, from the flat map cache. The BMC 
+        text file is only parsed if it is not cached yet, or if it changed.
+        Inputs:
+            version - the flat map version, defaults to the BMC file (str)
+        """
+        if version is None:
+            assert self.flatMapSource is not None, 'No flat map file for this DM'
+            self.flatMap = self.getFlatMaps().get(self.DMserial, source=self.flatMapSource)
+            version = os.path.splitext(os.path.basename(self.flatMapSource))[0]
+        else:
+            self.flatMap = self.getFlatMaps().get(self.DMserial, version)
+        self.flatMapVersion = version
+    
+    def saveFlatMap(self, version, flatMap=None):
+        """
+        Stores a flat map version of the DM (e.g. a calibrated flat), and 
+        selects it
+        Inputs:
+            version - name of the new flat map version (str)
+            flatMap - actuator voltages, defaults to the current command (np array)
+        """
+        flatMap = self.getCurrentData() if flatMap is None else flatMap
+        self.flatMap = self.getFlatMaps().put(self.DMserial, version, flatMap)
+        self.flatMapVersion = version
+    
+    def flatMapVersions(self):
+        """
+        Returns the flat map versions stored for the DM, oldest first
+        """
+        return self.getFlatMaps().versions(self.DMserial)
+    
     def flatten(self):
         """
-        Flattens the DM using the provided flatmaps
+        Flattens the DM using the selected flat map (see setFlatMap)
         """
         if not self.labExperiment:
             super().flatten()
         else:
             self.sendData(self.flatMap)
 
-    def getCurentData(self):
+    def getCurrentData(self, fromHardware=False):
         """
-        Gets the current voltage on each actuator
+        Gets the current voltage on each actuator, from the command history 
+        kept in memory
+        Inputs:
+            fromHardware - if True, queries the driver profile instead (bool)
         Output:
             data - voltage on each actuator (np array)
         """
-        if not self.labExperiment:
-            super().getCurentData()
+        if not self.labExperiment or not fromHardware:
+            return super().getCurrentData()
         else:
             return np.array(self.connection.query('get_actuator_data'))
+    
+    def getCurentData(self):
+        """
+        Gets the current voltage on each actuator from the DM (legacy name)
+        """
+        return self.getCurrentData(fromHardware=True)
+
+    def actuatorMap(self):
+        """
+        Builds the map of the actuators into the BMC profile, once from DMnum,
+        numAct and numActProfile: DM1 uses the first numAct profile entries,
+        DM2 the first numAct entries of the second half of the profile.
+        Output:
+            actSlice - the profile entries of the actuators (slice)
+            deadIdx - the profile entries of the dead actuators (np array)
+        """
+        offset = {1: 0, 2: self.numActProfile // 2}.get(self.DMnum)
+        if offset is None:
+            return None, None
+        assert offset + self.numAct <= self.numActProfile, 'numAct too large for the profile'
+        assert np.all((self.deadAct >= 0) & (self.deadAct < self.numAct)), \
+                'dead actuators must be in [0, numAct)'
+        return slice(offset, offset + self.numAct), offset + self.deadAct
+    
+    def fillProfile(self, data, profile=None):
+        """
+        Scatters normalized voltages into a profile buffer, with the dead 
+        actuators at 0. The rest of the profile is left untouched.
+        Inputs:
+            data - the actuator voltages, at least numAct of them (np array)
+            profile - the profile buffer, defaults to self.profile (np array)
+        Output:
+            profile - the filled profile buffer (np array)
+        """
+        if self.actSlice is None:
+            raise Exception('Serial number not recognized')
+        profile = self.profile if profile is None else profile
+        data = np.asarray(data, dtype=np.float64).ravel()
+        # make sure data is correct size
+        assert data.size >= self.numAct, 'data is too small'
+        np.divide(data[:self.numAct], self.maxVoltage, out=profile[self.actSlice])
+        profile[self.deadIdx] = 0
+        return profile
 
     def sendData(self, data):
         """
-        Sends data to every actuator on the DM.
+        Sends data to every actuator on the DM. The voltages are normalized and
+        scattered into the reusable profile buffer (see actuatorMap), and the
+        latency of the command is recorded in commandStats. If at most 
+        pokeThreshold actuators changed since the last command, only those are
+        sent with 'poke'. The command is recorded in the history.
         Inputs:
             data - the actuator voltages to be sent (np array)
-                    array of one dimension with a size greater than numActProfile
+                    array of one dimension with a size of at least numAct
                     do not normalize data beforehand
         Note: data processing is specific to the DMs in the lab
         and the way the profiles from BMC are set up
@@ -115,23 +241,27 @@ class BM1k(DM):
         if not self.labExperiment:
             super().sendData(data)
         else:
-            # make sure data is correct size
-            assert np.size(data) >= self.numActProfile, 'data is too small'
-            data = data[:self.numActProfile]
-            # normalize data
-            data = data / self.maxVoltage
-            # process data for different dms
-            if self.DMnum == 1:
-                data = np.append(data[:self.numAct],
-                                 np.zeros(int(self.numActProfile - self.numAct)))
-            elif self.DMnum == 2:
-                data = np.append(np.zeros(int(self.numActProfile / 2)),
-                                 np.append(data[:self.numAct],
-                                           np.zeros(int(self.numActProfile/2 - self.numAct))))
+            start = time.perf_counter()
+            data = np.asarray(data, dtype=np.float64).ravel()
+            changed = self.changedActuators(data) if self.synced else None
+            if changed is not None and changed.size <= self.pokeThreshold:
+                # small change: poke the changed actuators only
+                sent = self.current.copy()
+                sent[changed] = data[changed]
+                self.fillProfile(sent)
+                for i in changed + self.actSlice.start:
+                    self.connection.command('poke', int(i), self.profile[i])
+                self.commandStats['pokes'] += 1
+                data = sent
             else:
-                raise Exception('Serial number not recognized')
-            self.connection.command('send_data', data)
-            
+                self.profile[:] = 0
+                self.fillProfile(data)
+                self.connection.command('send_data', self.profile)
+                self.commandStats['frames'] += 1
+                self.synced = True
+            self.recordLatency(time.perf_counter() - start)
+            self.recordCommand(data)
+    
     def zero(self):
         """
         Zeros the voltage on all actuators
@@ -142,6 +272,8 @@ class BM1k(DM):
             num_actuators = self.connection.query('num_actuators')
             data = np.zeros(num_actuators)
             self.connection.command('send_data', data)
+            self.recordCommand(np.zeros(self.numAct))
+            self.synced = True
             if self.name is None:
                 self.name = 'DM' + self.DMnum
             print(self.name + ' zeroed')
\ No newline at end of file
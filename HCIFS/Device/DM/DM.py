@@ -1,10 +1,53 @@
 from HCIFS.Device.Device import Device
+import numpy as np
+import time
+
+class CommandHistory(object):
+    """
+    Ring buffer of the last commands sent to a DM, stored as float32 voltages
+    with their timestamps. Once full, the oldest commands are overwritten.
+    """
+    
+    def __init__(self, numAct, size=64):
+        """
+        Inputs:
+            numAct - number of actuators of each command (int)
+            size - maximum number of commands kept (int)
+        """
+        self.commands = np.zeros((max(int(size), 1), numAct), dtype=np.float32)
+        self.timestamps = np.zeros(max(int(size), 1))
+        self.count = 0                      # number of commands recorded
+    
+    def __len__(self):
+        return min(self.count, len(self.commands))
+    
+    def append(self, command, timestamp=None):
+        """
+        Records a command, overwriting the oldest one if the buffer is full
+        """
+        i = self.count % len(self.commands)
+        self.commands[i] = command
+        self.timestamps[i] = time.time() if timestamp is None else timestamp
+        self.count += 1
+    
+    def get(self, steps=0):
+        """
+        Returns the command sent 'steps' commands ago (0 is the latest), and
+        its timestamp
+        """
+        if not 0 <= steps < len(self):
+            raise IndexError('Only %d commands in the history.'%len(self))
+        i = (self.count - 1 - steps) % len(self.commands)
+        return self.commands[i], self.timestamps[i]
 
 class DM(Device):
     """
     class for representing deformable mirrors
     """
-    def __init__(self, maxVoltage=0, flatMap=None, numAct=0, numActProfile = 0, **specs):
+    def __init__(self, maxVoltage=0, flatMap=None, numAct=0, numActProfile = 0, 
+            deadAct=[], historySize=64, pokeThreshold=16, deltaTol=1e-3, 
+            DMmodel='influencingFunction', DMpitch=286.05e-6, gridSize=0, npixDM=256,
+            coupling=0.15, DMgain=5e-9, DMcache='~/.HCIFS/DMSurface', **specs):
         """
         Constructor for the 'DM' class
         Inputs:
@@ -12,6 +55,19 @@ class DM(Device):
             flatMap - path for file containing flatmap (str)
             numAct - real number of actuators on DM (int)
             numActProfile - the number of actuators included in the profile (int)
+            deadAct - indices of the dead actuators, always sent 0 V (list)
+            historySize - number of commands kept in the history (int)
+            pokeThreshold - most actuators changed one by one instead of 
+                sending a full frame (int)
+            deltaTol - smallest voltage change sent to an actuator, above the
+                float32 rounding of the history (num)
+            DMmodel - surface model of the DM, see util.DMSurface (str)
+            DMpitch - actuator pitch in meters (num)
+            gridSize - number of actuators across the actuator grid (int)
+            npixDM - number of surface samples across the actuator grid (int)
+            coupling - influence of an actuator at the nearest actuators (num)
+            DMgain - surface in meters per volt, about 5 nm/V for the BM1k (num)
+            DMcache - directory of the surface operator cache (str)
         """
         # call the Device constructor
         super().__init__(**specs)
@@ -21,6 +77,25 @@ class DM(Device):
         self.flatMap = specs.get('flatMap', flatMap)
         self.numAct = int(specs.get('numAct', numAct))
         self.numActProfile = int(specs.get('numActProfile', numActProfile))
+        self.deadAct = np.array(specs.get('deadAct', deadAct), dtype=int) # dead actuators
+        # latency of the commands sent to the DM, in seconds
+        self.commandStats = {'commands': 0, 'last': 0., 'mean': 0., 'max': 0.,
+                'pokes': 0, 'frames': 0}
+        # command history and current command, kept in memory
+        self.pokeThreshold = int(specs.get('pokeThreshold', pokeThreshold))
+        self.deltaTol = float(specs.get('deltaTol', deltaTol))
+        self.history = CommandHistory(self.numAct, specs.get('historySize', historySize))
+        self.current = np.zeros(self.numAct)    # current voltages
+        self.synced = False                     # current known to match the DM
+        # surface model, built on first use
+        self.DMmodel = specs.get('DMmodel', DMmodel)
+        self.DMpitch = float(specs.get('DMpitch', DMpitch))     # actuator pitch in m
+        self.gridSize = int(specs.get('gridSize', gridSize))     # actuators across
+        self.npixDM = int(specs.get('npixDM', npixDM))           # surface sampling
+        self.coupling = float(specs.get('coupling', coupling))   # inter-actuator coupling
+        self.DMgain = float(specs.get('DMgain', DMgain))         # m/V
+        self.DMcache = specs.get('DMcache', DMcache)
+        self.surfaceModel = None
     
     def zero(self):
         """
@@ -28,28 +103,156 @@ class DM(Device):
         """
         assert not self.labExperiment, "Can't use 'zero' with default 'DM' class."
         print("Turn 'labExperiment = True' to run the lab.")
+        self.recordCommand(np.zeros(self.numAct))
     
     def sendData(self, data):
         """
-        Dummy function for passing data to DM
+        Dummy function for passing data to DM, only records the command
         """
         assert not self.labExperiment, "Can't use 'sendData' with default 'DM' class."
         print("Turn 'labExperiment = True' to run the lab.")
+        self.recordCommand(data)
     
     def flatten(self):
         """
-        Dummy function for flattening the DM using self.flatMap
+        Dummy function for flattening the DM, only records the flat command
         """
         assert not self.labExperiment, "Can't use 'flatten' with default 'DM' class."
         print("Turn 'labExperiment = True' to run the lab.")
+        self.recordCommand(self.flatCommand())
     
-    def getCurrentData(self):
+    def flatCommand(self):
         """
-        Dummy function for getting current voltage data
+        Actuator voltages of the flat DM: the loaded flat map, or mid-range
+        voltages without one (e.g. in simulations)
         """
-        assert not self.labExperiment, "Can't use 'zero' with default 'DM' class."
-        print("Turn 'labExperiment = True' to run the lab.")
-        return np.zeros(self.numAct)
+        if isinstance(self.flatMap, np.ndarray):
+            flat = np.array(self.flatMap[:self.numAct], dtype=np.float64)
+        else:
+            flat = np.full(self.numAct, self.maxVoltage / 2.)
+        flat[self.deadAct] = 0
+        return flat
+    
+    def clip(self, data):
+        """
+        Clips actuator voltages to the range of the DM, [0, maxVoltage]
+        """
+        if self.maxVoltage <= 0:
+            return data
+        return np.clip(data, 0, self.maxVoltage)
+    
+    def recordLatency(self, latency):
+        """
+        Updates commandStats with the latency of a command
+        Inputs:
+            latency - time taken to send the command, in seconds (num)
+        """
+        stats = self.commandStats
+        stats['commands'] += 1
+        stats['last'] = latency
+        stats['mean'] += (latency - stats['mean']) / stats['commands']
+        stats['max'] = max(stats['max'], latency)
+    
+    @staticmethod
+    def sendBatch(commands):
+        """
+        Sends commands to several DMs, e.g. DM1 and DM2 in the same control step
+        Inputs:
+            commands - list of (DM, data) pairs, or dict {DM: data}
+        """
+        commands = commands.items() if isinstance(commands, dict) else commands
+        for dm, data in commands:
+            dm.sendData(data)
+    
+    def recordCommand(self, data, timestamp=None):
+        """
+        Updates the current command and appends it to the history
+        Inputs:
+            data - the actuator voltages sent, at least numAct of them (np array)
+            timestamp - time of the command, defaults to now (num)
+        """
+        data = np.asarray(data, dtype=np.float64).ravel()
+        self.current[:] = data[:self.numAct]
+        self.current[self.deadAct] = 0
+        self.history.append(self.current, timestamp)
+    
+    def changedActuators(self, data):
+        """
+        Indices of the actuators whose voltage differs from the current command
+        by more than deltaTol (dead actuators excluded)
+        Inputs:
+            data - the new actuator voltages (np array)
+        """
+        changed = np.abs(data[:self.numAct] - self.current) > self.deltaTol
+        changed[self.deadAct] = False
+        return np.flatnonzero(changed)
+    
+    def getCurrentData(self, fromHardware=False):
+        """
+        Gets the current voltage on each actuator, from memory
+        Inputs:
+            fromHardware - query the DM instead of using memory (bool)
+        Output:
+            data - voltage on each actuator (np array)
+        """
+        return self.current.copy()
+    
+    def getSurface(self, commands=None, method='sparse'):
+        """
+        Computes the DM surface from the surface model (see util.DMSurface)
+        Inputs:
+            commands - actuator voltages (numAct,) or a batch (N, numAct), 
+                       defaults to the current command (np array)
+            method - 'sparse' or 'fft' (str)
+        Output:
+            surface - surface in meters (npixDM, npixDM), or (N, npixDM, npixDM)
+        """
+        if self.surfaceModel is None:
+            assert self.DMmodel is not None, "No 'DMmodel' defined for this DM."
+            from HCIFS.util.DMSurface import DMSurface
+            self.surfaceModel = DMSurface(self.gridSize, self.numAct, self.DMpitch, 
+                    self.npixDM, self.coupling, gain=self.DMgain, deadAct=self.deadAct,
+                    cacheDir=self.DMcache, model=self.DMmodel)
+        commands = self.current if commands is None else commands
+        return self.surfaceModel.surface(commands, method)
+    
+    def diff(self, steps=1):
+        """
+        Difference between the current command and the command sent 'steps'
+        commands before it
+        """
+        return self.current - self.history.get(steps)[0]
+    
+    def apply(self, data):
+        """
+        Sends a command to the DM, or only records it without the lab
+        """
+        if self.labExperiment:
+            self.sendData(data)
+        else:
+            self.recordCommand(data)
+    
+    def undo(self, steps=1):
+        """
+        Sends again the command sent 'steps' commands ago (a new history entry)
+        """
+        self.apply(self.history.get(steps)[0].astype(np.float64))
+    
+    def replay(self, steps, interval=0.):
+        """
+        Sends again the last 'steps' commands of the history, oldest first
+        Inputs:
+            steps - number of commands replayed (int)
+            interval - pause between two commands in seconds (num)
+        """
+        commands = [self.history.get(k)[0].astype(np.float64) 
+                for k in range(steps - 1, -1, -1)]
+        for i, command in enumerate(commands):
+            if i > 0 and interval > 0:
+                time.sleep(interval)
+            self.apply(command)
+    
+
     def changeActuator(self, actuator, command):
         """
         Dummy function for changing the voltage on a single actuator
@@ -23,7 +23,14 @@ class Device(object):
         # loop through axes x,y,z, look for any stages, and get real position
         self.stageTypes = specs.get('stageTypes', stageTypes)      # (motor)stage types (x,y,z)
         self.stageSerials = specs.get('stageSerials', stageSerials)# (motor)stage serials (x,y,z)
+        # stage handles shared with the Experiment (StagePool), if any
+        stagePool = specs.get('stagePool')
         for i, (stageType, serial) in enumerate(zip(self.stageTypes, self.stageSerials)):
+            if stagePool is not None:
+                # get the open Stage from the pool, and get the position
+                Stage = stagePool.get(stageType, serial, (self.name, i))
+                self.position[i] = Stage.pos
+                continue
             # get the specified module, or use the default 'Stage' module
             stageType = stageType if stageType is not None else 'Stage'
             # enable the Stage, get the position, then disable the Stage
@@ -5,7 +5,7 @@ class BowtieSet(Mask):
     """Focal Plane mask (set of 9 masks)
     """
     
-    def __init__(self, numON=9, numOFF=8, **specs):
+    def __init__(self, numON=9, numOFF=8, bowtieAngle=60, bowtieOrientation=0, **specs):
         
         # call the Mask constructor
         super().__init__(**specs)
@@ -21,3 +21,8 @@ class BowtieSet(Mask):
         self.numOFF = int(specs.get('numOFF', numOFF))  # mask OFF number
         self.posON = self.allPos[self.numON]
         self.posOFF = self.allPos[self.numOFF]
+        self.bowtieAngle = float(specs.get('bowtieAngle', bowtieAngle))    # opening angle in deg
+        self.bowtieOrientation = float(specs.get('bowtieOrientation', bowtieOrientation))
+        # azimuthal sectors of the two bowtie lobes (degrees), e.g. for radial profiles
+        self.sectors = [(self.bowtieOrientation + lobe - self.bowtieAngle/2, 
+                         self.bowtieOrientation + lobe + self.bowtieAngle/2) for lobe in [0, 180]]
@@ -2,6 +2,7 @@
 
 from HCIFS.Device.Source.Source import Source
 from HCIFS.util.img_processing import fit_gauss_2D
+from HCIFS.util.centroid import centroid
 import time
 import numpy as np
 import astropy.units as u
@@ -141,18 +142,15 @@ class MCLS1(Source):
         image = camera.avgimg(.1, 3)
         image = np.transpose(image)
         # finds pixel with highest value
-        maximum = np.amax(image)
-        max_coordinates = np.where(image == maximum)
         ## numpy puts the y-coordinate first so much of this looks reversed
         # finds the maximum valued point which corresponds to largest peak
-        y = max_coordinates[0]
-        x = max_coordinates[1]
-        # finds a gaussian in the square with side-lengths 2*length around the
+        y, x = np.unravel_index(np.argmax(image), image.shape)
+        # finds the peak in the square with side-lengths 2*length around the
         # peak pixel
         centerGauss = image[int(y - length) : int(y + length),
                             int(x - length) : int(x + length)]
-        centerParams = fit_gauss_2D(centerGauss)
-        # gets the location of the peak of the gaussian
+        centerParams = self.locatePeak(centerGauss)
+        # gets the location of the peak
         centerY = centerParams[1] + (y - length)
         centerX = centerParams[2] + (x - length)
         # removes the central gaussian from the image
@@ -160,15 +158,12 @@ class MCLS1(Source):
               int(x - length) : int(x + length)] = np.zeros((2*length,2*length))
         # finds the new maximum valued points which corresponds to second-order
         # peak
-        maximum = np.amax(image)
-        max_coordinates = np.where(image == maximum)
-        y = max_coordinates[0][0]
-        x = max_coordinates[1][0]
-        # fits a gaussian to the second-order peak
+        y, x = np.unravel_index(np.argmax(image), image.shape)
+        # locates the second-order peak
         secondGauss = image[int(y - length) : int(y + length),
                             int(x - length) : int(x + length)]
-        secondParams = fit_gauss_2D(secondGauss)
-        # gets the location of the peak of the gaussian
+        secondParams = self.locatePeak(secondGauss)
+        # gets the location of the peak
         secondY = secondParams[1] + (y - length)
         secondX = secondParams[2] + (x - length)
         # changes the current to the higher value
@@ -197,3 +192,21 @@ class MCLS1(Source):
         # calculates the newCenterPeak from the scale
         newCenterPeak = newSecondPeak * scale
         return centerX, centerY, newCenterPeak, secondX, secondY, newSecondPeak
+
+    def locatePeak(self, cutout):
+        """
+        Locates the peak in a calibration cutout with the centroidMethod of
+        the source. 'gauss' fits a 2D gaussian (curve_fit), the other methods
+        are the fast centroids of util.centroid, with the cutout maximum as
+        amplitude.
+        
+        Inputs:
+            cutout - square image around the peak (np array)
+        
+        Outputs:
+            Tuple: (amplitude, x-coordinate, y-coordinate) in cutout pixels
+        """
+        if self.centroidMethod == 'gauss':
+            return tuple(fit_gauss_2D(cutout)[:3])
+        xo, yo = centroid(cutout, self.centroidMethod)[0]
+        return np.max(cutout), xo, yo
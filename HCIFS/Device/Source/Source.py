@@ -5,12 +5,14 @@ class Source(Device):
     A class used to represent sources.
     """
     def __init__(self, npixCalib=10, FWtype = 'FilterWheel', FWport = 0,
-                 **specs):
+                 centroidMethod = 'gauss', **specs):
         """
         Constructor of the dummy class for source.
         
         Inputs:
             npixCalib: half the length in pixels of the squares used for calibration
+            centroidMethod: peak location method used for calibration, one of
+                'gauss', 'com', 'quadratic', 'xcorr' (see util.centroid)
         """
         super().__init__(**specs)
         
@@ -18,6 +20,7 @@ class Source(Device):
         self.npixCalib = int(specs.get('npixCalib', npixCalib)) # length of calibration area
         self.FWtype = specs.get('FWtype', FWtype)
         self.FWport = int(specs.get('FWport', FWport))
+        self.centroidMethod = specs.get('centroidMethod', centroidMethod) # calibration centroiding
     
     def status(self):
         """
@@ -38,6 +38,8 @@ class MTS50(Stage):
         if not self.labExperiment:
             super().disable()
         else:
+            # finish the pending moves before releasing the stage
+            self.waitMoves()
             self.handle.query('cleanUpAPT')
     
     def gotoHome(self):
@@ -56,9 +58,11 @@ class MTS50(Stage):
         """
         assert type(pos) == u.Quantity, "pos must be an astropy Quantity."
         if not self.labExperiment:
-            super().enable()
+            super().setPos(pos)
         else:
             self.handle.command('mAbs', pos.to('mm').value)
+            # keep track of the position while the handle stays open
+            self.pos = pos
     
     def setVel(self, vel):
         """
@@ -66,9 +70,10 @@ class MTS50(Stage):
         """
         assert type(vel) == u.Quantity, "vel must be an astropy Quantity."
         if not self.labExperiment:
-            super().enable()
+            super().setVel(vel)
         else:
             self.handle.command('setVel', vel.to('mm/s').value)
+            self.vel = vel
     
     def setAcc(self, acc):
         """
@@ -76,7 +81,7 @@ class MTS50(Stage):
         """
         assert type(acc) == u.Quantity, "acc must be an astropy Quantity."
         if not self.labExperiment:
-            super().enable()
+            super().setAcc(acc)
         else:
             # get current velocity parameters
             params = self.handle.query('getVelocityParameters')
@@ -84,6 +89,7 @@ class MTS50(Stage):
             params[1] = acc.to('mm/s2').value
             # change the paramters
             self.handle.command('setVelocityParameters', *params)
+            self.acc = acc
     
     def getPos(self):
         """
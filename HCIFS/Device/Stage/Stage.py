@@ -1,4 +1,5 @@
 import astropy.units as u
+import concurrent.futures
 
 class Stage(object):
     
@@ -12,13 +13,14 @@ class Stage(object):
         self.acc = specs.get('acc', acc)*u.mm/u.s**2
         self.maxtravel = specs.get('maxtravel', maxtravel)*u.mm
         self.labExperiment = bool(specs.get('labExperiment', labExperiment))# lab flag
+        self.executor = None                                       # thread for moveAsync
     
     def enable(self):
         assert not self.labExperiment, "Can't 'enable' with a default stage class."
         print("Turn 'labExperiment = True' to enable a Stage.")
     
     def disable(self):
-        pass
+        self.waitMoves()
     
     def move(self, movement):
         """
@@ -27,6 +29,31 @@ class Stage(object):
         assert type(movement) == u.Quantity, "movement must be an astropy Quantity."
         self.setPos(self.pos + movement)
     
+    def moveAsync(self, movement, callback=None):
+        """
+        moves the stage relative to its position without blocking, and returns
+        a concurrent.futures.Future completed at the end of the move. Moves of 
+        the same stage are queued, moves of different stages run at the same time.
+        The optional callback(movement) is called once the move succeeded, 
+        before the future completes.
+        """
+        assert type(movement) == u.Quantity, "movement must be an astropy Quantity."
+        if self.executor is None:
+            self.executor = concurrent.futures.ThreadPoolExecutor(max_workers=1)
+        def run():
+            self.move(movement)
+            if callback is not None:
+                callback(movement)
+        return self.executor.submit(run)
+    
+    def waitMoves(self):
+        """
+        waits for the end of all moves started with moveAsync
+        """
+        if self.executor is not None:
+            self.executor.shutdown(wait=True)
+            self.executor = None
+    
     def gotoHome(self):
         """
         moves the stage to its home position
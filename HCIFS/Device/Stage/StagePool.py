@@ -0,0 +1,91 @@
+from HCIFS.util.imports import get_module
+import threading
+
+class StagePool(object):
+    """
+    A pool of stage handles keyed by serial number. Each motorized stage is 
+    enabled once, the first time it is requested, and its handle stays open 
+    until 'closeAll' is called, so that successive moves don't pay the APT 
+    connection and cleanup cost.
+    """
+    
+    def __init__(self, labExperiment=False):
+        """
+        Constructor for the 'StagePool' class
+        Inputs:
+            labExperiment - lab flag passed to the stages (bool)
+        """
+        self.labExperiment = bool(labExperiment)
+        self.handles = dict()                   # open stage handles, keyed by serial
+        self.defaults = dict()                  # non-motorized axes, keyed by (device, axis)
+        self.lock = threading.RLock()
+    
+    def createStage(self, stageType, serial):
+        """
+        Creates (and enables) a new stage
+        Inputs:
+            stageType - the stage module name, defaults to 'Stage' (str)
+            serial - the serial number of the stage (str)
+        """
+        # get the specified module, or use the default 'Stage' module
+        stageType = stageType if stageType is not None else 'Stage'
+        module = get_module(stageType, 'Stage')
+        stagespecs = {'stageType':stageType, 'serial':serial, 'labExperiment':self.labExperiment}
+        return getattr(module, stageType)(**stagespecs)
+    
+    def get(self, stageType, serial, axis=None):
+        """
+        Returns the open handle of a stage, and creates it on first use.
+        Axes without serial are not motorized, they get a default stage, 
+        kept per device axis.
+        Inputs:
+            stageType - the stage module name, defaults to 'Stage' (str)
+            serial - the serial number of the stage (str)
+            axis - (device name, axis index) of a non-motorized axis (tuple)
+        """
+        if serial is None:
+            if axis is None:
+                return self.createStage(stageType, serial)
+            with self.lock:
+                stage = self.defaults.get(axis)
+                if stage is None:
+                    stage = self.createStage(stageType, serial)
+                    self.defaults[axis] = stage
+                return stage
+        with self.lock:
+            stage = self.handles.get(str(serial))
+            if stage is None:
+                stage = self.createStage(stageType, serial)
+                self.handles[str(serial)] = stage
+            else:
+                assert stageType in [None, stage.stageType], \
+                        "Stage '%s' is already open as a '%s'."%(serial, stage.stageType)
+            return stage
+    
+    def close(self, serial):
+        """
+        Disables a stage and removes its handle from the pool
+        """
+        with self.lock:
+            stage = self.handles.pop(str(serial), None)
+        if stage is not None:
+            stage.disable()
+    
+    def closeAll(self):
+        """
+        Disables all stages of the pool
+        """
+        with self.lock:
+            serials = list(self.handles)
+            defaults = list(self.defaults.values())
+            self.defaults.clear()
+        for serial in serials:
+            self.close(serial)
+        for stage in defaults:
+            stage.disable()
+    
+    def __contains__(self, serial):
+        return str(serial) in self.handles
+    
+    def __len__(self):
+        return len(self.handles)
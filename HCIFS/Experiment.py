@@ -2,14 +2,37 @@
 #from Hardware.Laser import Laser
 #from Hardware.Motor import Motor
 import os.path, json, inspect, glob
+import concurrent.futures, threading
 from HCIFS.util.imports import get_module
+from HCIFS.Device.Stage.StagePool import StagePool
+from HCIFS.Device.DM.DM import DM
+from HCIFS.WavefrontControl.WavefrontControl import WavefrontControl
 import numpy as np
 import astropy.units as u
 
 
+class DeviceInitError(Exception):
+    """Raised when one or several Devices could not be created. The 'failures'
+    attribute maps each failed device name to its exception.
+    """
+    
+    def __init__(self, failures):
+        self.failures = failures
+        report = ["%d device(s) failed to initialize:"%len(failures)]
+        for name, ex in failures.items():
+            report.append("  '%s': %s: %s"%(name, type(ex).__name__, ex))
+        super().__init__('\n'.join(report))
+
+
 class Experiment(object):
     
-    def __init__(self, jsonfile=None, labExperiment=False, nbIter=30, **specs):
+    # top-level script keys passed to every DM device
+    DMspecs = ['DMmodel', 'DMpitch', 'DMgain', 'DMcache', 'npixDM']
+    # wavefront controllers selected by runFPWC
+    controllers = {'EFC': 'ElectricFieldConjugation', 'SM': 'StrokeMinimization'}
+    
+    def __init__(self, jsonfile=None, labExperiment=False, nbIter=30, 
+            parallelInit=False, maxWorkers=None, centroidMethod='gauss', **specs):
     
         # ensure JSON filename extension
         if jsonfile[-5:].lower() != '.json':
@@ -32,6 +55,13 @@ class Experiment(object):
         
         # load the labExperiment flag
         self.labExperiment = bool(specs.get('labExperiment', labExperiment))
+        # concurrent construction of the devices (opt-in)
+        self.parallelInit = bool(specs.get('parallelInit', parallelInit))
+        self.maxWorkers = specs.get('maxWorkers', maxWorkers)
+        # number of wavefront control iterations
+        self.nbIter = int(specs.get('nbIter', nbIter))
+        # PSF centroiding method of the wavefront control (see util.centroid)
+        self.centroidMethod = specs.get('centroidMethod', centroidMethod)
         
         # check format of the Devices list of dictionaries from specs
         assert 'Devices' in specs, "Devices not defined in specs."
@@ -42,15 +72,17 @@ class Experiment(object):
         assert len(devs) == len(set(dev['name'] for dev in devs)), \
                 "All Devices must have a unique name."
         
+        # open stage handles, shared by all devices and closed in 'closeLab'
+        self.stagePool = StagePool(self.labExperiment)
+        self.positionLock = threading.Lock()        # device positions updated by moves
+        
         # create the Devices dictionary of modules (Source, Camera, DM, Mask, ...)
         self.Devices = dict()
-        for ID, dev in enumerate(devs):
-            # create device dictionary with additional useful keys
-            devspecs = dict({**dev, 'ID':ID, 'labExperiment':labExperiment})
-            # get the specified module, or use the default 'Device' module
-            modname = dev.get('device', 'Device')
-            module = get_module(modname)
-            self.Devices[dev['name']] = getattr(module, modname)(**devspecs)
+        if self.parallelInit:
+            self.Devices = self.createDevices(devs, self.maxWorkers)
+        else:
+            for ID, dev in enumerate(devs):
+                self.Devices[dev['name']] = self.createDevice(ID, dev)
         
         # create the distance-to-previous arrays for both FPWC and IFS loops
         # default loop: all devices sorted by ID, with distances equal zero
@@ -61,48 +93,207 @@ class Experiment(object):
         # set the units to mm
         self.dist2prev_Imag[1] *= u.mm
         self.dist2prev_Spec[1] *= u.mm
+        
+        # wavefront control: dark hole Jacobian, and field model used to 
+        # simulate the images when not running the lab (see runFPWC)
+        self.jacobian = None
+        self.fpwcModel = None
+        self.opticalModel = None
+
+    def createDevice(self, ID, dev):
+        """Create a single device from its dictionary of specs.
+        """
+        # create device dictionary with additional useful keys
+        devspecs = dict({**dev, 'ID':ID, 'labExperiment':self.labExperiment,
+                'stagePool':self.stagePool})
+        # get the specified module, or use the default 'Device' module
+        modname = dev.get('device', 'Device')
+        module = get_module(modname)
+        deviceClass = getattr(module, modname)
+        # DM model specs defined at the top level of the script, unless overridden
+        if issubclass(deviceClass, DM):
+            for key in self.DMspecs:
+                if key in self.specs:
+                    devspecs.setdefault(key, self.specs[key])
+        
+        return deviceClass(**devspecs)
+    
+    def createDevices(self, devs, maxWorkers=None):
+        """Create the devices concurrently on a thread pool, so that the bring-up 
+        time is set by the slowest device instead of the sum of all devices.
+        
+        A device starts once all devices listed in its 'dependsOn' key have been
+        created. Devices sharing a hardware resource (same COM port, same stage 
+        serial, or same entry in their 'resources' key) are never created at the 
+        same time. All failures are collected and raised as one DeviceInitError;
+        devices depending on a failed device are not created.
+        
+        Inputs:
+            devs - list of device specs (list of dicts)
+            maxWorkers - maximum number of threads, defaults to one per device (int)
+        Output:
+            Devices - dictionary of devices, in the same order as devs (dict)
+        """
+        names = [dev['name'] for dev in devs]
+        for dev in devs:
+            for dep in dev.get('dependsOn', []):
+                assert dep in names, "'%s' depends on unknown device '%s'."%(dev['name'], dep)
+        # get the hardware resources of each device
+        resources = dict((dev['name'], self.getResources(dev)) for dev in devs)
+        pending = list(enumerate(devs))
+        created, failures, running = dict(), dict(), dict()
+        maxWorkers = int(maxWorkers) if maxWorkers else max(len(devs), 1)
+        with concurrent.futures.ThreadPoolExecutor(maxWorkers) as executor:
+            while pending or running:
+                busy = set().union(*(resources[name] for name in running.values()))
+                for ID, dev in list(pending):
+                    deps = dev.get('dependsOn', [])
+                    # skip the devices depending on a failed device
+                    failed = [dep for dep in deps if dep in failures]
+                    if failed:
+                        failures[dev['name']] = RuntimeError("dependency '%s' failed."%failed[0])
+                        pending.remove((ID, dev))
+                    # start the devices with all dependencies and resources available
+                    elif all(dep in created for dep in deps) and \
+                            not resources[dev['name']] & busy:
+                        future = executor.submit(self.createDevice, ID, dev)
+                        running[future] = dev['name']
+                        busy |= resources[dev['name']]
+                        pending.remove((ID, dev))
+                if not running:
+                    # remaining devices wait on each other
+                    for ID, dev in pending:
+                        failures[dev['name']] = RuntimeError("circular 'dependsOn'.")
+                    break
+                done, _ = concurrent.futures.wait(running, \
+                        return_when=concurrent.futures.FIRST_COMPLETED)
+                for future in done:
+                    name = running.pop(future)
+                    try:
+                        created[name] = future.result()
+                    except Exception as ex:
+                        failures[name] = ex
+        if failures:
+            # disconnect the devices that were successfully created
+            for dev in created.values():
+                try:
+                    dev.disable()
+                except Exception:
+                    pass
+            raise DeviceInitError(dict((name, failures[name]) for name in names \
+                    if name in failures))
+        
+        return dict((name, created[name]) for name in names)
+    
+    def getResources(self, dev):
+        """Get the set of hardware resources (COM ports, stage serials) used by a 
+        device, including the default port of its module.
+        """
+        resources = set(('resource', str(res)) for res in dev.get('resources', []))
+        modname = dev.get('device', 'Device')
+        try:
+            params = inspect.signature(getattr(get_module(modname), modname)).parameters
+        except Exception:
+            # unknown module, the error is reported when creating the device
+            params = dict()
+        for key in ['port', 'FWport']:
+            default = params[key].default if key in params else None
+            port = dev.get(key, default)
+            if port not in [None, 0]:
+                resources.add(('port', str(port)))
+        for serial in dev.get('stageSerials', []):
+            if serial is not None:
+                resources.add(('stage', str(serial)))
+        
+        return resources
 
     def closeLab(self):
         """ Disconnect all devices from the lab. 
         """
         for dev in self.Devices.values():
             dev.disable()
+        # release the stage handles
+        self.stagePool.closeAll()
 
     def moveStage(self, name, movement):
         """Check for motorized stages on a device, then change the position of the 
         device by introducing a relative movement in x,y,z.
         """
-        # get device, stage types, and stage serials
+        self.moveStages({name: movement})
+    
+    def moveStages(self, movements, wait=True):
+        """Move several devices at once, by introducing relative movements in x,y,z.
+        Axes on different stages move at the same time (e.g. the FPM x,y stages 
+        and the Imag z stage). With wait=False, the moves run in the background
+        and can overlap with a camera readout or a DM command.
+        
+        Inputs:
+            movements - relative movements in x,y,z, keyed by device name (dict)
+            wait - if True, blocks until all moves are completed (bool)
+        Output:
+            futures - one concurrent.futures.Future per moving axis (list)
+        """
+        futures = []
+        for name, movement in movements.items():
+            # get device, stage types, and stage serials
+            dev = self.Devices[name]
+            stages = dev.stageTypes
+            serials = dev.stageSerials
+            # loop through axes x,y,z
+            for i, (mvt, stage, serial) in enumerate(zip(movement, stages, serials)):
+                # for each axis, check if there is any movement, and change position
+                if mvt != 0:
+                    # get the open Stage from the pool, and start moving the Device
+                    Stage = self.stagePool.get(stage, serial, (name, i))
+                    futures.append(Stage.moveAsync(mvt, 
+                            lambda mvt, dev=dev, i=i: self.moved(dev, i, mvt)))
+        if wait:
+            # wait for all moves, and raise the first error
+            concurrent.futures.wait(futures)
+            for future in futures:
+                future.result()
+        
+        return futures
+    
+    def moved(self, dev, axis, mvt):
+        """Update the position of a device after a successful move of one axis.
+        """
+        with self.positionLock:
+            dev.position[axis] += mvt
+            # if device moves along z axis, update the dist2prev arrays
+            if axis == 2:
+                self.updateDist2prev(dev.name, mvt)
+    
+    def updateDist2prev(self, name, mvt):
+        """Update the distance-to-previous arrays after a movement along z.
+        """
+        # FPWC loop
+        for i, devname in enumerate(self.dist2prev_Imag[0]):
+            if devname == name:
+                self.dist2prev_Imag[1][i] += mvt
+                if i < len(self.dist2prev_Imag[0]) - 1:
+                    self.dist2prev_Imag[1][i+1] -= mvt
+        # IFS loop
+        for i, devname in enumerate(self.dist2prev_Spec[0]):
+            if devname == name:
+                self.dist2prev_Spec[1][i] += mvt
+                if i < len(self.dist2prev_Spec[0]) - 1:
+                    self.dist2prev_Spec[1][i+1] -= mvt
+    
+    def switchMask(self, name, on=True):
+        """Move a mask in (posON) or out (posOFF) of the beam, using the 
+        motorized stages of the device.
+        
+        Inputs:
+            name - the name of the Mask device (str)
+            on - True for the mask ON position, False for OFF (bool)
+        """
         dev = self.Devices[name]
-        stages = dev.stageTypes
-        serials = dev.stageSerials
-        # loop through axes x,y,z
-        for i, (mvt, stage, serial) in enumerate(zip(movement, stages, serials)):
-            # for each axis, check if there is any movement, and change position
-            if mvt != 0:
-                dev.position[i] += mvt
-                # get the specified module, or use the default 'Stage' module
-                stage = stage if stage is not None else 'Stage'
-                # enable the Stage, move the Device, then disable the Stage
-                module = get_module(stage, 'Stage')
-                stagespecs = {'stageType':stage, 'serial':serial, 'labExperiment':self.labExperiment}
-                Stage = getattr(module, stage)(**stagespecs)
-                Stage.move(mvt)
-                Stage.disable()
-                # if device moves along z axis, update the dist2prev arrays
-                if i == 2:
-                    # FPWC loop
-                    for i, devname in enumerate(self.dist2prev_Imag[0]):
-                        if devname == name:
-                            self.dist2prev_Imag[1][i] += mvt
-                            if i < len(self.dist2prev_Imag[0]) - 1:
-                                self.dist2prev_Imag[1][i+1] -= mvt
-                    # IFS loop
-                    for i, devname in enumerate(self.dist2prev_Spec[0]):
-                        if devname == name:
-                            self.dist2prev_Spec[1][i] += mvt
-                            if i < len(self.dist2prev_Spec[0]) - 1:
-                                self.dist2prev_Spec[1][i+1] -= mvt
+        target = dev.posON if on else dev.posOFF
+        # movement along each axis given in the mask positions (x,y or x,y,z)
+        movement = [target[i] - dev.position[i] if i < len(target) else 0*u.mm 
+                for i in range(len(dev.position))]
+        self.moveStage(name, movement)
     
     def turnWheel(self, name, number):
         """
@@ -134,18 +325,213 @@ class Experiment(object):
         dev.bandwidth = newMax - newMin
         dev.lam = newMin + dev.bandwidth / 2
         
-
-    def runFPWC(self, mode):
-        
-        # connect the camera
-        self.Camera.connect()
-        # initiate the camera
-        self.Camera.init()
-        # enable the laser
-        self.Laser.enable()
-        # change the focal plane mask
-        # calibrate the laser
-        center, secondary = self.Laser.calibrate()
+    
+    def getDMs(self):
+        """Returns the DM devices, sorted by ID (the order of the Jacobian columns).
+        """
+        return [dev for dev in sorted(self.Devices.values(), key=lambda dev: dev.ID)
+                if isinstance(dev, DM)]
+    
+    def setDMs(self, commands):
+        """Applies absolute DM commands, to all DMs in one batch, clipped to the
+        voltage range of each DM. Without the lab, the commands are only
+        recorded by the DMs.
+        
+        Inputs:
+            commands - {DM name: actuator voltages} (dict)
+        """
+        DMs = [self.Devices[name] for name in commands]
+        if self.labExperiment:
+            DM.sendBatch([(dm, dm.clip(commands[dm.name])) for dm in DMs])
+        else:
+            for dm in DMs:
+                dm.recordCommand(dm.clip(commands[dm.name]))
+    
+    def buildJacobian(self, mode='Imag', cacheDir='~/.HCIFS/Jacobian', batchSize=32,
+            maxWorkers=None, rebuild=False, **modelspecs):
+        """Builds, or loads from the cache, the Jacobian of the DMs on the 'Imag' 
+        or 'Spec' path (see WavefrontControl.OpticalModel and Jacobian), and 
+        uses it for runFPWC. Without the lab, the optical model also simulates
+        the dark hole field of runFPWC.
+        
+        Inputs:
+            mode - 'Imag' or 'Spec', the optical path (str)
+            cacheDir - directory of the Jacobian files (str)
+            batchSize - number of actuators poked per batch (int)
+            maxWorkers - number of worker processes, defaults to the CPUs (int)
+            rebuild - build the Jacobian even if it is cached (bool)
+            modelspecs - OpticalModel inputs, e.g. lams, iwa, owa, pupil
+        Outputs:
+            jacobian - the Jacobian (npix, numAct), or (nlam, npix, numAct)
+            model - the optical model (OpticalModel)
+        """
+        from HCIFS.WavefrontControl.OpticalModel import OpticalModel
+        from HCIFS.WavefrontControl.Jacobian import Jacobian
+        model = OpticalModel.fromExperiment(self, mode, **modelspecs)
+        J = Jacobian(cacheDir, batchSize, maxWorkers).get(model, rebuild)
+        self.jacobian = J[0] if model.nlam == 1 else J
+        self.opticalModel = model
+        if not self.labExperiment:
+            self.fpwcModel = model.field
+        
+        return self.jacobian, model
+    
+    def locatePSF(self, mode='Imag', expTime=0.1, numIm=1, half=10, method=None,
+            Source=None):
+        """Locates the PSF on the camera at the end of the 'Imag' or 'Spec' path,
+        in an image taken with the current setup (e.g. focal plane mask out), 
+        by centroiding a cutout around the brightest pixel.
+        
+        Inputs:
+            mode - 'Imag' or 'Spec', name of the camera device (str)
+            expTime - exposure time of the images in seconds (num)
+            numIm - number of images averaged (int)
+            half - half size of the cutout in pixels (int)
+            method - centroiding method, defaults to the centroidMethod spec,
+                     see util.centroid (str)
+            Source - source turned off for the dark images, needed by the
+                     SXvrh9 camera (Source)
+        Outputs:
+            (xo, yo) - the PSF center in pixels, xo along the columns (tuple)
+            img - the image (np array)
+        """
+        from HCIFS.util.centroid import get_cutouts, centroid
+        img = np.asarray(self.Devices[mode].avgImg(expTime, numIm, Source=Source)[0],
+                dtype=np.float64)
+        (iy, ix) = np.unravel_index(np.argmax(img), img.shape)
+        cutout, origin = get_cutouts(img, [ix, iy], half)
+        (xo, yo) = centroid(cutout, self.centroidMethod if method is None else method)[0]
+        
+        return (float(origin[0, 0] + xo), float(origin[0, 1] + yo)), img
+    
+    def darkHolePixels(self, center, shape, model=None):
+        """Flat indices of the camera pixels of the dark hole samples of the 
+        optical model, in the order of the Jacobian rows. The camera must sample
+        the focal plane like the model (samplesPerLamD pixels per lam0/D).
+        
+        Inputs:
+            center - PSF center (xo, yo) in pixels (tuple)
+            shape - shape of the camera images (tuple)
+            model - optical model, defaults to the one of buildJacobian
+        """
+        model = self.opticalModel if model is None else model
+        assert model is not None, "Build the Jacobian first (buildJacobian)."
+        nf = len(model.xf)
+        (iy, ix) = np.unravel_index(model.darkHole, (nf, nf))
+        px = np.rint(center[0] + model.xf[ix] * model.samplesPerLamD).astype(int)
+        py = np.rint(center[1] + model.xf[iy] * model.samplesPerLamD).astype(int)
+        assert px.min() >= 0 and py.min() >= 0 and px.max() < shape[1] and \
+                py.max() < shape[0], "The dark hole is not inside the camera images."
+        return py * shape[1] + px
+    
+    def runFPWC(self, mode='Imag', controller='EFC', nbIter=None, jacobian=None,
+            darkHole=None, model=None, expTime=0.1, numIm=1, nProbes=2, probeAmp=0.5,
+            centroidMethod=None, Source=None, **ctrlspecs):
+        """Runs the focal plane wavefront control loop with the DMs, on the camera
+        at the end of the 'Imag' or 'Spec' path. At each iteration, the dark hole
+        field is estimated by pairwise probing with the first DM, then the 
+        controller computes the command updates of all DMs, sent in one batch.
+        The loop starts from the current DM commands, e.g. flat DMs (see
+        DM.flatten), and the commands are clipped to [0, maxVoltage].
+        
+        Inputs:
+            mode - 'Imag' or 'Spec', name of the camera device (str)
+            controller - 'EFC', 'SM', or a WavefrontControl instance
+            nbIter - number of iterations, defaults to the script nbIter (int)
+            jacobian - complex dark hole Jacobian (npix, numAct), one column per
+                       active actuator of the DMs, defaults to self.jacobian,
+                       built by buildJacobian at the central wavelength of
+                       the source if needed
+            darkHole - flat indices or boolean mask of the dark hole pixels in
+                       the camera images, defaults in the lab to the dark hole
+                       of the optical model around the PSF (np array)
+            model - function giving the dark hole field for a dict of DM 
+                    commands, simulates the images when not running the lab,
+                    defaults to self.fpwcModel (the optical model)
+            expTime - exposure time of the images in seconds (num)
+            numIm - number of images averaged per measurement (int)
+            nProbes - number of pairwise probes (int)
+            probeAmp - rms amplitude of the modelled probe fields, relative to
+                       the rms amplitude of the current dark hole field, i.e.
+                       the square root of the measured contrast (num)
+            centroidMethod - method locating the PSF center for the default
+                             dark hole, defaults to the centroidMethod spec (str)
+            Source - source turned off for the dark images, needed by the
+                     SXvrh9 camera (Source)
+            ctrlspecs - controller specs, e.g. beta, betaSchedule, gain
+        Outputs:
+            contrast - mean dark hole intensity before each iteration, and 
+                       after the last one (np array)
+            controller - the controller (WavefrontControl)
+        """
+        nbIter = self.nbIter if nbIter is None else int(nbIter)
+        if jacobian is None and self.jacobian is None:
+            self.buildJacobian(mode, nlam=1)
+        jacobian = self.jacobian if jacobian is None else jacobian
+        model = self.fpwcModel if model is None else model
+        assert jacobian is not None, "runFPWC needs a Jacobian."
+        assert np.ndim(jacobian) == 2, \
+                "runFPWC measures one wavelength per image, build the Jacobian with nlam=1."
+        camera = self.Devices[mode]
+        if self.labExperiment:
+            if darkHole is None:
+                center, img = self.locatePSF(mode, expTime, numIm, method=centroidMethod,
+                        Source=Source)
+                darkHole = self.darkHolePixels(center, img.shape)
+            darkHole = np.flatnonzero(darkHole) if np.asarray(darkHole).dtype == bool \
+                    else np.asarray(darkHole)
+        else:
+            assert model is not None, "Must provide a field model to simulate FPWC."
+        DMs = self.getDMs()
+        # get the controller
+        if isinstance(controller, str):
+            modname = self.controllers.get(controller, controller)
+            module = get_module(modname, 'WavefrontControl')
+            controller = getattr(module, modname)(jacobian, 
+                    WavefrontControl.actuatorsOf(DMs), **ctrlspecs)
+        
+        def intensity(commands):
+            self.setDMs(commands)
+            if self.labExperiment:
+                img, saturated = camera.avgImg(expTime, numIm, Source=Source)
+                return np.asarray(img, dtype=np.float64).ravel()[darkHole]
+            return np.abs(model(commands))**2
+        
+        # pairwise probes on the first DM: real parts of the conjugate response
+        # to uniform fields of different phases, normalized to a unit rms field
+        (name, idx, numAct) = controller.actuators[0]
+        J1 = np.asarray(jacobian)[:, :len(idx)]
+        probes, probeFields = [], []
+        for k in range(nProbes):
+            p = np.real(J1.conj().T @ np.full(J1.shape[0], np.exp(1j*np.pi*k/nProbes)))
+            dE = J1 @ p
+            norm = np.sqrt(np.mean(np.abs(dE)**2))
+            probes.append(p / norm)
+            probeFields.append(dE / norm)
+        probeFields = np.array(probeFields)
+        
+        current = dict((dm.name, dm.getCurrentData()) for dm in DMs)
+        contrast = [np.mean(intensity(current))]
+        for it in range(nbIter):
+            # probes scaled to the current field, in the linear regime
+            scale = probeAmp * np.sqrt(max(contrast[-1], 0))
+            deltaI = []
+            for p in probes:
+                probed = dict(current)
+                probed[name] = current[name].copy()
+                probed[name][idx] += scale * p
+                Iplus = intensity(probed)
+                probed[name][idx] -= 2 * scale * p
+                deltaI.append(Iplus - intensity(probed))
+            E = controller.pairwiseEstimate(np.array(deltaI), scale * probeFields)
+            updates = controller.step(E)
+            # clipped to the voltage range of the DMs, as sent
+            current = dict((dm.name, dm.clip(current[dm.name] + updates.get(dm.name, 0)))
+                    for dm in DMs)
+            contrast.append(np.mean(intensity(current)))
+        self.setDMs(current)
+        
+        return np.array(contrast), controller
 
     def getDataCube(self):
         
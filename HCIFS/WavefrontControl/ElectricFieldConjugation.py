@@ -1,5 +1,93 @@
 from HCIFS.WavefrontControl.WavefrontControl import WavefrontControl
+import numpy as np
+import os.path
+import hashlib
 
 class ElectricFieldConjugation(WavefrontControl):
-    
-    pass
\ No newline at end of file
+    """
+    Electric Field Conjugation (Give'on et al. 2007): the command update
+    minimizes |E + G du|^2 + alpha^2 |du|^2, with a Tikhonov regularization
+    alpha^2 = s_max^2 * 10^beta relative to the largest singular value of G.
+
+    The SVD of the Jacobian is computed once (and optionally cached on disk):
+    each solve is two products with the singular vectors, and changing beta
+    only recomputes the filter factors s / (s^2 + alpha^2), O(n).
+    """
+
+    def __init__(self, jacobian, actuators, beta=-2., betaSchedule=None, gain=1.,
+            cacheDir=None, **specs):
+        """
+        Inputs:
+            jacobian, actuators - see WavefrontControl
+            beta - log10 of the regularization relative to s_max^2 (num)
+            betaSchedule - beta of each iteration, the last one is kept (list)
+            gain - loop gain applied to the command updates (num)
+            cacheDir - directory of the SVD cache, not cached if None (str)
+        """
+        self.beta = float(beta)
+        self.betaSchedule = None if betaSchedule is None else list(betaSchedule)
+        self.gain = float(gain)
+        self.cacheDir = cacheDir
+        super().__init__(jacobian, actuators, **specs)
+
+    def jacobianChanged(self):
+        self.U = self.s = self.Vt = None
+        self.filters = dict()
+
+    def jacobianID(self):
+        """
+        Returns a short hash of the stacked Jacobian
+        """
+        return hashlib.sha1(np.ascontiguousarray(self.G).data).hexdigest()[:16]
+
+    def factorize(self):
+        """
+        Computes, or loads from the cache, the thin SVD G = U diag(s) Vt
+        """
+        if self.s is not None:
+            return
+        cachefile = None
+        if self.cacheDir is not None:
+            cachedir = os.path.normpath(os.path.expanduser(self.cacheDir))
+            cachefile = os.path.join(cachedir, 'EFC_%s.npz'%self.jacobianID())
+            if os.path.isfile(cachefile):
+                with np.load(cachefile) as svd:
+                    self.U, self.s, self.Vt = svd['U'], svd['s'], svd['Vt']
+                return
+        U, s, Vt = np.linalg.svd(self.G, full_matrices=False)
+        self.U, self.s, self.Vt = U.astype(self.dtype), s.astype(self.dtype), Vt.astype(self.dtype)
+        if cachefile is not None:
+            os.makedirs(os.path.dirname(cachefile), exist_ok=True)
+            tmpfile = cachefile[:-4] + '.tmp.npz'
+            np.savez(tmpfile, U=self.U, s=self.s, Vt=self.Vt)
+            os.replace(tmpfile, cachefile)
+
+    def currentBeta(self):
+        """
+        Returns the beta of the current iteration, from the schedule if any
+        """
+        if not self.betaSchedule:
+            return self.beta
+        return self.betaSchedule[min(self.iteration, len(self.betaSchedule) - 1)]
+
+    def filterFactors(self, beta):
+        """
+        Returns the Tikhonov filter factors s / (s^2 + alpha^2) for a beta
+        """
+        self.factorize()
+        if beta not in self.filters:
+            alpha2 = self.s[0]**2 * 10.**beta
+            self.filters[beta] = self.s / (self.s**2 + alpha2)
+        return self.filters[beta]
+
+    def computeCommand(self, E, beta=None):
+        """
+        Returns the command update of the active actuators
+        Inputs:
+            E - complex field of the dark hole pixels (npix,) or (nlam, npix) (np array)
+            beta - regularization, defaults to the schedule or self.beta (num)
+        """
+        beta = self.currentBeta() if beta is None else beta
+        f = self.filterFactors(beta)
+        e = self.fieldVector(E)
+        return -self.gain * (self.Vt.T @ (f * (self.U.T @ e))).astype(np.float64)
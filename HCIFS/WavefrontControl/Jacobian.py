@@ -0,0 +1,108 @@
+import os
+import os.path
+import concurrent.futures
+import numpy as np
+
+# optical model of the worker processes, set once per process
+_model = None
+
+
+def _initWorker(model):
+    global _model
+    _model = model
+
+def _computeColumns(filename, dm, actuators, start):
+    """
+    Computes a batch of Jacobian columns in a worker, and writes them in the
+    memory-mapped Jacobian file shared by all workers
+    """
+    J = np.load(filename, mmap_mode='r+')
+    J[start:start + len(actuators)] = _model.columns(dm, actuators)
+    J.flush()
+    del J
+    return len(actuators)
+
+
+class Jacobian(object):
+    """
+    Builds and caches the wavefront control Jacobian of an OpticalModel: the
+    complex dark hole field response to each active actuator of the DMs (the
+    dead actuators are excluded), linearized around flat DMs.
+
+    Actuators are poked in batches, computed in parallel by worker processes,
+    which write their columns directly into a complex64 *.npy file mapped in
+    memory. The file is named after the hash of the optical configuration
+    (DM geometry and distances, wavelengths, pupil, dark hole), so the
+    Jacobian is only built again when one of them changes.
+    """
+
+    def __init__(self, cacheDir='~/.HCIFS/Jacobian', batchSize=32, maxWorkers=None):
+        """
+        Constructor for the 'Jacobian' class
+        Inputs:
+            cacheDir - directory of the Jacobian files (str)
+            batchSize - number of actuators poked per batch (int)
+            maxWorkers - number of worker processes, defaults to the number
+                         of CPUs, computed in this process if 1 (int)
+        """
+        self.cacheDir = os.path.normpath(os.path.expandvars(os.path.expanduser(cacheDir)))
+        self.batchSize = int(batchSize)
+        self.maxWorkers = (os.cpu_count() or 1) if maxWorkers is None else int(maxWorkers)
+
+    def filename(self, model):
+        return os.path.join(self.cacheDir, 'Jacobian_%s.npy'%model.configID())
+
+    def get(self, model, rebuild=False):
+        """
+        Returns the Jacobian of an optical model, from the cache or built
+        Inputs:
+            model - the optical model (OpticalModel)
+            rebuild - build it even if it is cached (bool)
+        Output:
+            J - read-only view of the memory-mapped Jacobian, with one column
+                per active actuator (nlam, npixDH, numAct) (np array)
+        """
+        filename = self.filename(model)
+        numAct = sum(len(idx) for name, idx, n in model.actuators())
+        shape = (numAct, model.nlam, model.npixDH)
+        J = None
+        if not rebuild and os.path.isfile(filename):
+            try:
+                J = np.load(filename, mmap_mode='r')
+            except (IOError, ValueError):
+                J = None
+            if J is not None and (J.shape != shape or J.dtype != np.complex64):
+                J = None
+        if J is None:
+            J = self.build(model, filename, shape)
+        # actuators are stored first, each batch of columns is contiguous
+        return np.moveaxis(J, 0, -1)
+
+    def build(self, model, filename, shape):
+        """
+        Computes all the columns into a temporary file, renamed when complete
+        """
+        os.makedirs(self.cacheDir, exist_ok=True)
+        tmpfile = filename[:-4] + '.tmp.npy'
+        J = np.lib.format.open_memmap(tmpfile, mode='w+', dtype=np.complex64, shape=shape)
+        del J
+        # batches of actuators of each DM, and their first column
+        batches, start = [], 0
+        for dm, (name, idx, numAct) in enumerate(model.actuators()):
+            for i in range(0, len(idx), self.batchSize):
+                batches.append((dm, idx[i:i + self.batchSize], start + i))
+            start += len(idx)
+        if self.maxWorkers > 1 and len(batches) > 1:
+            with concurrent.futures.ProcessPoolExecutor(min(self.maxWorkers, len(batches)),
+                    initializer=_initWorker, initargs=(model,)) as executor:
+                futures = [executor.submit(_computeColumns, tmpfile, *batch)
+                        for batch in batches]
+                for future in concurrent.futures.as_completed(futures):
+                    future.result()
+        else:
+            _initWorker(model)
+            for batch in batches:
+                _computeColumns(tmpfile, *batch)
+            _initWorker(None)
+        os.replace(tmpfile, filename)
+        return np.load(filename, mmap_mode='r')
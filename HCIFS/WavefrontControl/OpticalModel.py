@@ -0,0 +1,251 @@
+import json
+import hashlib
+import numpy as np
+import astropy.units as u
+import scipy.fft as fft
+
+class OpticalModel(object):
+    """
+    Fourier optics model of the coronagraph, from the entrance pupil to the
+    dark hole, used for the wavefront control Jacobian and for simulations.
+
+    The pupil plane is the plane of the first DM. The other DMs are out of
+    the pupil, at their distance to the first DM along the optical path, and
+    the field is propagated between them with the Fresnel transfer function
+    on a padded grid, then back to the pupil plane where the shaped pupil is
+    applied. The field in the dark hole is a matrix Fourier transform of the
+    pupil field, in units of lam0/D, normalized by the peak of the PSF without
+    focal plane mask: its squared modulus is the contrast.
+    """
+
+    def __init__(self, surfaces, names, distances, lams, pupilDiameter=None,
+            pupil=None, iwa=3., owa=10., sectors=None, samplesPerLamD=2., lam0=None,
+            flats=None):
+        """
+        Inputs:
+            surfaces - surface models of the DMs, see util.DMSurface (list)
+            names - names of the DMs (list)
+            distances - distance of each DM to the first DM in meters (list)
+            lams - wavelengths in meters (list)
+            pupilDiameter - diameter of the entrance pupil in meters, defaults
+                            to the DM actuator grid (num)
+            pupil - transmission of the shaped pupil, sampled like the DM
+                    surfaces (npix, npix), defaults to the entrance pupil (np array)
+            iwa, owa - inner and outer radius of the dark hole in lam0/D (num)
+            sectors - azimuthal sectors of the dark hole in degrees, e.g. the
+                      bowtie lobes of the focal plane mask (list of tuples)
+            samplesPerLamD - focal plane samples per lam0/D (num)
+            lam0 - central wavelength in meters, defaults to the mean of lams (num)
+            flats - commands of the flat DM surfaces, the reference of the
+                    commands of 'field', defaults to zero {DM name: commands} (dict)
+        """
+        self.surfaces = list(surfaces)
+        self.names = list(names)
+        self.distances = np.array(distances, dtype=float)
+        self.lams = np.atleast_1d(np.array(lams, dtype=float))
+        self.nlam = len(self.lams)
+        self.lam0 = float(np.mean(self.lams) if lam0 is None else lam0)
+        # all DM surfaces sample the pupil plane the same way
+        self.npix = self.surfaces[0].npix
+        self.dx = self.surfaces[0].dx
+        assert all(s.npix == self.npix and np.isclose(s.dx, self.dx)
+                for s in self.surfaces), "The DM surfaces must have the same sampling."
+        self.pupilDiameter = float(self.npix * self.dx if pupilDiameter is None
+                else pupilDiameter)
+        x = (np.arange(self.npix) - (self.npix - 1) / 2.) * self.dx
+        self.aperture = (x[:, None]**2 + x**2 <= (self.pupilDiameter / 2)**2).astype(float)
+        self.pupil = self.aperture if pupil is None else np.asarray(pupil, dtype=float)
+        assert self.pupil.shape == self.aperture.shape, "Pupil must be sampled like the DMs."
+        self.iwa, self.owa = float(iwa), float(owa)
+        self.sectors = None if sectors is None else [tuple(map(float, s)) for s in sectors]
+        self.samplesPerLamD = float(samplesPerLamD)
+        # padded grid of the Fresnel propagations (no wrapping of the field)
+        self.P = fft.next_fast_len(2 * self.npix)
+        self.p0 = (self.P - self.npix) // 2
+        # dark hole pixels of the focal plane grid
+        nf = int(np.ceil(self.owa * self.samplesPerLamD))
+        self.xf = np.arange(-nf, nf + 1) / self.samplesPerLamD      # lam0/D
+        (X, Y) = np.meshgrid(self.xf, self.xf)
+        r = np.hypot(X, Y)
+        darkHole = (r >= self.iwa) & (r <= self.owa)
+        if self.sectors is not None:
+            theta = np.degrees(np.arctan2(Y, X))
+            inSector = np.zeros_like(darkHole)
+            for (start, stop) in self.sectors:
+                inSector |= (theta - start) % 360 <= (stop - start) % 360
+            darkHole &= inSector
+        self.darkHole = np.flatnonzero(darkHole)
+        self.npixDH = len(self.darkHole)
+        self.mft = None
+        self.flats = dict() if flats is None else dict(flats)
+
+    @classmethod
+    def fromExperiment(cls, expt, mode='Imag', lams=None, nlam=None, **specs):
+        """
+        Builds the model of an Experiment: the DMs of its Devices list (sorted
+        by ID, the order of the Jacobian columns) with their surface models and
+        flat commands, their distances along the 'dist2prev_<mode>' path, the
+        wavelengths of the first source, and the bowtie sectors of the focal
+        plane mask
+        Inputs:
+            expt - the Experiment
+            mode - 'Imag' or 'Spec', the optical path (str)
+            lams - wavelengths in nm, defaults to the source (list)
+            nlam - number of wavelengths across the source bandwidth (int)
+            specs - other OpticalModel inputs
+        """
+        DMs = expt.getDMs()
+        assert DMs, "No DM in the Devices list."
+        (names, dist) = getattr(expt, 'dist2prev_' + mode)
+        # position of the devices along the optical path, in meters
+        position = dict(zip(names, np.cumsum(u.Quantity(dist, u.mm).to(u.m).value)))
+        assert all(dm.name in position for dm in DMs), "The DMs must be in dist2prev_%s."%mode
+        distances = [position[dm.name] - position[DMs[0].name] for dm in DMs]
+        if lams is None:
+            lams = [635.]
+            for dev in expt.Devices.values():
+                if getattr(dev, 'lam', None) is not None:
+                    lam = u.Quantity(dev.lam, u.nm).value
+                    bandwidth = u.Quantity(getattr(dev, 'bandwidth', 0), u.nm).value
+                    nlam = (3 if bandwidth > 0 else 1) if nlam is None else int(nlam)
+                    lams = lam + bandwidth * (np.arange(nlam) - (nlam - 1) / 2.) \
+                            / max(nlam - 1, 1)
+                    break
+        lams = np.atleast_1d(lams) * 1e-9
+        if 'sectors' not in specs:
+            for dev in expt.Devices.values():
+                if getattr(dev, 'sectors', None) is not None:
+                    specs['sectors'] = dev.sectors
+                    break
+        if 'flats' not in specs:
+            specs['flats'] = dict((dm.name, dm.flatCommand()) for dm in DMs)
+        # the DM surface models are built (and cached) by the DMs
+        surfaces = []
+        for dm in DMs:
+            dm.getSurface(np.zeros(dm.numAct))
+            surfaces.append(dm.surfaceModel)
+        return cls(surfaces, [dm.name for dm in DMs], distances, lams, **specs)
+
+    def config(self):
+        """
+        Returns the parameters the Jacobian depends on (dict)
+        """
+        return {'DMs': [dict(s.config(), gain=s.gain, deadAct=s.deadAct.tolist())
+                for s in self.surfaces], 'distances': self.distances.tolist(),
+                'lams': self.lams.tolist(), 'lam0': self.lam0,
+                'pupilDiameter': self.pupilDiameter,
+                'pupil': hashlib.sha1(np.ascontiguousarray(self.pupil).data).hexdigest(),
+                'iwa': self.iwa, 'owa': self.owa, 'sectors': self.sectors,
+                'samplesPerLamD': self.samplesPerLamD, 'version': 1}
+
+    def configID(self):
+        """
+        Returns a short hash of the configuration
+        """
+        text = json.dumps(self.config(), sort_keys=True)
+        return hashlib.sha1(text.encode()).hexdigest()[:16]
+
+    def actuators(self):
+        """
+        Returns the active actuators of each DM, without the dead ones, in the
+        format of WavefrontControl 'actuators'
+        """
+        return [(name, np.setdiff1d(np.arange(s.numAct), s.deadAct), s.numAct)
+                for name, s in zip(self.names, self.surfaces)]
+
+    def fourierMatrices(self):
+        """
+        Returns the matrix Fourier transforms, one per wavelength, from the
+        pupil samples to the focal plane samples, normalized by the PSF peak
+        """
+        if self.mft is None:
+            x = (np.arange(self.npix) - (self.npix - 1) / 2.) * self.dx / self.pupilDiameter
+            norm = np.sqrt(self.pupil.sum())
+            self.mft = [np.exp(-2j * np.pi * self.lam0 / lam * np.outer(self.xf, x)) / norm
+                    for lam in self.lams]
+        return self.mft
+
+    def toDarkHole(self, fields, k):
+        """
+        Dark hole field of pupil fields (N, npix, npix) at wavelength index k,
+        after the shaped pupil: (N, npixDH)
+        """
+        A = self.fourierMatrices()[k].astype(fields.dtype, copy=False)
+        focal = A @ (fields * self.pupil) @ A.T
+        return focal.reshape(len(fields), -1)[:, self.darkHole]
+
+    def propagate(self, fields, z, lam):
+        """
+        Fresnel propagation of padded fields (N, P, P) over a distance z, in
+        the precision of the fields
+        """
+        if z == 0:
+            return fields
+        f = fft.fftfreq(self.P, self.dx)
+        H = np.exp(-1j * np.pi * lam * z * (f[:, None]**2 + f**2)).astype(fields.dtype)
+        spectrum = fft.fft2(fields)
+        spectrum *= H
+        return fft.ifft2(spectrum, overwrite_x=True)
+
+    def pad(self, fields, dtype=complex):
+        """
+        Pads pupil fields (N, npix, npix) to the propagation grid (N, P, P)
+        """
+        padded = np.zeros((len(fields), self.P, self.P), dtype=dtype)
+        padded[:, self.p0:self.p0 + self.npix, self.p0:self.p0 + self.npix] = fields
+        return padded
+
+    def crop(self, fields):
+        return fields[:, self.p0:self.p0 + self.npix, self.p0:self.p0 + self.npix]
+
+    def field(self, commands):
+        """
+        Computes the dark hole field for DM commands, the surfaces being those
+        of the commands relative to the flat commands
+        Inputs:
+            commands - {DM name: actuator commands}, missing DMs are flat (dict)
+        Output:
+            E - complex dark hole field (npixDH,), or (nlam, npixDH) (np array)
+        """
+        heights = [s.surface(commands[name] - self.flats.get(name, 0))
+                if name in commands else None
+                for name, s in zip(self.names, self.surfaces)]
+        E = np.empty((self.nlam, self.npixDH), dtype=complex)
+        for k, lam in enumerate(self.lams):
+            fields = self.pad(self.aperture[np.newaxis])
+            z = 0.
+            for zk, h in zip(self.distances, heights):
+                fields = self.propagate(fields, zk - z, lam)
+                z = zk
+                if h is not None:
+                    fields[:, self.p0:self.p0 + self.npix, self.p0:self.p0 + self.npix] \
+                            *= np.exp(4j * np.pi / lam * h)
+            fields = self.propagate(fields, -z, lam)
+            E[k] = self.toDarkHole(self.crop(fields), k)[0]
+        return E[0] if self.nlam == 1 else E
+
+    def columns(self, dm, actuators):
+        """
+        Computes Jacobian columns, the dark hole field response to unit
+        commands of a batch of actuators of one DM, linearized around flat DMs,
+        in single precision like the stored Jacobian
+        Inputs:
+            dm - index of the DM (int)
+            actuators - indices of the actuators (np array)
+        Output:
+            J - columns (len(actuators), nlam, npixDH) (np array)
+        """
+        surface = self.surfaces[dm]
+        commands = np.zeros((len(actuators), surface.numAct))
+        commands[np.arange(len(actuators)), actuators] = 1.
+        pokes = surface.surface(commands)
+        z = self.distances[dm]
+        J = np.empty((len(actuators), self.nlam, self.npixDH), dtype=np.complex64)
+        for k, lam in enumerate(self.lams):
+            # field on the DM, a phase 4 pi h / lam to first order
+            incident = self.propagate(self.pad(self.aperture[np.newaxis]), z, lam)
+            fields = (self.crop(incident) * (4j * np.pi / lam)).astype(np.complex64) * pokes
+            if z != 0:
+                fields = self.crop(self.propagate(self.pad(fields, np.complex64), -z, lam))
+            J[:, k] = self.toDarkHole(fields, k)
+        return J
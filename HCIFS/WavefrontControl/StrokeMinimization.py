@@ -1,5 +1,116 @@
 from HCIFS.WavefrontControl.WavefrontControl import WavefrontControl
+from collections import OrderedDict
+import numpy as np
+import scipy.linalg as sla
 
 class StrokeMinimization(WavefrontControl):
-    
-    pass
\ No newline at end of file
+    """
+    Stroke Minimization (Pueyo et al. 2009): the command update minimizes the
+    DM stroke |du|^2 subject to a predicted dark hole contrast |E + G du|^2
+    below a target, a fraction 'gamma' of the current contrast. For a Lagrange
+    multiplier mu, the solution is du = -(G^T G + I/mu)^-1 G^T e, and mu is
+    searched until the predicted contrast reaches the target.
+
+    The Gram matrix G^T G is computed once, G^T e once per iteration, and the
+    Cholesky factors of G^T G + I/mu are cached for the multipliers of a
+    logarithmic grid: each trial of the search is two triangular solves, and
+    the search starts from the multiplier of the previous iteration.
+    """
+
+    def __init__(self, jacobian, actuators, gamma=0.8, logMu=0., muStep=0.5,
+            logMuRange=(-4., 10.), gain=0.5, maxFactors=8, **specs):
+        """
+        Inputs:
+            jacobian, actuators - see WavefrontControl
+            gamma - target contrast relative to the current contrast (num)
+            logMu - initial log10 of mu, relative to 1 / mean diagonal of G^T G (num)
+            muStep - step of the mu grid in decades (num)
+            logMuRange - smallest and largest log10 of the relative mu (tuple)
+            gain - loop gain applied to the command updates (num)
+            maxFactors - number of Cholesky factors kept in memory (int)
+        """
+        assert 0 < gamma < 1, "gamma must be between 0 and 1."
+        self.gamma = float(gamma)
+        self.muStep = float(muStep)
+        self.logMuRange = tuple(float(x) for x in logMuRange)
+        self.k = int(round(float(logMu) / self.muStep))
+        self.gain = float(gain)
+        self.maxFactors = int(maxFactors)
+        super().__init__(jacobian, actuators, **specs)
+
+    def jacobianChanged(self):
+        self.GtG = None
+        self.factors = OrderedDict()
+
+    def gram(self):
+        """
+        Returns the Gram matrix G^T G (float64), computed once per Jacobian
+        """
+        if self.GtG is None:
+            G = self.G.astype(np.float64)
+            self.GtG = G.T @ G
+            self.scale = np.trace(self.GtG) / self.numAct
+        return self.GtG
+
+    def logMu(self, k=None):
+        """
+        Returns log10 of the relative mu of a grid index, by default the current one
+        """
+        return (self.k if k is None else k) * self.muStep
+
+    def factor(self, k):
+        """
+        Returns the Cholesky factor of G^T G + I/mu for the grid index k
+        """
+        if k in self.factors:
+            self.factors.move_to_end(k)
+            return self.factors[k]
+        A = self.gram().copy()
+        A[np.diag_indices_from(A)] += self.scale * 10.**(-self.logMu(k))
+        self.factors[k] = sla.cho_factor(A, lower=True, overwrite_a=True, check_finite=False)
+        if len(self.factors) > self.maxFactors:
+            self.factors.popitem(last=False)
+        return self.factors[k]
+
+    def solve(self, k, Gte, e2):
+        """
+        Returns the update of the grid index k and its predicted contrast,
+        |e|^2 + 2 du.G^T e + du.G^T G du, per pixel and wavelength
+        """
+        du = -sla.cho_solve(self.factor(k), Gte, check_finite=False)
+        contrast = (e2 + 2 * du @ Gte + du @ (self.GtG @ du)) / (self.nlam * self.npix)
+        return du, contrast
+
+    def computeCommand(self, E, target=None):
+        """
+        Returns the command update of the active actuators
+        Inputs:
+            E - complex field of the dark hole pixels (npix,) or (nlam, npix) (np array)
+            target - predicted contrast to reach, defaults to gamma times the
+                     contrast of E (num)
+        """
+        e = self.fieldVector(E).astype(np.float64)
+        e2 = e @ e
+        Gte = self.G.T @ e.astype(self.dtype)
+        Gte = Gte.astype(np.float64)
+        self.gram()
+        target = self.gamma * e2 / (self.nlam * self.npix) if target is None else target
+        (kmin, kmax) = (int(np.ceil(self.logMuRange[0] / self.muStep)),
+                int(np.floor(self.logMuRange[1] / self.muStep)))
+        k = min(max(self.k, kmin), kmax)
+        # warm start: smallest mu of the grid reaching the target, searched
+        # from the mu of the previous iteration
+        du, contrast = self.solve(k, Gte, e2)
+        if contrast > target:
+            while contrast > target and k < kmax:
+                k += 1
+                du, contrast = self.solve(k, Gte, e2)
+        else:
+            while k > kmin:
+                du1, contrast1 = self.solve(k - 1, Gte, e2)
+                if contrast1 > target:
+                    break
+                k, du, contrast = k - 1, du1, contrast1
+        self.k = k
+        self.predictedContrast = contrast
+        return self.gain * du
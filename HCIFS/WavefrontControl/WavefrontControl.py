@@ -1,3 +1,138 @@
-class WavefrontControl(object):
-    
-    pass
\ No newline at end of file
+import numpy as np
+import abc
+
+class WavefrontControl(abc.ABC):
+    """
+    Base class of the focal plane wavefront controllers. A controller uses the
+    Jacobian of the dark hole electric field with respect to the DM actuators
+    to compute, from a field estimate, the DM command updates of the next
+    iteration.
+
+    The complex Jacobian (npix, numAct), or (nlam, npix, numAct) for a batch of
+    wavelengths, is stored as a real float32 matrix, stacking the real and
+    imaginary parts of each wavelength: real actuator commands act on both
+    quadratures of the field. Its columns are the active actuators of all DMs,
+    in the order of 'actuators'.
+    """
+
+    def __init__(self, jacobian, actuators, weights=None, dtype='float32', **specs):
+        """
+        Inputs:
+            jacobian - complex Jacobian (npix, numAct) or (nlam, npix, numAct) (np array)
+            actuators - list of (DM name, active actuator indices, number of DM
+                        actuators), in the order of the Jacobian columns (list)
+            weights - relative weight of each wavelength (list)
+            dtype - storage dtype of the real Jacobian (str)
+        """
+        self.actuators = [(name, np.asarray(idx, dtype=int), int(numAct))
+                for name, idx, numAct in actuators]
+        self.numAct = sum(len(idx) for name, idx, numAct in self.actuators)
+        self.dtype = np.dtype(dtype)
+        self.iteration = 0
+        self.setJacobian(jacobian, weights)
+
+    @staticmethod
+    def actuatorsOf(DMs):
+        """
+        Returns the 'actuators' list of DM devices: their active actuators,
+        without the dead ones (deadAct)
+        Inputs:
+            DMs - DM devices, in the order of the Jacobian columns (list)
+        """
+        return [(dm.name, np.setdiff1d(np.arange(dm.numAct), dm.deadAct), dm.numAct)
+                for dm in DMs]
+
+    def setJacobian(self, jacobian, weights=None):
+        """
+        Stores the real/imaginary stacked Jacobian, weighted per wavelength
+        """
+        J = np.asarray(jacobian)
+        J = J[np.newaxis] if J.ndim == 2 else J
+        (self.nlam, self.npix, numAct) = J.shape
+        assert numAct == self.numAct, "The Jacobian must have one column per active actuator."
+        weights = np.ones(self.nlam) if weights is None else np.asarray(weights, dtype=float)
+        assert weights.shape == (self.nlam,), "One weight per wavelength."
+        self.sqrtWeights = np.sqrt(weights / weights.sum() * self.nlam)
+        G = np.empty((self.nlam, 2, self.npix, self.numAct), dtype=self.dtype)
+        G[:, 0] = J.real * self.sqrtWeights[:, None, None]
+        G[:, 1] = J.imag * self.sqrtWeights[:, None, None]
+        self.G = G.reshape(-1, self.numAct)
+        self.jacobianChanged()
+
+    def jacobianChanged(self):
+        """
+        Called when the Jacobian changes, to reset the cached factorizations
+        """
+        pass
+
+    def fieldVector(self, E):
+        """
+        Stacks the real and imaginary parts of a field estimate like the Jacobian
+        Inputs:
+            E - complex field of the dark hole pixels (npix,) or (nlam, npix) (np array)
+        """
+        E = np.asarray(E).reshape(self.nlam, 1, self.npix)
+        e = np.concatenate((E.real, E.imag), axis=1) * self.sqrtWeights[:, None, None]
+        return e.astype(self.dtype).ravel()
+
+    @abc.abstractmethod
+    def computeCommand(self, E, **kwargs):
+        """
+        Returns the command update of the active actuators (numAct,),
+        implemented by the controllers
+        """
+
+    def splitCommand(self, delta):
+        """
+        Splits a command update of the active actuators into full command
+        updates of each DM, with zeros on the dead actuators
+        Output:
+            commands - {DM name: command update (DM numAct,)} (dict)
+        """
+        commands, start = dict(), 0
+        for name, idx, numAct in self.actuators:
+            commands[name] = np.zeros(numAct)
+            commands[name][idx] = delta[start:start + len(idx)]
+            start += len(idx)
+        return commands
+
+    def step(self, E, **kwargs):
+        """
+        Computes the DM command updates of one iteration from a field estimate
+        Inputs:
+            E - complex field of the dark hole pixels (npix,) or (nlam, npix) (np array)
+        Output:
+            commands - {DM name: command update} (dict)
+        """
+        delta = self.computeCommand(E, **kwargs)
+        self.iteration += 1
+        return self.splitCommand(delta)
+
+    @staticmethod
+    def pairwiseEstimate(deltaI, probeFields, rcond=0.1):
+        """
+        Estimates the field from pairwise probe images (Give'on et al. 2011):
+        I(+p) - I(-p) = 4 Re(conj(E) dE) for each probe p of modelled field dE,
+        solved per pixel by regularized least squares. Pixels where the probe
+        fields are zero or collinear (e.g. a single probe) get the minimum
+        norm estimate instead of a singular solve, and the regularization
+        damps the pixels where the modelled probe fields, linearized around
+        flat DMs, are least reliable.
+        Inputs:
+            deltaI - intensity differences I(+p) - I(-p) (nProbes, npix) (np array)
+            probeFields - modelled probe fields dE (nProbes, npix) (np array)
+            rcond - regularization relative to the probe field intensity (num)
+        Output:
+            E - the field estimate (npix,) (np array)
+        """
+        H = 4 * np.stack((probeFields.real, probeFields.imag), axis=-1).transpose(1, 0, 2)
+        HtH = H.transpose(0, 2, 1) @ H                          # (npix, 2, 2)
+        Htd = (H.transpose(0, 2, 1) @ deltaI.T[:, :, None])[:, :, 0]
+        # Tikhonov term scaled per pixel, and explicit inverse of the 2x2 systems
+        eps = rcond * (HtH[:, 0, 0] + HtH[:, 1, 1]) / 2
+        (a, b, d) = (HtH[:, 0, 0] + eps, HtH[:, 0, 1], HtH[:, 1, 1] + eps)
+        det = a * d - b * b
+        det[det <= 0] = np.inf                                  # no probe signal
+        x = (d * Htd[:, 0] - b * Htd[:, 1]) / det
+        y = (a * Htd[:, 1] - b * Htd[:, 0]) / det
+        return x + 1j * y
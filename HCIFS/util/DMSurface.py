@@ -0,0 +1,220 @@
+import os.path
+import json
+import hashlib
+import numpy as np
+import scipy.sparse as sparse
+from scipy.fft import next_fast_len
+
+# influence function models, by 'DMmodel' spec
+MODELS = ['influencingFunction']
+
+# operators already built or loaded in this process, by config ID
+_operators = dict()
+
+
+class DMSurface(object):
+    """
+    Surface model of a deformable mirror with actuators on a square grid,
+    inside a circle (BM1k: 952 actuators of a 34x34 grid). Each actuator has a
+    Gaussian influence function, set by the coupling to its nearest neighbours.
+
+    The actuator-to-surface operator is a sparse (npix*npix, numAct) matrix,
+    built once per DM geometry and pupil sampling, and cached on disk as a
+    scipy.sparse *.npz file named after the hash of the configuration.
+    Surfaces of batches of commands are one sparse-dense product, or an FFT
+    convolution of the commands with the influence function.
+    """
+
+    def __init__(self, gridSize=34, numAct=952, pitch=286.05e-6, npix=256,
+            coupling=0.15, support=3., gain=1., deadAct=[],
+            cacheDir='~/.HCIFS/DMSurface', model='influencingFunction'):
+        """
+        Constructor for the 'DMSurface' class
+        Inputs:
+            gridSize - number of actuators across the grid (int)
+            numAct - number of actuators inside the circular aperture (int)
+            pitch - actuator pitch in meters (num)
+            npix - number of surface samples across the grid (int)
+            coupling - influence of an actuator at the nearest actuators (num)
+            support - radius of the influence functions, in pitches (num)
+            gain - surface per unit of command, e.g. meters per volt (num)
+            deadAct - indices of the dead actuators, with no influence (list)
+            cacheDir - directory of the operator cache, no disk cache if None (str)
+            model - influence function model (str)
+        """
+        assert model in MODELS, "DM model must be one of %s."%MODELS
+        assert 0 < coupling < 1, "coupling must be between 0 and 1."
+        self.gridSize = int(gridSize)
+        self.pitch = float(pitch)
+        self.npix = int(npix)
+        self.coupling = float(coupling)
+        self.support = float(support)
+        self.gain = float(gain)
+        self.model = model
+        self.deadAct = np.array(deadAct, dtype=int)
+        self.cacheDir = None if cacheDir is None else \
+                os.path.normpath(os.path.expandvars(os.path.expanduser(cacheDir)))
+        # actuator grid indices inside the circle, row by row
+        self.iy, self.ix = self.actuatorGrid()
+        self.numAct = len(self.ix)
+        assert self.numAct == int(numAct), "%d actuators inside the circle, not %d."%(
+                self.numAct, numAct)
+        # Gaussian width giving the coupling at one pitch, and surface sampling
+        self.sigma = self.pitch / np.sqrt(-2 * np.log(self.coupling))
+        self.dx = self.gridSize * self.pitch / self.npix
+        self.operator = None
+
+    def __getstate__(self):
+        # the operator is not pickled, e.g. to worker processes: it is loaded
+        # again from the disk cache on first use
+        state = self.__dict__.copy()
+        state['operator'] = None
+        return state
+
+    def actuatorGrid(self):
+        """
+        Returns the (row, column) grid indices of the actuators whose center is
+        inside the circle of radius (gridSize+1)/2 pitches (952 of 34x34)
+        """
+        c = np.arange(self.gridSize) - (self.gridSize - 1) / 2.
+        (x, y) = np.meshgrid(c, c)
+        return np.nonzero(x**2 + y**2 <= ((self.gridSize + 1) / 2.)**2)
+
+    def positions(self):
+        """
+        Returns the (x, y) positions of the actuators in meters, from the
+        center of the grid
+        """
+        c = (np.arange(self.gridSize) - (self.gridSize - 1) / 2.) * self.pitch
+        return c[self.ix], c[self.iy]
+
+    def coordinates(self):
+        """
+        Returns the 1D coordinates of the surface samples in meters
+        """
+        return (np.arange(self.npix) - (self.npix - 1) / 2.) * self.dx
+
+    def config(self):
+        """
+        Returns the parameters the operator depends on (dict)
+        """
+        return {'model': self.model, 'gridSize': self.gridSize, 'numAct': self.numAct,
+                'pitch': self.pitch, 'npix': self.npix, 'coupling': self.coupling,
+                'support': self.support, 'version': 1}
+
+    def configID(self):
+        """
+        Returns a short hash of the configuration
+        """
+        text = json.dumps(self.config(), sort_keys=True)
+        return hashlib.sha1(text.encode()).hexdigest()[:16]
+
+    def getOperator(self):
+        """
+        Returns the sparse actuator-to-surface operator (csr matrix) for unit
+        gain, from memory, from the disk cache, or built and cached
+        """
+        if self.operator is not None:
+            return self.operator
+        ID = self.configID()
+        operator = _operators.get(ID)
+        cachefile = None if self.cacheDir is None else \
+                os.path.join(self.cacheDir, 'DMSurface_%s.npz'%ID)
+        if operator is None and cachefile is not None and os.path.isfile(cachefile):
+            try:
+                operator = sparse.load_npz(cachefile).tocsr()
+            except (IOError, ValueError):
+                operator = None
+        if operator is None:
+            operator = self.buildOperator()
+            if cachefile is not None:
+                os.makedirs(self.cacheDir, exist_ok=True)
+                tmpfile = cachefile[:-4] + '.tmp.npz'
+                sparse.save_npz(tmpfile, operator)
+                os.replace(tmpfile, cachefile)
+        _operators[ID] = operator
+        self.operator = operator
+        return operator
+
+    def buildOperator(self):
+        """
+        Builds the sparse operator from the influence functions sampled in a
+        window of radius 'support' pitches around each actuator
+        """
+        xp = self.coordinates()
+        (xa, ya) = self.positions()
+        w = int(np.ceil(self.support * self.pitch / self.dx))
+        offsets = np.arange(-w, w + 1)
+        # pixel windows around the actuator centers
+        icx = np.rint(xa / self.dx + (self.npix - 1) / 2.).astype(int)
+        icy = np.rint(ya / self.dx + (self.npix - 1) / 2.).astype(int)
+        px = icx[:, None] + offsets                         # (numAct, 2w+1)
+        py = icy[:, None] + offsets
+        dxa = xp[np.clip(px, 0, self.npix - 1)] - xa[:, None]
+        dya = xp[np.clip(py, 0, self.npix - 1)] - ya[:, None]
+        # separable Gaussian, truncated to a disk of radius support
+        r2 = dya[:, :, None]**2 + dxa[:, None, :]**2        # (numAct, 2w+1, 2w+1)
+        values = np.exp(-r2 / (2 * self.sigma**2))
+        keep = (r2 <= (self.support * self.pitch)**2) \
+                & ((py >= 0) & (py < self.npix))[:, :, None] \
+                & ((px >= 0) & (px < self.npix))[:, None, :]
+        rows = py[:, :, None] * self.npix + px[:, None, :]
+        cols = np.broadcast_to(np.arange(self.numAct)[:, None, None], rows.shape)
+        operator = sparse.csr_matrix((values[keep], (rows[keep], cols[keep])),
+                shape=(self.npix**2, self.numAct))
+        return operator
+
+    def surface(self, commands, method='sparse'):
+        """
+        Computes the DM surfaces of one or several command vectors
+        Inputs:
+            commands - actuator commands (numAct,) or a batch (N, numAct) (np array)
+            method - 'sparse' (sparse-dense product) or 'fft' (FFT convolution
+                     with the untruncated influence function)
+        Output:
+            surface - surface (npix, npix) or surfaces (N, npix, npix) (np array)
+        """
+        commands = np.asarray(commands, dtype=np.float64)
+        single = commands.ndim == 1
+        commands = np.atleast_2d(commands)[:, :self.numAct] * self.gain
+        assert commands.shape[1] == self.numAct, "Commands must have numAct values."
+        if self.deadAct.size:
+            commands = commands.copy()
+            commands[:, self.deadAct] = 0
+        if method == 'sparse':
+            surfaces = (self.getOperator() @ commands.T).T
+        elif method == 'fft':
+            surfaces = self.fftSurface(commands)
+        else:
+            raise ValueError("method must be 'sparse' or 'fft'.")
+        surfaces = surfaces.reshape(-1, self.npix, self.npix)
+        return surfaces[0] if single else surfaces
+
+    def fftSurface(self, commands):
+        """
+        Surfaces of a batch of commands (N, numAct) by FFT convolution: the
+        commands on the actuator grid are Fourier transformed with two matrix
+        products (exact actuator positions), multiplied by the transfer
+        function of the Gaussian, and transformed back on a grid padded by the
+        influence support to avoid wrapping.
+        """
+        N = len(commands)
+        w = int(np.ceil(self.support * self.pitch / self.dx))
+        P = next_fast_len(self.npix + 2 * w)
+        p0 = (P - self.npix) // 2
+        fy = np.fft.fftfreq(P, self.dx)
+        fx = np.fft.rfftfreq(P, self.dx)                       # real surfaces
+        # actuator grid positions, relative to the first pixel of the padded grid
+        c = (np.arange(self.gridSize) - (self.gridSize - 1) / 2.) * self.pitch \
+                + (p0 + (self.npix - 1) / 2.) * self.dx
+        Ey = np.exp(-2j * np.pi * fy[:, None] * c)             # (P, gridSize)
+        Ex = np.exp(-2j * np.pi * fx[:, None] * c)             # (P//2+1, gridSize)
+        grid = np.zeros((N, self.gridSize, self.gridSize))
+        grid[:, self.iy, self.ix] = commands
+        spectrum = Ey @ grid @ Ex.T                             # (N, P, P//2+1)
+        # transfer function of the Gaussian, per sample area
+        f2 = fy[:, None]**2 + fx**2
+        spectrum *= 2 * np.pi * self.sigma**2 / self.dx**2 * np.exp(
+                -2 * np.pi**2 * self.sigma**2 * f2)
+        surfaces = np.fft.irfft2(spectrum, s=(P, P))
+        return surfaces[:, p0:p0 + self.npix, p0:p0 + self.npix]
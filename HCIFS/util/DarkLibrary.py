@@ -0,0 +1,202 @@
+import os.path
+import json
+import hashlib
+import threading
+import atexit
+import time
+import numpy as np
+
+
+class DarkLibrary(object):
+    """
+    A library of dark images stored on disk as *.npy files, loaded as read-only
+    memory maps. Darks are keyed by a camera configuration (serial, binning, 
+    originPix, imgSize, readout speed, CCD temperature) and an exposure time.
+    The least recently used darks are evicted once the library exceeds maxBytes.
+    
+    A file is never written over: a new dark gets a new file, named after its
+    checksum, since the previous one may still be memory-mapped (which locks
+    it on Windows). Files that could not be removed are removed later.
+    """
+    
+    def __init__(self, path, maxBytes=2e9, expTol=0.2):
+        """
+        Constructor for the 'DarkLibrary' class
+        Inputs:
+            path - directory of the library, created if needed (str)
+            maxBytes - maximum size of the library on disk in bytes (num)
+            expTol - relative exposure time difference allowed to reuse or 
+                     interpolate darks taken at other exposure times (num)
+        """
+        self.path = os.path.normpath(os.path.expandvars(os.path.expanduser(path)))
+        os.makedirs(self.path, exist_ok=True)
+        self.maxBytes = float(maxBytes)
+        self.expTol = float(expTol)
+        self.lock = threading.RLock()
+        # index of the darks: file name -> config ID, exposure time, size, last use
+        self.indexfile = os.path.join(self.path, 'index.json')
+        try:
+            self.index = json.loads(open(self.indexfile).read())
+        except (IOError, ValueError):
+            self.index = dict()
+        self.removeStale()
+        # last uses are updated in memory by 'get', and written with the index
+        # by put, evict, clear and close (also called at exit)
+        self.dirty = False
+        atexit.register(self.close)
+    
+    def configID(self, config):
+        """
+        Returns a short hash of a camera configuration (dict)
+        """
+        text = json.dumps(config, sort_keys=True, default=str)
+        return hashlib.sha1(text.encode()).hexdigest()[:16]
+    
+    def removeStale(self):
+        """
+        Removes, best-effort, the dark files no longer in the index
+        """
+        for filename in os.listdir(self.path):
+            if filename.endswith('.npy') and filename not in self.index:
+                self.remove(filename)
+    
+    def remove(self, filename):
+        """
+        Removes a dark file, unless it is still memory-mapped on Windows
+        """
+        try:
+            os.remove(os.path.join(self.path, filename))
+        except OSError:
+            pass
+    
+    def save(self):
+        """
+        Writes the index of the library on disk
+        """
+        tmpfile = self.indexfile + '.tmp'
+        with open(tmpfile, 'w') as f:
+            f.write(json.dumps(self.index, indent=1))
+        os.replace(tmpfile, self.indexfile)
+        self.dirty = False
+    
+    def close(self):
+        """
+        Writes the index if last uses changed since it was last written
+        """
+        with self.lock:
+            if self.dirty:
+                self.save()
+    
+    def load(self, filename):
+        """
+        Loads a dark as a read-only memory map, and updates its last use in memory
+        """
+        self.index[filename]['lastUsed'] = time.time()
+        self.dirty = True
+        return np.load(os.path.join(self.path, filename), mmap_mode='r')
+    
+    @staticmethod
+    def distance(t, expTime):
+        """
+        Exposure time distance |log(t/expTime)|, infinite between a zero 
+        exposure time (bias frame) and a non-zero one
+        """
+        if t == expTime:
+            return 0.
+        if t <= 0 or expTime <= 0:
+            return np.inf
+        return abs(np.log(t / expTime))
+    
+    def get(self, config, expTime):
+        """
+        Gets the dark of a camera configuration for an exposure time.
+        
+        Returns the stored dark if the exposure time matches. Otherwise, if the
+        nearest stored exposure time is within expTol, the dark is linearly 
+        interpolated (or extrapolated) in exposure time from the two nearest 
+        darks, bias plus dark current, if the second one is also within expTol,
+        or reused as is. A zero exposure time (bias) only matches a bias.
+        
+        Inputs:
+            config - camera configuration (dict)
+            expTime - exposure time in seconds (num)
+        Output:
+            dark - the dark image, or None if not in the library (np array)
+        """
+        ID = self.configID(config)
+        tol = np.log(1 + self.expTol)
+        with self.lock:
+            entries = sorted((self.distance(entry['expTime'], expTime), filename) \
+                    for filename, entry in self.index.items() if entry['config'] == ID \
+                    and os.path.isfile(os.path.join(self.path, filename)))
+            entries = [(d, filename) for d, filename in entries if d <= tol]
+            if not entries:
+                return None
+            dark = self.load(entries[0][1])
+            t1 = self.index[entries[0][1]]['expTime']
+            if entries[0][0] > 0 and len(entries) > 1:
+                dark2 = self.load(entries[1][1])
+                t2 = self.index[entries[1][1]]['expTime']
+                dark = dark + (dark2 - dark) * ((expTime - t1) / (t2 - t1))
+            
+            return dark
+    
+    def put(self, config, expTime, dark):
+        """
+        Stores a dark in the library, then evicts the least recently used darks
+        if the library is larger than maxBytes.
+        
+        Inputs:
+            config - camera configuration (dict)
+            expTime - exposure time in seconds (num)
+            dark - the dark image (np array)
+        """
+        ID = self.configID(config)
+        dark = np.ascontiguousarray(dark)
+        checksum = hashlib.sha1(dark.data).hexdigest()[:8]
+        filename = '%s_%.6g_%s.npy'%(ID, expTime, checksum)
+        with self.lock:
+            # the dark it replaces is removed, the same dark is not written again
+            for old in [f for f, entry in self.index.items() if f != filename \
+                    and entry['config'] == ID and entry['expTime'] == float(expTime)]:
+                del self.index[old]
+                self.remove(old)
+            if not os.path.isfile(os.path.join(self.path, filename)):
+                tmpfile = os.path.join(self.path, filename[:-4] + '.tmp.npy')
+                np.save(tmpfile, dark)
+                os.replace(tmpfile, os.path.join(self.path, filename))
+            self.index[filename] = {'config': ID, 'expTime': float(expTime), 
+                    'nbytes': int(np.asarray(dark).nbytes), 'lastUsed': time.time(),
+                    'camera': json.loads(json.dumps(config, default=str))}
+            self.dirty = True
+            self.evict(keep=filename)
+    
+    def evict(self, keep=None):
+        """
+        Removes the least recently used darks until the library fits in 
+        maxBytes, and writes the index
+        """
+        with self.lock:
+            lru = sorted(self.index, key=lambda filename: self.index[filename]['lastUsed'])
+            total = sum(entry['nbytes'] for entry in self.index.values())
+            for filename in lru:
+                if total <= self.maxBytes:
+                    break
+                if filename == keep:
+                    continue
+                total -= self.index.pop(filename)['nbytes']
+                self.dirty = True
+                self.remove(filename)
+            self.close()
+    
+    def clear(self):
+        """
+        Removes all darks from the library
+        """
+        with self.lock:
+            maxBytes, self.maxBytes = self.maxBytes, -1
+            self.evict()
+            self.maxBytes = maxBytes
+    
+    def __len__(self):
+        return len(self.index)
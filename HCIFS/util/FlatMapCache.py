@@ -0,0 +1,188 @@
+import os.path
+import json
+import hashlib
+import threading
+import time
+import numpy as np
+
+
+class FlatMapCache(object):
+    """
+    A cache of DM flat maps stored on disk as *.npy files, loaded as read-only
+    memory maps. Flat maps are parsed once from the BMC voltage text files, and
+    several versions (e.g. calibrated flats) can be stored per DM serial. Each
+    file is validated against the SHA-1 checksum recorded in the index, and
+    parsed again if its text source changed.
+
+    The file names include the checksum, so that a new flat map never
+    replaces a file that may still be memory-mapped (which locks it on
+    Windows). Files that could not be removed are removed later.
+    """
+
+    def __init__(self, path):
+        """
+        Constructor for the 'FlatMapCache' class
+        Inputs:
+            path - directory of the cache, created if needed (str)
+        """
+        self.path = os.path.normpath(os.path.expandvars(os.path.expanduser(path)))
+        os.makedirs(self.path, exist_ok=True)
+        self.lock = threading.RLock()
+        # index of the flat maps: serial -> version -> file, checksum, source
+        self.indexfile = os.path.join(self.path, 'index.json')
+        try:
+            self.index = json.loads(open(self.indexfile).read())
+        except (IOError, ValueError):
+            self.index = dict()
+        self.removeStale()
+
+    def removeStale(self):
+        """
+        Removes, best-effort, the flat map files no longer in the index
+        """
+        files = set(entry['file'] for entries in self.index.values()
+                for entry in entries.values())
+        for filename in os.listdir(self.path):
+            if filename.endswith('.npy') and filename not in files:
+                self.deleteFile(filename)
+
+    def deleteFile(self, filename):
+        """
+        Removes a flat map file, unless it is still memory-mapped on Windows
+        """
+        try:
+            os.remove(os.path.join(self.path, filename))
+        except OSError:
+            pass
+
+    def save(self):
+        """
+        Writes the index of the cache on disk
+        """
+        tmpfile = self.indexfile + '.tmp'
+        with open(tmpfile, 'w') as f:
+            f.write(json.dumps(self.index, indent=1))
+        os.replace(tmpfile, self.indexfile)
+
+    @staticmethod
+    def checksum(flatMap):
+        """
+        Returns the SHA-1 checksum of the float64 values of a flat map
+        """
+        data = np.ascontiguousarray(flatMap, dtype=np.float64)
+        return hashlib.sha1(data.tobytes()).hexdigest()
+
+    @staticmethod
+    def sourceStamp(source):
+        """
+        Returns the size and modification time of a text source, or None
+        """
+        try:
+            stat = os.stat(source)
+        except (OSError, TypeError):
+            return None
+        return [stat.st_size, stat.st_mtime]
+
+    def versions(self, serial):
+        """
+        Returns the versions stored for a DM serial, oldest first
+        """
+        with self.lock:
+            entries = self.index.get(serial, {})
+            return sorted(entries, key=lambda version: entries[version]['created'])
+
+    def load(self, serial, version):
+        """
+        Loads a stored flat map as a read-only memory map, after checking its
+        checksum. Returns None if the file is missing or corrupted.
+        """
+        with self.lock:
+            entry = self.index.get(serial, {}).get(version)
+            if entry is None:
+                return None
+            try:
+                flatMap = np.load(os.path.join(self.path, entry['file']), mmap_mode='r')
+            except (IOError, ValueError):
+                return None
+            if self.checksum(flatMap) != entry['sha1']:
+                return None
+            return flatMap
+
+    def put(self, serial, version, flatMap, source=None):
+        """
+        Stores a flat map, replacing the same version if any
+        Inputs:
+            serial - the DM serial number (str)
+            version - name of the flat map version (str)
+            flatMap - actuator voltages (np array)
+            source - text file the flat map was parsed from, if any (str)
+        Output:
+            flatMap - the stored flat map, as a read-only memory map (np array)
+        """
+        flatMap = np.ascontiguousarray(flatMap, dtype=np.float64)
+        name = hashlib.sha1(('%s/%s'%(serial, version)).encode()).hexdigest()[:16]
+        sha1 = self.checksum(flatMap)
+        filename = '%s_%s.npy'%(name, sha1[:8])
+        with self.lock:
+            old = self.index.get(serial, {}).get(version)
+            # the same flat map is not written again, and is still valid
+            if old is None or old['file'] != filename or self.load(serial, version) is None:
+                tmpfile = os.path.join(self.path, name + '.tmp.npy')
+                np.save(tmpfile, flatMap)
+                os.replace(tmpfile, os.path.join(self.path, filename))
+            self.index.setdefault(serial, {})[version] = {'file': filename,
+                    'sha1': sha1, 'numAct': int(flatMap.size),
+                    'source': source, 'sourceStamp': self.sourceStamp(source),
+                    'created': time.time()}
+            self.save()
+            if old is not None and old['file'] != filename:
+                self.deleteFile(old['file'])
+            return self.load(serial, version)
+
+    def get(self, serial, version=None, source=None):
+        """
+        Gets a flat map of a DM. The stored version is used if its checksum is
+        valid and its text source did not change, otherwise the source is
+        parsed (np.loadtxt) and stored.
+
+        Inputs:
+            serial - the DM serial number (str)
+            version - name of the flat map version, defaults to the name of the
+                      source file, or to the latest stored version (str)
+            source - BMC voltage text file of the flat map (str)
+        Output:
+            flatMap - the flat map, as a read-only memory map (np array)
+        """
+        if version is None:
+            if source is not None:
+                version = os.path.splitext(os.path.basename(source))[0]
+            elif self.versions(serial):
+                version = self.versions(serial)[-1]
+            else:
+                raise Exception("No flat map stored for DM '%s'."%serial)
+        with self.lock:
+            entry = self.index.get(serial, {}).get(version)
+            flatMap = self.load(serial, version)
+            # a source that changed on disk is parsed again, a missing one is not
+            stamp = self.sourceStamp(source)
+            stale = entry is not None and stamp is not None and entry['sourceStamp'] != stamp
+            if flatMap is not None and not stale:
+                return flatMap
+            if source is None:
+                source = entry['source'] if entry is not None else None
+            if source is None or not os.path.isfile(source):
+                if entry is not None:
+                    raise Exception("Flat map '%s' of DM '%s' is missing or corrupted, "
+                            "and has no text source."%(version, serial))
+                raise Exception("Flat map '%s' of DM '%s' not found."%(version, serial))
+            return self.put(serial, version, np.loadtxt(source), source)
+
+    def remove(self, serial, version):
+        """
+        Removes a flat map version from the cache
+        """
+        with self.lock:
+            entry = self.index.get(serial, {}).pop(version, None)
+            if entry is not None:
+                self.deleteFile(entry['file'])
+                self.save()
@@ -1,4 +1,56 @@
 import time
+import itertools
+import numpy as np
+
+
+def array_from_com(data, dtype='int32', out=None, shape=None):
+    """
+    Converts an image returned by a COM/ActiveX property (e.g. 'ImageArray') 
+    into a contiguous 2D numpy array of known dtype, without going through the
+    element-by-element conversion of np.array on nested tuples.
+    
+    Inputs:
+        data - the image: numpy array, object exposing the buffer protocol
+               (SAFEARRAY wrappers, array.array, ...), or nested tuples (rows)
+        dtype - the dtype of the returned array (numpy dtype)
+        out - optional preallocated output array, filled in place (np array)
+        shape - shape of the image, needed for flat (1D) buffers, defaults 
+                to the shape of 'out' (tuple len. 2)
+    Output:
+        img - the image, with shape (len(data), len(data[0])) (np array)
+    """
+    dtype = np.dtype(dtype)
+    # fast path: numpy arrays, and objects exposing their memory (no copy)
+    try:
+        img = np.asarray(memoryview(data)) if not isinstance(data, np.ndarray) else data
+    except TypeError:
+        img = None
+    if img is not None and img.ndim == 1:
+        # flat buffer (e.g. a 1D SAFEARRAY), reshaped to the known frame shape
+        shape = out.shape if shape is None and out is not None else shape
+        if shape is None:
+            raise ValueError("Flat image buffer of %d pixels, give the image 'shape'."
+                    %img.size)
+        if img.size != np.prod(shape):
+            raise ValueError("Flat image buffer of %d pixels, can't reshape it to %s."
+                    %(img.size, tuple(shape)))
+        img = img.reshape(shape)
+    if img is not None and img.ndim == 2:
+        if out is None:
+            return np.ascontiguousarray(img, dtype=dtype)
+        np.copyto(out, img, casting='unsafe')
+        return out
+    # fallback: nested tuples, flattened into one preallocated array
+    nrow, ncol = len(data), len(data[0])
+    if out is None:
+        return np.fromiter(itertools.chain.from_iterable(data), dtype=dtype, 
+                count=nrow*ncol).reshape(nrow, ncol)
+    # or written row by row into 'out', without a full frame temporary
+    assert out.shape == (nrow, ncol), \
+            "'out' must have shape %s, not %s."%((nrow, ncol), out.shape)
+    for i, row in enumerate(data):
+        out[i] = np.fromiter(row, dtype=out.dtype, count=ncol)
+    return out
 
 
 class LabControl():
@@ -19,6 +71,19 @@ class LabControl():
         """
         request = getattr(self.connection, attribute)
         request(*value)
+    
+    def threadConnection(self):
+        """
+        returns a function giving, when called from another thread, a connection 
+        usable in that thread (the same connection by default)
+        """
+        return lambda: self
+    
+    def release(self):
+        """
+        releases a connection obtained from 'threadConnection', in its thread
+        """
+        pass
 
 class PyAPT(LabControl):
     
@@ -61,6 +126,44 @@ class ActiveX(LabControl):
         
     def command(self, attribute, value):
         setattr(self.connection, attribute, value)
+    
+    def threadConnection(self):
+        """
+        returns a function giving, when called from another thread, a new ActiveX
+        connection to the same COM object (the interface is marshalled between
+        the COM apartments of both threads)
+        """
+        try:
+            import pythoncom
+        except ModuleNotFoundError:
+            return super().threadConnection()
+        stream = pythoncom.CoMarshalInterThreadInterfaceInStream(
+                pythoncom.IID_IDispatch, self.connection._oleobj_)
+        def unmarshal():
+            import win32com.client
+            pythoncom.CoInitialize()
+            try:
+                connection = ActiveX.__new__(ActiveX)
+                LabControl.__init__(connection)
+                connection.connection = win32com.client.Dispatch(
+                        pythoncom.CoGetInterfaceAndReleaseStream(stream, pythoncom.IID_IDispatch))
+            except Exception:
+                pythoncom.CoUninitialize()
+                raise
+            def release():
+                # drop the COM object before leaving the apartment of the thread
+                connection.connection = None
+                pythoncom.CoUninitialize()
+            connection.release = release
+            return connection
+        return unmarshal
+    
+    def queryArray(self, attribute, dtype='int32', out=None, shape=None):
+        """
+        gets an image attribute (e.g. 'ImageArray') as a 2D numpy array, 
+        see array_from_com
+        """
+        return array_from_com(self.query(attribute), dtype=dtype, out=out, shape=shape)
 
 class SerialPort(LabControl):
     
@@ -0,0 +1,146 @@
+import numpy as np
+
+METHODS = ['com', 'quadratic', 'xcorr', 'gauss']
+
+def _as_stack(stack):
+    ''' Returns a float64 stack (N, ny, nx) from a stack or a single 2D image.
+    '''
+    stack = np.asarray(stack, dtype=np.float64)
+    return stack[np.newaxis] if stack.ndim == 2 else stack
+
+def get_cutouts(img, centers, half):
+    ''' Extracts a stack of square cutouts (N, 2*half, 2*half) from an image.
+        
+        img:
+            2D image.
+        centers:
+            (N, 2) integer centers (x, y), x along the columns.
+        half:
+            half width of the cutouts in pixels.
+        
+        Returns the stack, and the (x, y) origins of the cutouts in the image.
+        Cutouts are shifted to stay inside the image.
+    '''
+    
+    centers = np.atleast_2d(np.asarray(centers)).astype(np.intp)
+    (ny, nx) = img.shape
+    x0 = np.clip(centers[:, 0] - half, 0, nx - 2*half)
+    y0 = np.clip(centers[:, 1] - half, 0, ny - 2*half)
+    stack = np.stack([img[j:j+2*half, i:i+2*half] for i, j in zip(x0, y0)])
+    
+    return stack, np.stack((x0, y0), axis=1)
+
+def centroid_com(stack):
+    ''' Center of mass of each cutout, after subtraction of the median of the 
+        cutout edges (negative values are clipped). Returns (N, 2) (x, y).
+    '''
+    
+    stack = _as_stack(stack)
+    edges = np.concatenate((stack[:, 0, :], stack[:, -1, :], stack[:, :, 0], 
+            stack[:, :, -1]), axis=1)
+    w = np.clip(stack - np.median(edges, axis=1)[:, None, None], 0, None)
+    total = w.sum(axis=(1, 2))
+    total[total == 0] = 1.
+    xo = w.sum(axis=1) @ np.arange(stack.shape[2]) / total
+    yo = w.sum(axis=2) @ np.arange(stack.shape[1]) / total
+    
+    return np.stack((xo, yo), axis=1)
+
+def centroid_quadratic(stack):
+    ''' Peak pixel of each cutout, refined by a parabola through the peak and
+        its two neighbours along x and y. Returns (N, 2) (x, y).
+    '''
+    
+    stack = _as_stack(stack)
+    (N, ny, nx) = stack.shape
+    (iy, ix) = np.unravel_index(stack.reshape(N, -1).argmax(axis=1), (ny, nx))
+    # keep the 3-point stencil inside the cutout
+    ix = np.clip(ix, 1, nx - 2)
+    iy = np.clip(iy, 1, ny - 2)
+    n = np.arange(N)
+    def vertex(m, c, p):
+        denom = m - 2*c + p
+        safe = np.where(denom != 0, denom, 1.)
+        return np.where(denom != 0, np.clip(0.5*(m - p)/safe, -0.5, 0.5), 0.)
+    dx = vertex(stack[n, iy, ix-1], stack[n, iy, ix], stack[n, iy, ix+1])
+    dy = vertex(stack[n, iy-1, ix], stack[n, iy, ix], stack[n, iy+1, ix])
+    
+    return np.stack((ix + dx, iy + dy), axis=1)
+
+def _dft_upsampled(F, upsample, size, offsets):
+    ''' Upsampled inverse DFT of F (N, ny, nx) on a (size x size) grid around 
+        the given offsets (N, 2) (x, y), in units of 1/upsample pixel, 
+        computed by matrix multiplications (Guizar-Sicairos et al. 2008).
+    '''
+    
+    (N, ny, nx) = F.shape
+    kx = np.fft.ifftshift(np.arange(nx) - nx//2)
+    ky = np.fft.ifftshift(np.arange(ny) - ny//2)
+    s = np.arange(size) - size//2
+    # sample positions, in pixels, for each cutout
+    px = offsets[:, 0, None] + s/upsample                   # (N, size)
+    py = offsets[:, 1, None] + s/upsample
+    ex = np.exp(2j*np.pi*px[:, :, None]*kx/nx)             # (N, size, nx)
+    ey = np.exp(2j*np.pi*py[:, :, None]*ky/ny)             # (N, size, ny)
+    
+    return ey @ F @ ex.transpose(0, 2, 1)
+
+def centroid_xcorr(stack, reference=None, upsample=100):
+    ''' Position of each cutout from the peak of its FFT cross-correlation,
+        refined with an upsampled DFT to 1/upsample pixel.
+        
+        Without reference, each cutout is correlated with its 180 degrees 
+        rotation, whose peak is at twice the offset of the centroid from the
+        cutout center. With a reference image, the positions are the shifts
+        from the reference plus the reference center of mass.
+        
+        Returns (N, 2) (x, y).
+    '''
+    
+    stack = _as_stack(stack)
+    (N, ny, nx) = stack.shape
+    F = np.fft.fft2(stack)
+    if reference is None:
+        # rotation by 180 deg about the cutout center ((n-1)/2)
+        R = np.fft.fft2(stack[:, ::-1, ::-1])
+        scale, center = 2., np.array([(nx-1)/2, (ny-1)/2])
+    else:
+        reference = np.asarray(reference, dtype=np.float64)
+        R = np.fft.fft2(reference)[np.newaxis]
+        scale, center = 1., centroid_com(reference)[0]
+    X = F * np.conj(R)
+    # coarse peak of the cross-correlation
+    cc = np.fft.ifft2(X).real
+    (iy, ix) = np.unravel_index(cc.reshape(N, -1).argmax(axis=1), (ny, nx))
+    shifts = np.stack((np.where(ix > nx//2, ix - nx, ix), 
+                       np.where(iy > ny//2, iy - ny, iy)), axis=1).astype(np.float64)
+    # refined peak in a 1.5 x 1.5 pixels window
+    size = int(np.ceil(1.5*upsample))
+    up = _dft_upsampled(X, upsample, size, shifts).real
+    (jy, jx) = np.unravel_index(up.reshape(N, -1).argmax(axis=1), (size, size))
+    shifts[:, 0] += (jx - size//2) / upsample
+    shifts[:, 1] += (jy - size//2) / upsample
+    
+    return center + shifts / scale
+
+def centroid(stack, method='com', **kwargs):
+    ''' Sub-pixel positions of the spots in a stack of cutouts (N, ny, nx), or
+        in a single cutout, with the selected method:
+        'com': center of mass (centroid_com)
+        'quadratic': parabolic peak interpolation (centroid_quadratic)
+        'xcorr': upsampled FFT cross-correlation (centroid_xcorr)
+        'gauss': 2D Gaussian fit (psf_fitting.fit_gauss_2D_batch)
+        
+        Returns (N, 2) (x, y), x along the columns.
+    '''
+    
+    assert method in METHODS, "method must be one of %s."%METHODS
+    if method == 'com':
+        return centroid_com(stack)
+    elif method == 'quadratic':
+        return centroid_quadratic(stack)
+    elif method == 'xcorr':
+        return centroid_xcorr(stack, **kwargs)
+    from HCIFS.util.psf_fitting import fit_gauss_2D_batch
+    fits = fit_gauss_2D_batch(stack, **kwargs)
+    return np.stack((fits['xo'], fits['yo']), axis=1)
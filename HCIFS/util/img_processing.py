@@ -1,8 +1,107 @@
 import numpy as np
 import scipy.optimize as opt
 import scipy.special as spe
-import matplotlib.pyplot as plt
-from matplotlib import cm           # palette for image display
+from collections import OrderedDict
+import threading
+
+# LRU cache of coordinate grids, see get_grid and get_r2
+_grid_cache = OrderedDict()
+_grid_lock = threading.Lock()
+_grid_stats = {'hits': 0, 'misses': 0, 'evictions': 0, 'nbytes': 0, 'maxbytes': 256e6}
+_grid_hook = None
+
+def set_grid_cache_hook(hook=None):
+    ''' Sets an instrumentation hook, called as hook(event, key) for every grid
+        cache 'hit', 'miss' and 'evict'. None removes the hook.
+    '''
+    global _grid_hook
+    _grid_hook = hook
+    
+def grid_cache_info():
+    ''' Returns the grid cache statistics: hits, misses, evictions, hit rate,
+        number of grids, and memory used (nbytes) out of maxbytes.
+    '''
+    with _grid_lock:
+        info = dict(_grid_stats, size=len(_grid_cache))
+    calls = info['hits'] + info['misses']
+    info['hitrate'] = info['hits'] / calls if calls else 0.
+    return info
+    
+def clear_grid_cache(maxbytes=None):
+    ''' Empties the grid cache, and optionally changes its memory limit.
+    '''
+    with _grid_lock:
+        _grid_cache.clear()
+        _grid_stats.update(hits=0, misses=0, evictions=0, nbytes=0)
+        if maxbytes is not None:
+            _grid_stats['maxbytes'] = float(maxbytes)
+    
+def _cached(key, build):
+    ''' Returns the cached arrays for key, built by build() on a miss. The 
+        arrays are read-only, and the least recently used are evicted beyond 
+        the memory limit.
+    '''
+    with _grid_lock:
+        arrays = _grid_cache.get(key)
+        if arrays is not None:
+            _grid_cache.move_to_end(key)
+            _grid_stats['hits'] += 1
+    if arrays is not None:
+        if _grid_hook is not None:
+            _grid_hook('hit', key)
+        return arrays
+    arrays = build()
+    for a in arrays:
+        a.flags.writeable = False
+    evicted = []
+    with _grid_lock:
+        _grid_stats['misses'] += 1
+        if key not in _grid_cache:
+            _grid_cache[key] = arrays
+            _grid_stats['nbytes'] += sum(a.nbytes for a in arrays)
+        while _grid_stats['nbytes'] > _grid_stats['maxbytes'] and len(_grid_cache) > 1:
+            old, olds = _grid_cache.popitem(last=False)
+            _grid_stats['nbytes'] -= sum(a.nbytes for a in olds)
+            _grid_stats['evictions'] += 1
+            evicted.append(old)
+    if _grid_hook is not None:
+        _grid_hook('miss', key)
+        for old in evicted:
+            _grid_hook('evict', old)
+    return arrays
+    
+def get_grid(shape, dtype=np.float64):
+    ''' Returns read-only (x, y) pixel coordinate grids of an image shape
+        (ny, nx), as given by np.meshgrid: x along the columns, y along the rows.
+    '''
+    (ny, nx) = shape
+    dtype = np.dtype(dtype)
+    return _cached(('grid', ny, nx, dtype.str), lambda: 
+            np.meshgrid(np.arange(nx, dtype=dtype), np.arange(ny, dtype=dtype)))
+    
+def get_axes(shape, dtype=np.float64):
+    ''' Returns read-only 1D pixel coordinates (x, y) of an image shape (ny, nx).
+    '''
+    (ny, nx) = shape
+    dtype = np.dtype(dtype)
+    return _cached(('axes', ny, nx, dtype.str), lambda: 
+            (np.arange(nx, dtype=dtype), np.arange(ny, dtype=dtype)))
+    
+def get_r2(shape, xoyo, dtype=np.float64, out=None):
+    ''' Returns the squared distance of each pixel of an image shape (ny, nx)
+        to the center (xo, yo), xo along the columns. The offsets are applied 
+        to the cached 1D coordinates, and the result is a new array, or is
+        written into 'out' to reuse a buffer.
+    '''
+    (ny, nx) = shape
+    (xo, yo) = xoyo
+    dtype = np.dtype(dtype)
+    if out is None:
+        out = np.empty((ny, nx), dtype=dtype)
+    (x, y) = get_axes(shape, dtype)
+    dx2 = (x - dtype.type(xo))**2
+    dy2 = (y - dtype.type(yo))**2
+    return np.add(dx2, dy2[:, np.newaxis], out=out)
 
 def twoD_Gaussian(xy, amplitude, xo, yo, sigma_x, sigma_y, theta, offset):
     ''' Model function. 2D Gaussian.
@@ -45,73 +144,110 @@ def poly6odd(x, x0, a0, a2, a4, a6):
     y = a0 + a2*xx**2 + a4*xx**4 + a6*xx**6
     return y
 
+# tabulated Bessel functions J0 and J1, see set_airy_method
+_airy = {'method': 'j1', 'step': 1e-3, 'rmax': 200., 'table': None}
+
+def set_airy_method(method='j1', step=1e-3, rmax=200.):
+    ''' Selects how the Airy models evaluate the Bessel functions:
+        'j1': scipy.special.j1 and j0 (exact).
+        'table': linear interpolation in a table of J0, J1 with the given step,
+                 computed once, for 0 <= r < rmax (exact beyond rmax).
+    '''
+    assert method in ['j1', 'table'], "method must be 'j1' or 'table'."
+    _airy.update(method=method, step=float(step), rmax=float(rmax), table=None)
+    
+def _bessel_j0_j1(r):
+    ''' Returns J0(r) and J1(r), for r >= 0.
+    '''
+    if _airy['method'] == 'table':
+        if _airy['table'] is None:
+            rt = np.arange(0, _airy['rmax'] + 2*_airy['step'], _airy['step'])
+            _airy['table'] = (spe.j0(rt), spe.j1(rt))
+        (T0, T1) = _airy['table']
+        u = r / _airy['step']
+        i = np.minimum(u.astype(np.intp), T1.size - 2)
+        f = u - i
+        J0 = T0[i] + (T0[i+1] - T0[i])*f
+        J1 = T1[i] + (T1[i+1] - T1[i])*f
+        beyond = r >= _airy['rmax']
+        if beyond.any():
+            J0[beyond] = spe.j0(r[beyond])
+            J1[beyond] = spe.j1(r[beyond])
+        return J0, J1
+    return spe.j0(r), spe.j1(r)
+    
+def airy_kernel(r, deriv=False):
+    ''' Returns the normalized Airy pattern (2 J1(r)/r)**2, equal to 1 at r=0,
+        and with deriv=True its derivative with respect to r. The singularity
+        at r=0 is handled element-wise, without searching for the null.
+    '''
+    r = np.asarray(r, dtype=np.float64)
+    ra = np.abs(r)
+    small = ra < 1e-4
+    rs = np.where(small, 1., ra)
+    J0, J1 = _bessel_j0_j1(rs)
+    # u = 2 J1(r)/r, with its series expansion near r=0
+    u = np.where(small, 1. - ra**2/8, 2*J1/rs)
+    if not deriv:
+        return u**2
+    # du/dr = -2 J2(r)/r = -2 (u - J0)/r, odd in r
+    du = np.where(small, -ra/4, -2*(u - J0)/rs) * np.sign(r)
+    
+    return u**2, 2*u*du
+    
 def twoD_Airy(xy, amplitude, xo, yo, F):
     ''' Model function. 2D Airy.
     '''    
 
     (x, y) = xy
     r = np.sqrt((x-xo)**2+(y-yo)**2)*F
-    
-    nx=r.shape[1]
-    ny=r.shape[0]    
-    maxmap=np.where(r==0, np.ones((ny,nx)), np.zeros((ny,nx)))
-    nbmax=np.sum(maxmap)
-    if nbmax == 1:
-        indmax=np.unravel_index(maxmap.argmax(), maxmap.shape)
-        r[indmax]=1.
-    elif nbmax > 1:
-        print('ERROR in twoD_Airy: several nulls')
-    
-    J=spe.jn(1, r)
-    Airy=amplitude*(2*J/r)**2
-    if nbmax == 1 :   
-        Airy[indmax]=amplitude
+    Airy = amplitude*airy_kernel(r)
     
     return Airy.ravel()
+    
+def twoD_Airy_jac(xy, amplitude, xo, yo, F):
+    ''' Analytic Jacobian of twoD_Airy, with respect to (amplitude, xo, yo, F).
+    '''
+    
+    (x, y) = xy
+    dx = np.ravel(x - xo)
+    dy = np.ravel(y - yo)
+    rho = np.sqrt(dx**2 + dy**2)
+    A, dA = airy_kernel(rho*F, deriv=True)
+    # dr/dxo = -F dx/rho, zero at the center where dA = 0
+    dArho = amplitude*dA / np.where(rho > 0, rho, 1.)
+    
+    return np.stack((A, -F*dx*dArho, -F*dy*dArho, amplitude*dA*rho), axis=1)
 
 def oneD_Airy(x, amplitude, xo, F):
     ''' Model function. 1D Airy.
     '''
 
     r=(x-xo)*F
-    nx=x.shape[0]
     
-    maxmap=np.where(x==0, np.ones(nx), np.zeros(nx))
-    nbmax=np.sum(maxmap)
-    if nbmax == 1:
-        indmax=np.argmax(maxmap)
-        r[indmax]=1.
-    elif nbmax > 1:
-        print('ERROR in oneD_Airy: several nulls')
+    return amplitude*airy_kernel(r)
+    
+def oneD_Airy_jac(x, amplitude, xo, F):
+    ''' Analytic Jacobian of oneD_Airy, with respect to (amplitude, xo, F).
+    '''
     
-    J=spe.jn(1, r)
-    Airy=amplitude*(2*J/r)**2
-    if nbmax == 1 :   
-        Airy[indmax]=amplitude
+    A, dA = airy_kernel((x-xo)*F, deriv=True)
     
-    return Airy
+    return np.stack((A, -F*amplitude*dA, (x-xo)*amplitude*dA), axis=1)
     
 def oneD_Airy_log(x, amplitude, xo, F):
     ''' Model function. 1D log10(Airy).
     '''    
 
-    r=(x-xo)*F
-    nx=x.shape[0]
-    
-    maxmap=np.where(r==0, np.ones(nx), np.zeros(nx))
-    nbmax=np.sum(maxmap)
-    if nbmax == 1:
-        indmax=np.argmax(maxmap)
-        r[indmax]=1.
-    elif nbmax > 1:
-        print('ERROR in oneD_Airy: several nulls')
-    
-    J=spe.jn(1, r)
-    Airy=amplitude*(2*J/r)**2
-    if nbmax == 1 :   
-        Airy[indmax]=amplitude
-    
-    return np.log10(Airy)
+    return np.log10(oneD_Airy(x, amplitude, xo, F))
+    
+def oneD_Airy_log_jac(x, amplitude, xo, F):
+    ''' Analytic Jacobian of oneD_Airy_log, with respect to (amplitude, xo, F).
+    '''
+    
+    Airy = oneD_Airy(x, amplitude, xo, F)
+    
+    return oneD_Airy_jac(x, amplitude, xo, F) / (Airy*np.log(10))[:, np.newaxis]
 
 def fit_gauss_2D(img):
     ''' Fits a 2D Gaussian pattern on the image.
@@ -123,10 +259,7 @@ def fit_gauss_2D(img):
 
     nx=img.shape[1]
     ny=img.shape[0]
-    x = np.linspace(0, nx-1, nx)
-    y = np.linspace(0, ny-1, ny)
-    x, y = np.meshgrid(x, y)
-    xy = (x, y)
+    xy = get_grid(img.shape)
 
     init_xmax=np.unravel_index(img.argmax(), img.shape)[1]
     init_ymax=np.unravel_index(img.argmax(), img.shape)[0]
@@ -164,49 +297,22 @@ def fit_airy_2D(img, disp=0):
 
     nx=img.shape[1]
     ny=img.shape[0]
-    x = np.linspace(0, nx-1, nx)
-    y = np.linspace(0, ny-1, ny)
-    x, y = np.meshgrid(x, y)
-    xy = (x, y)
+    xy = get_grid(img.shape)
     
     init_xmax=np.unravel_index(img.argmax(), img.shape)[1]
     init_ymax=np.unravel_index(img.argmax(), img.shape)[0]
     initial_guess = (img.max(), init_xmax, init_ymax, .4)
     #initial_guess = (img[init_xmax, init_ymax]  , init_xmax, init_ymax, .6)
 
-    #plt.figure(27)
-    #plt.imshow(twoD_Airy(xy, img[init_xmax, init_ymax]  , init_xmax, init_ymax, .6).reshape(nx,ny))
-
-    popt, pcov = opt.curve_fit(twoD_Airy, xy, img.ravel(), p0=initial_guess)
+    popt, pcov = opt.curve_fit(twoD_Airy, xy, img.ravel(), p0=initial_guess, 
+                               jac=twoD_Airy_jac)
     
     if disp != 0:
-        data_fitted = twoD_Airy(xy, *popt)
-        #offset=np.min(img)
-        plt.figure(disp)
-        plt.clf()
-        plt.subplot(1,3,1)
-        plt.imshow(data_fitted.reshape(nx,ny), interpolation='none', cmap=cm.Greys_r)
-        plt.colorbar()
-        plt.subplot(1,3,2)
-        plt.plot(img[popt[1],:])
-        plt.plot(data_fitted.reshape(nx,ny)[popt[1],:], 'r--')
-        plt.yscale('log')
-        plt.subplot(1,3,3)
-        plt.plot(img[:,popt[2]])
-        plt.plot(data_fitted.reshape(nx,ny)[:,popt[2]], 'r--')
-        plt.yscale('log')
-        
-        plt.figure(disp+1)
-        plt.clf()
-        plt.subplot(121)
-        plt.imshow(data_fitted.reshape(nx,ny), interpolation='none', cmap=cm.Greys_r)
-        plt.colorbar()      
-        P_fit=get_radial_profile(data_fitted.reshape(nx,ny), (popt[1], popt[2]), 1, disp=10)
-        P_mes=get_radial_profile(img, (popt[1], popt[2]), 1, disp=0)        
-        plt.subplot(122)        
-        plt.plot(P_mes, 'b')
-        plt.plot(P_fit, 'r--')
-        plt.yscale('log')
+        from HCIFS.util.visualization import display_airy_fit
+        data_fitted = twoD_Airy(xy, *popt).reshape(img.shape)
+        P_fit=get_radial_profile(data_fitted, (popt[1], popt[2]), 1, disp=10)
+        P_mes=get_radial_profile(img, (popt[1], popt[2]), 1, disp=0)
+        display_airy_fit(img, data_fitted, popt, P_mes, P_fit, disp)
         
         print('\n--- Airy disk fit results ---')
         print('Amplitude ='+str(popt[0]))
@@ -232,14 +338,12 @@ def fit_airy_1Dlog(Y, disp=0, initial_guess=[0.,0.,0.]):
     if np.sum(initial_guess) == 0. :
         initial_guess=(np.max(Y), np.argmax(Y), .5)
     
-    popt, pcov = opt.curve_fit(oneD_Airy_log, x, Ylog, p0=initial_guess, sigma=1./Y**2)  
+    popt, pcov = opt.curve_fit(oneD_Airy_log, x, Ylog, p0=initial_guess, sigma=1./Y**2, 
+                               jac=oneD_Airy_log_jac)
     
     if disp != 0:
-        data_fitted=oneD_Airy_log(x, *popt)        
-        plt.figure(disp)
-        plt.clf()
-        plt.plot(Ylog, 'b')
-        plt.plot(x, data_fitted, 'r--')
+        from HCIFS.util.visualization import display_1D_fit
+        display_1D_fit(Ylog, x, oneD_Airy_log(x, *popt), disp)
     
     return popt
     
@@ -257,31 +361,95 @@ def fit_airy_1D(Y, disp=0, initial_guess=[0.,0.,0.]):
     if np.sum(initial_guess) == 0. :
         initial_guess=(np.max(Y), np.argmax(Y), .5)
     
-    popt, pcov = opt.curve_fit(oneD_Airy, x, Y, p0=initial_guess, sigma=1./Y)  
+    popt, pcov = opt.curve_fit(oneD_Airy, x, Y, p0=initial_guess, sigma=1./Y, 
+                               jac=oneD_Airy_jac)
     
     if disp != 0:
-        data_fitted=oneD_Airy(x, *popt)        
-        plt.figure(disp)
-        plt.clf()
-        plt.plot(Y, 'b')
-        plt.yscale('log')
-        plt.plot(x, data_fitted, 'r--')
+        from HCIFS.util.visualization import display_1D_fit
+        display_1D_fit(Y, x, oneD_Airy(x, *popt), disp, log=True)
     
     return popt
     
 def get_r_dist(nx,ny,xo,yo):
     ''' Returns the array of dimensions (nx,ny) with values corresponding the
-        distance from the center (xo,yo). 
+        distance from the center (xo,yo), xo along the columns. 
     '''
     
-    x = np.linspace(0, nx, nx)-xo-1
-    y = np.linspace(0, ny, ny)-yo-1
-    x, y = np.meshgrid(x, y)
+    r = get_r2((nx, ny), (xo, yo))
+    return np.sqrt(r, out=r)
+    
+def radial_profile(img, xoyo, nbin=1, stat='mean', sectors=None, npts=None):
+    ''' Computes the radial profile of the image in one pass, with np.bincount
+        on integer radius bins.
     
-    return np.sqrt(x**2+y**2)
+        img:
+            2D image.
+        xoyo:
+            (xo,yo) center for the annuli, sub-pixel, xo along the columns.
+        nbin:
+            width of the annuli in pixels. Annulus k: nbin*k <= r < nbin*(k+1).
+        stat:
+            'mean', 'median' or 'std' of the pixels in each annulus.
+        sectors:
+            optional list of azimuthal sectors (theta_min, theta_max) in degrees,
+            counter-clockwise from the x axis, e.g. the two lobes of a bowtie.
+        npts:
+            number of annuli, defaults to the largest distance from the center 
+            to an image edge divided by nbin.
+        
+        Returns the profile (npts,), or one profile per sector (nsectors, npts).
+        Empty annuli are NaN.
+    '''
     
-def get_radial_profile(img, xoyo, nbin, disp=0):
-    ''' Computes the mean radial profile of the image.
+    assert stat in ['mean', 'median', 'std'], "stat must be 'mean', 'median' or 'std'."
+    (xo, yo) = xoyo
+    (ny, nx) = img.shape
+    r = get_r2(img.shape, xoyo)
+    np.sqrt(r, out=r)
+    if npts is None:
+        npts = int(max(xo, nx-1-xo, yo, ny-1-yo) / nbin)
+    bins = (r / nbin).astype(np.intp).ravel()
+    values = np.asarray(img, dtype=np.float64).ravel()
+    # pixel selection: all annuli within npts, in each sector
+    if sectors is None:
+        selections = [bins < npts]
+    else:
+        (x, y) = get_grid(img.shape)
+        theta = np.degrees(np.arctan2(y - yo, x - xo)).ravel() % 360
+        selections = []
+        for (tmin, tmax) in sectors:
+            tmin, tmax = tmin % 360, tmax % 360
+            inside = (theta >= tmin) & (theta < tmax) if tmin <= tmax \
+                    else (theta >= tmin) | (theta < tmax)
+            selections.append(inside & (bins < npts))
+    
+    Profiles = np.full((len(selections), npts), np.nan)
+    for i, sel in enumerate(selections):
+        b, v = bins[sel], values[sel]
+        counts = np.bincount(b, minlength=npts)
+        filled = counts > 0
+        if stat == 'median':
+            # sort by annulus, then by value: the medians are the middle elements
+            order = np.lexsort((v, b))
+            v = v[order]
+            start = np.cumsum(counts) - counts
+            lo = start + (counts - 1) // 2
+            hi = start + counts // 2
+            Profiles[i, filled] = 0.5 * (v[lo[filled]] + v[hi[filled]])
+            continue
+        sums = np.bincount(b, weights=v, minlength=npts)
+        mean = sums[filled] / counts[filled]
+        if stat == 'mean':
+            Profiles[i, filled] = mean
+        else:
+            sumsq = np.bincount(b, weights=v**2, minlength=npts)
+            Profiles[i, filled] = np.sqrt(np.maximum(sumsq[filled] / counts[filled] 
+                    - mean**2, 0))
+    
+    return Profiles[0] if sectors is None else Profiles
+    
+def get_radial_profile(img, xoyo, nbin, disp=0, stat='mean', sectors=None):
+    ''' Computes the mean radial profile of the image, see radial_profile.
     
         img:
             2D image.
@@ -292,97 +460,172 @@ def get_radial_profile(img, xoyo, nbin, disp=0):
         disp:
             optional key word for displaying the images.
             Its value will serve as the window number that will be created.
+        stat, sectors:
+            see radial_profile.
     '''
     
-    (xo, yo) = xoyo
-    (nx, ny) = img.shape
-    r = get_r_dist(nx, ny, xo, yo)
+    Profile = radial_profile(img, xoyo, nbin, stat=stat, sectors=sectors)
     
-    r_max = np.max(r) # radius of the image
-    r_max = np.max(r[xo,:])
+    if disp != 0:
+        from HCIFS.util.visualization import display_radial_profile
+        display_radial_profile(img, xoyo, Profile, disp)
     
-    npts=int(r_max/nbin)
-    O=np.ones((nx,ny))
-    Z=np.zeros((nx,ny))
-    Profile=np.zeros(npts)
+    return Profile
     
-    if disp != 0:
-        plt.figure(disp)
-        plt.clf()
-        plt.subplot(121)
-        plt.plot(xo,yo, 'xw')
-        plt.title('PSF')
-        plt.title('Averaged radial profile')
-        plt.xlabel('Distance from center (pixels)')    
-        plt.imshow(img, interpolation='none')
-        plt.colorbar()
-        
-        val_min=np.min(img)
-        val_max=np.max(img)        
+BCKGR_METHODS = ['partition', 'histogram', 'sigmaclip', 'plane']
+
+def get_bckgr_mask(shape, xoyo, R=0):
+    ''' Returns the cached read-only flat indices of the pixels of an image 
+        shape (ny, nx) outside the radius R from the center (xo, yo).
+    '''
+    (ny, nx) = shape
+    (xo, yo) = xoyo
+    return _cached(('bckgr', ny, nx, float(xo), float(yo), float(R)), lambda: 
+            (np.flatnonzero(get_r2(shape, xoyo) > R**2),))[0]
+
+def _bckgr_design(shape, xoyo, R, order):
+    ''' Cached pseudo-inverse of the polynomial design matrix of the background
+        pixels, in coordinates centered on (xo, yo), up to the given total order.
+    '''
+    (ny, nx) = shape
+    (xo, yo) = xoyo
+    def build():
+        (x, y) = get_grid(shape)
+        idx = get_bckgr_mask(shape, xoyo, R)
+        dx, dy = x.ravel()[idx] - xo, y.ravel()[idx] - yo
+        terms = [dx**i * dy**(k-i) for k in range(order+1) for i in range(k, -1, -1)]
+        return (np.linalg.pinv(np.stack(terms, axis=1)),)
+    return _cached(('bckgr_pinv', ny, nx, float(xo), float(yo), float(R), 
+            int(order)), build)[0]
+
+def estimate_background(img, xoyo, R=0, method='partition', nsigma=3., 
+            maxIter=10, nbins=4096, order=1):
+    ''' Estimates the background level of an image, or of each frame of a 
+        stack, from the pixels outside a given radius. The pixel mask is cached, 
+        and a stack is processed in one call.
         
-        for k in range(0,npts-1,1):
-            M=np.where(r>nbin*k, O, Z)*np.where(r<nbin*(k+1), O, Z)
-            Profile[k]=np.sum(img*M)/np.sum(M)
-            
-            plt.figure(disp)
-            plt.subplot(121)
-            plt.imshow(img, interpolation='none')
-            plt.pause(.005)
-            plt.imshow(img*M, interpolation='none', vmin=val_min, vmax=val_max)
-            plt.pause(.005)            
-            plt.subplot(122)
-            plt.plot(Profile, 'rx')
-            plt.yscale('log')
+        img:
+            2D image, or stack of images (N, ny, nx).
+        xoyo:
+            (xo,yo) center of the PSF, xo along the columns.
+        R: 
+            radius of the circular zone to exclude.
+        method:
+            'partition': exact median, with np.partition (no full sort).
+            'histogram': approximate median from a histogram of nbins bins, 
+                accurate to (max - min) / nbins.
+            'sigmaclip': mean of the pixels within nsigma standard deviations,
+                iterated up to maxIter times.
+            'plane': least-squares polynomial background of the given order 
+                (1: plane), the level is its value at the center.
         
-        plt.plot(Profile, 'r')
-        plt.subplot(121)
-        plt.imshow(img, interpolation='none', vmin=val_min, vmax=val_max)
-    
-    for k in range(0,npts-1,1):
-        M=np.where(r>nbin*k, O, Z)*np.where(r<nbin*(k+1), O, Z)
-        Profile[k]=np.sum(img*M)/np.sum(M)   
-    
-    return Profile
+        Returns the background level (scalar, or (N,) for a stack), and a dict
+        of diagnostics: 'mean', 'std' and 'npix' of the background pixels, and
+        depending on the method 'iterations' and 'nclipped' (sigmaclip), 
+        'coeffs' and 'model' (plane, the fitted background images).
+    '''
     
-def adjust_bckgr_level(img, xo, yo, R=0, disp=0):
+    assert method in BCKGR_METHODS, "method must be one of %s."%BCKGR_METHODS
+    img = np.asarray(img)
+    stack = img[np.newaxis] if img.ndim == 2 else img
+    (N, ny, nx) = stack.shape
+    idx = get_bckgr_mask((ny, nx), xoyo, R)
+    npix = idx.size
+    assert npix > 0, "No background pixels outside R."
+    # one copy of the background pixels, in the image dtype
+    M = stack.reshape(N, -1)[:, idx]
+    mean = M.mean(axis=1, dtype=np.float64)
+    info = {'method': method, 'npix': npix, 'mean': mean,
+            'std': M.std(axis=1, dtype=np.float64)}
+    
+    if method == 'partition':
+        kth = [(npix - 1) // 2, npix // 2]
+        # M is already a copy: partition it in place
+        M.partition(kth, axis=1)
+        level = 0.5 * (M[:, kth[0]].astype(np.float64) + M[:, kth[1]])
+    elif method == 'histogram':
+        lo = M.min(axis=1).astype(np.float64)
+        width = np.maximum(M.max(axis=1) - lo, 1e-300) / nbins
+        bins = np.minimum(((M - lo[:, None]) / width[:, None]).astype(np.intp), nbins-1)
+        bins += np.arange(N)[:, None] * nbins
+        counts = np.bincount(bins.ravel(), minlength=N*nbins).reshape(N, nbins)
+        cum = np.cumsum(counts, axis=1)
+        k = np.argmax(cum >= npix / 2., axis=1)
+        n = np.arange(N)
+        # linear interpolation inside the median bin
+        frac = (npix / 2. - (cum[n, k] - counts[n, k])) / counts[n, k]
+        level = lo + (k + frac) * width
+    elif method == 'sigmaclip':
+        keep = np.ones(M.shape, dtype=bool)
+        level, std = mean, info['std']
+        for it in range(maxIter):
+            new = np.abs(M - level[:, None]) <= nsigma * std[:, None]
+            if np.array_equal(new, keep):
+                break
+            keep = new
+            count = np.maximum(keep.sum(axis=1), 1)
+            level = np.where(keep, M, 0).sum(axis=1, dtype=np.float64) / count
+            std = np.sqrt(np.where(keep, (M - level[:, None])**2, 0).sum(axis=1) / count)
+        info.update(iterations=it+1, nclipped=npix - keep.sum(axis=1))
+    else:
+        coeffs = M @ _bckgr_design((ny, nx), xoyo, R, order).T
+        (x, y) = get_grid((ny, nx))
+        dx, dy = x - xoyo[0], y - xoyo[1]
+        terms = [dx**i * dy**(k-i) for k in range(order+1) for i in range(k, -1, -1)]
+        model = np.tensordot(coeffs, np.stack(terms), axes=1)
+        level = coeffs[:, 0]
+        info.update(coeffs=coeffs, model=model if img.ndim == 3 else model[0])
+    
+    if img.ndim == 2:
+        level = level[0]
+        info.update((key, info[key][0]) for key in ['mean', 'std', 'nclipped'] 
+                if key in info)
+    
+    return level, info
+
+def adjust_bckgr_level(img, xo, yo, R=0, disp=0, method='partition', 
+            verbose=False):
     ''' Computes the median/mean background level of the image outside a 
-        given radius.
+        given radius, and subtracts it, see estimate_background.
         
         img:
-            2D image
+            2D image, or stack of images (N, ny, nx).
         (xo,yo):
             center of the PSF
         R: 
             radius of the circular zone to exclude.
         disp:
             optional keyword for displaying images.
+        method:
+            background estimator, 'partition' is the exact median. With 'plane'
+            the fitted background is subtracted instead of a constant level.
+        verbose:
+            prints the background levels.
+        
+        Returns the adjusted image, the background level and the mean of the 
+        background pixels.
     '''
     
-    (nx,ny)=img.shape
-    r=get_r_dist(nx,ny,xo,yo)
+    bckgr_med, info = estimate_background(img, (xo, yo), R, method=method)
+    bckgr_mean = info['mean']
     
-    M=np.double(img[np.where(r>R)])   
-    
-    bckgr_med=np.median(M)
-    bckgr_mean=np.mean(M)
-    
-    
-    print('\n----- Checking background level ------')
-    print('Background level = '+str(bckgr_med)+' [median]')
-    print('                   '+str(bckgr_mean)+' [mean]')
+    if verbose:
+        print('\n----- Checking background level ------')
+        print('Background level = '+str(bckgr_med)+' ['+method+']')
+        print('                   '+str(bckgr_mean)+' [mean]')
+        print('------------------------------------- ')
     
     if disp != 0:
-        plt.figure(disp)
-        plt.clf()
-        Pattern=np.where(r>R,np.ones((nx,ny)),np.zeros((nx,ny)))
-        plt.imshow(Pattern*img, interpolation='none')
-        plt.colorbar()
-        plt.title('Background median on external area = '+str(bckgr_med))
-    
-    if bckgr_med != 0 :
-        img=img-bckgr_med
-        print(' -> background adjusted to 0 median')
-    
-    print('------------------------------------- ')
-        
-    return (img, bckgr_med, bckgr_mean)
\ No newline at end of file
+        from HCIFS.util.visualization import show_image
+        Pattern=get_r2(np.shape(img)[-2:], (xo, yo))>R**2
+        show_image(Pattern*np.asarray(img).reshape((-1,)+Pattern.shape)[0], disp,
+                'Background median on external area = '+str(bckgr_med))
+    
+    if method == 'plane':
+        img = img - info['model']
+    elif np.ndim(img) == 3:
+        img = img - np.asarray(bckgr_med)[:, None, None]
+    elif bckgr_med != 0:
+        img = img - bckgr_med
+    
+    return (img, bckgr_med, bckgr_mean)
@@ -3,6 +3,13 @@ import glob
 import pkgutil
 import importlib
 import imp
+import threading
+
+# module registry: index of the HCIFS/Device modules, built once by 'index_modules'
+_index = None
+# memoized modules, keyed by (modname, folder)
+_modules = dict()
+_lock = threading.RLock()
 
 def get_folder(folder=''):
     """Get the path to a specific HCIFS module folder. Defaults to HCIFS GitHub repository.
@@ -44,11 +51,67 @@ def get_full_modname(pypath=''):
     
     return full_modname
 
-def get_module(modname, folder=''):
+def index_modules(folder='Device'):
+    """Scan the HCIFS/<folder> directory once, and map every module name (e.g. 
+    'MTS50', 'QSIrs61', 'FW212b') to its full module name and package path.
+    Modules take precedence over packages with the same name.
+    """
+    HCIFS_path = importlib.import_module('HCIFS').__path__[0]
+    root_path = os.path.dirname(HCIFS_path)
+    index, packages = dict(), dict()
+    for dirpath, dirnames, filenames in os.walk(os.path.join(HCIFS_path, folder)):
+        # skip caches and hidden directories
+        dirnames[:] = sorted(d for d in dirnames if not d.startswith(('.', '__')))
+        # full package name of the current directory, e.g. 'HCIFS.Device.Stage'
+        pkgname = os.path.relpath(dirpath, root_path).replace(os.sep, '.')
+        if '__init__.py' in filenames:
+            packages.setdefault(os.path.basename(dirpath), pkgname)
+        for filename in sorted(filenames):
+            if filename.endswith('.py') and filename != '__init__.py':
+                index.setdefault(filename[:-3], pkgname + '.' + filename[:-3])
+    for name, full_modname in packages.items():
+        index.setdefault(name, full_modname)
+    
+    return index
+
+def clear_module_cache():
+    """Invalidate the module registry, e.g. after adding a new device module.
+    The next call to 'get_module' rescans the HCIFS/Device directory.
+    """
+    global _index
+    with _lock:
+        _index = None
+        _modules.clear()
+        importlib.invalidate_caches()
+
+def get_module(modname, folder='', cached=True):
     """Get an HCIFS module, from an optional folder.
+    
+    Device modules (Camera, DM, Stage, FilterWheel, ...) are resolved through
+    the module registry: HCIFS/Device is scanned once, the module is imported 
+    once, and the result is memoized. Set 'cached' to False, or give a path to 
+    a *.py file, to search the whole repository and load the module source again.
     """
     assert modname and isinstance(modname, str), "'modname' must be defined as a non-empty string."
     
+    if cached and not modname.endswith('.py'):
+        global _index
+        with _lock:
+            module = _modules.get((modname, folder))
+            if module is None:
+                if _index is None:
+                    _index = index_modules()
+                full_modname = _index.get(modname)
+                # the folder must be part of the module's package path
+                if full_modname is not None and (not folder or \
+                        folder in full_modname.split('.')[:-1]):
+                    module = importlib.import_module(full_modname)
+                else:
+                    # not a Device module, fall back to the repository search
+                    module = get_module(modname, folder, cached=False)
+                _modules[(modname, folder)] = module
+        return module
+    
     # case 1: modname is given as a path to a *.py file
     if modname.endswith('.py'):
         # expand ~/..., $HOME/..., etc.
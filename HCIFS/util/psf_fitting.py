@@ -0,0 +1,172 @@
+import os
+import numpy as np
+import concurrent.futures
+
+# fitted parameters, in the order of img_processing.twoD_Gaussian
+GAUSS_PARAMS = ['amplitude', 'xo', 'yo', 'sigma_x', 'sigma_y', 'theta', 'offset']
+GAUSS_DTYPE = np.dtype([(name, np.float64) for name in GAUSS_PARAMS] 
+        + [('chi2', np.float64), ('niter', np.int32), ('converged', np.bool_)])
+
+def gauss_moments(stack):
+    ''' Moment-based initial guesses of the 2D Gaussian parameters for a stack
+        of cutouts (N, ny, nx). Returns an array (N, 7), see twoD_Gaussian.
+    '''
+    
+    stack = np.asarray(stack, dtype=np.float64)
+    (N, ny, nx) = stack.shape
+    x = np.arange(nx, dtype=np.float64)
+    y = np.arange(ny, dtype=np.float64)
+    # background from the median of the cutout edges
+    edges = np.concatenate((stack[:, 0, :], stack[:, -1, :], stack[:, :, 0], 
+            stack[:, :, -1]), axis=1)
+    offset = np.median(edges, axis=1)
+    w = np.clip(stack - offset[:, None, None], 0, None)
+    total = w.sum(axis=(1, 2))
+    total[total == 0] = 1.
+    wx = w.sum(axis=1)                          # (N, nx)
+    wy = w.sum(axis=2)                          # (N, ny)
+    xo = wx @ x / total
+    yo = wy @ y / total
+    sx = np.sqrt(np.clip(wx @ x**2 / total - xo**2, 0.25, None))
+    sy = np.sqrt(np.clip(wy @ y**2 / total - yo**2, 0.25, None))
+    amplitude = stack.max(axis=(1, 2)) - offset
+    
+    return np.stack((amplitude, xo, yo, sx, sy, np.zeros(N), offset), axis=1)
+
+def gauss_model(p, x, y, jac=False):
+    ''' Vectorized twoD_Gaussian for N parameter sets p (N, 7), on pixel 
+        coordinates x, y (P,). Returns the model (N, P), and with jac=True 
+        the analytic Jacobian (N, P, 7).
+    '''
+    
+    amp, xo, yo, sx, sy, theta, off = [p[:, i, None] for i in range(7)]
+    cos2, sin2 = np.cos(theta)**2, np.sin(theta)**2
+    s2t, c2t = np.sin(2*theta), np.cos(2*theta)
+    a = cos2/(2*sx**2) + sin2/(2*sy**2)
+    b = -s2t/(4*sx**2) + s2t/(4*sy**2)
+    c = sin2/(2*sx**2) + cos2/(2*sy**2)
+    dx = x - xo
+    dy = y - yo
+    dx2, dxdy, dy2 = dx**2, dx*dy, dy**2
+    e = np.exp(-(a*dx2 + 2*b*dxdy + c*dy2))
+    g = off + amp*e
+    if not jac:
+        return g
+    ae = amp*e
+    J = np.empty(g.shape + (7,))
+    J[..., 0] = e
+    J[..., 1] = ae*(2*a*dx + 2*b*dy)
+    J[..., 2] = ae*(2*b*dx + 2*c*dy)
+    # derivatives of a, b, c with respect to sigma_x, sigma_y, theta
+    da = (-cos2/sx**3, -sin2/sy**3, -s2t/(2*sx**2) + s2t/(2*sy**2))
+    db = (s2t/(2*sx**3), -s2t/(2*sy**3), -c2t/(2*sx**2) + c2t/(2*sy**2))
+    dc = (-sin2/sx**3, -cos2/sy**3, s2t/(2*sx**2) - s2t/(2*sy**2))
+    for i in range(3):
+        J[..., 3+i] = -ae*(da[i]*dx2 + 2*db[i]*dxdy + dc[i]*dy2)
+    J[..., 6] = 1.
+    
+    return g, J
+
+def _lm_gauss(stack, p0, maxIter, tol):
+    ''' Vectorized Levenberg-Marquardt iterations, one damping factor per spot.
+        Only the spots not converged yet are updated at each iteration.
+    '''
+    
+    (N, ny, nx) = stack.shape
+    x = np.tile(np.arange(nx, dtype=np.float64), ny)
+    y = np.repeat(np.arange(ny, dtype=np.float64), nx)
+    data = stack.reshape(N, -1)
+    p = np.array(p0, dtype=np.float64)
+    lam = np.full(N, 1e-3)
+    niter = np.zeros(N, dtype=np.int32)
+    converged = np.zeros(N, dtype=bool)
+    chi2 = ((data - gauss_model(p, x, y))**2).sum(axis=1)
+    active = np.arange(N)
+    eye = np.eye(7)
+    for it in range(maxIter):
+        if active.size == 0:
+            break
+        pa = p[active]
+        g, J = gauss_model(pa, x, y, jac=True)
+        r = data[active] - g
+        JTJ = np.einsum('npi,npj->nij', J, J)
+        JTr = np.einsum('npi,np->ni', J, r)
+        diag = np.einsum('nii->ni', JTJ)
+        A = JTJ + (lam[active, None, None] * (diag[:, :, None] * eye) 
+                + 1e-12 * diag.max(axis=1)[:, None, None] * eye)
+        try:
+            step = np.linalg.solve(A, JTr[..., None])[..., 0]
+        except np.linalg.LinAlgError:
+            step = np.stack([np.linalg.lstsq(Ai, bi, rcond=None)[0] for Ai, bi in zip(A, JTr)])
+        pnew = pa + step
+        chi2new = ((data[active] - gauss_model(pnew, x, y))**2).sum(axis=1)
+        better = np.isfinite(chi2new) & (chi2new <= chi2[active])
+        # accepted steps: update parameters, decrease damping
+        idx = active[better]
+        dchi2 = chi2[idx] - chi2new[better]
+        p[idx] = pnew[better]
+        chi2[idx] = chi2new[better]
+        lam[idx] = np.maximum(lam[idx] / 10, 1e-12)
+        # rejected steps: increase damping
+        lam[active[~better]] *= 10
+        niter[active] += 1
+        small = np.zeros(active.size, dtype=bool)
+        small[better] = dchi2 <= tol * np.maximum(chi2[idx], 1e-300)
+        converged[active[small]] = True
+        stuck = lam[active] > 1e12
+        active = active[~small & ~stuck]
+    
+    return p, chi2, niter, converged
+
+def _fit_chunk(args):
+    (stack, p0, maxIter, tol) = args
+    return _lm_gauss(stack, p0, maxIter, tol)
+
+def fit_gauss_2D_batch(stack, p0=None, maxIter=100, tol=1e-10, processes=None, 
+        chunkSize=5000):
+    ''' Fits the twoD_Gaussian model to a stack of cutouts at once, with analytic 
+        Jacobians and vectorized Levenberg-Marquardt iterations.
+        
+        stack:
+            stack of cutouts (N, ny, nx), or a single 2D cutout.
+        p0:
+            optional initial guesses (N, 7), defaults to gauss_moments(stack).
+        maxIter:
+            maximum number of iterations.
+        tol:
+            convergence threshold on the relative decrease of chi2.
+        processes:
+            number of worker processes. Defaults to all CPUs when the batch
+            is larger than 4 chunks, and to 1 (no pool) otherwise.
+        chunkSize:
+            number of cutouts fitted by each worker at once.
+        
+        Returns a structured array (N,) with the fitted parameters (same names
+        and order as fit_gauss_2D), chi2, the number of iterations, and the
+        per-spot convergence flag.
+    '''
+    
+    stack = np.asarray(stack, dtype=np.float64)
+    if stack.ndim == 2:
+        stack = stack[np.newaxis]
+    N = stack.shape[0]
+    p0 = gauss_moments(stack) if p0 is None else np.asarray(p0, dtype=np.float64)
+    if processes is None:
+        processes = (os.cpu_count() or 1) if N > 4 * chunkSize else 1
+    chunks = [(stack[i:i+chunkSize], p0[i:i+chunkSize], maxIter, tol) 
+            for i in range(0, N, chunkSize)]
+    if processes > 1 and len(chunks) > 1:
+        with concurrent.futures.ProcessPoolExecutor(processes) as executor:
+            results = list(executor.map(_fit_chunk, chunks))
+    else:
+        results = [_fit_chunk(chunk) for chunk in chunks]
+    
+    fits = np.zeros(N, dtype=GAUSS_DTYPE)
+    p = np.concatenate([res[0] for res in results])
+    for i, name in enumerate(GAUSS_PARAMS):
+        fits[name] = p[:, i]
+    fits['chi2'] = np.concatenate([res[1] for res in results])
+    fits['niter'] = np.concatenate([res[2] for res in results])
+    fits['converged'] = np.concatenate([res[3] for res in results])
+    
+    return fits
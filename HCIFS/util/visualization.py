@@ -0,0 +1,231 @@
+""" Plotting for HCIFS. matplotlib is only imported when something is
+displayed, so that headless scripts and Experiments never load pyplot and its
+backend. The computational modules (img_processing, Camera) import this module
+lazily, in their display branches.
+"""
+import numpy as np
+import time
+import threading
+import copy
+
+def pyplot():
+    ''' Returns matplotlib.pyplot, imported on first use.
+    '''
+    import matplotlib.pyplot as plt
+    return plt
+
+def show_image(img, disp, title=None, **kwargs):
+    ''' Displays an image with its colorbar in the figure window disp.
+    '''
+    plt = pyplot()
+    plt.figure(disp)
+    plt.clf()
+    plt.imshow(img, interpolation='none', **kwargs)
+    plt.colorbar()
+    if title is not None:
+        plt.title(title)
+
+def display_airy_fit(img, data_fitted, popt, P_mes, P_fit, disp):
+    ''' Displays a 2D Airy fit (see img_processing.fit_airy_2D): the fitted 
+        model, its cuts through the center compared with the image, and the 
+        measured and fitted radial profiles, in figures disp and disp+1.
+    '''
+    plt = pyplot()
+    (xo, yo) = (int(round(popt[1])), int(round(popt[2])))
+    plt.figure(disp)
+    plt.clf()
+    plt.subplot(1,3,1)
+    plt.imshow(data_fitted, interpolation='none', cmap='Greys_r')
+    plt.colorbar()
+    plt.subplot(1,3,2)
+    plt.plot(img[yo,:])
+    plt.plot(data_fitted[yo,:], 'r--')
+    plt.yscale('log')
+    plt.subplot(1,3,3)
+    plt.plot(img[:,xo])
+    plt.plot(data_fitted[:,xo], 'r--')
+    plt.yscale('log')
+    
+    plt.figure(disp+1)
+    plt.clf()
+    plt.subplot(121)
+    plt.imshow(data_fitted, interpolation='none', cmap='Greys_r')
+    plt.colorbar()
+    plt.subplot(122)
+    plt.plot(P_mes, 'b')
+    plt.plot(P_fit, 'r--')
+    plt.yscale('log')
+
+def display_1D_fit(Y, x, data_fitted, disp, log=False):
+    ''' Displays a 1D profile and its fitted model.
+    '''
+    plt = pyplot()
+    plt.figure(disp)
+    plt.clf()
+    plt.plot(Y, 'b')
+    if log:
+        plt.yscale('log')
+    plt.plot(x, data_fitted, 'r--')
+
+def display_radial_profile(img, xoyo, Profile, disp):
+    ''' Displays the image with its center, and its radial profile.
+    '''
+    plt = pyplot()
+    (xo, yo) = xoyo
+    plt.figure(disp)
+    plt.clf()
+    plt.subplot(121)
+    plt.imshow(img, interpolation='none')
+    plt.colorbar()
+    plt.plot(xo, yo, 'xw')
+    plt.title('PSF')
+    plt.subplot(122)
+    plt.plot(np.atleast_2d(Profile).T, 'r')
+    plt.yscale('log')
+    plt.title('Averaged radial profile')
+    plt.xlabel('Distance from center (pixels)')
+
+
+class LiveView(object):
+    """
+    Live view of a camera. Images are taken in a background thread, and only 
+    the latest one is kept: stale images are dropped when the display falls 
+    behind. The display updates a single AxesImage by blitting, with images 
+    decimated to screen resolution, and shows both acquisition and display 
+    frame rates.
+    """
+    
+    def __init__(self, camera, expTime=0.0003, maxPix=800, interval=0.02, fignum=100):
+        """
+        Inputs:
+            camera - the connected camera (Camera)
+            expTime - exposure time in seconds of each image (num)
+            maxPix - maximum number of displayed pixels along each axis (int)
+            interval - refresh interval of the display in seconds (num)
+            fignum - number of the figure window (int)
+        """
+        self.camera = camera
+        self.expTime = expTime
+        self.maxPix = int(maxPix)
+        self.interval = float(interval)
+        self.fignum = fignum
+        self.lock = threading.Lock()
+        self.running = threading.Event()
+        self.latest = None                  # latest decimated image
+        self.acquired = 0                   # number of images taken
+        self.displayed = 0                  # number of images displayed
+        self.dropped = 0                    # images never displayed
+        self.error = None                   # exception of the acquisition thread
+    
+    def acquire(self, connect):
+        """
+        Acquisition loop, run in the background thread
+        """
+        # camera copy using a connection valid in this thread
+        camera = copy.copy(self.camera)
+        camera.connection = None
+        try:
+            camera.connection = connect()
+            frame = None
+            while self.running.is_set():
+                frame = camera.exposure(self.expTime, out=frame)
+                step = max(1, int(np.ceil(max(frame.shape) / self.maxPix)))
+                img = frame[::step, ::step].copy()
+                with self.lock:
+                    if self.latest is not None:
+                        self.dropped += 1
+                    self.latest = img
+                    self.acquired += 1
+        except Exception as ex:
+            # raised again in the GUI thread, see 'update'
+            self.error = ex
+        finally:
+            if camera.connection is not None:
+                camera.connection.release()
+    
+    def start(self, block=True):
+        """
+        Starts the acquisition thread and the display
+        """
+        self.running.set()
+        self.thread = threading.Thread(target=self.acquire, 
+                args=(self.camera.connection.threadConnection(),), daemon=True)
+        self.thread.start()
+        # wait for the first image to set up the figure
+        while self.latest is None and self.thread.is_alive():
+            time.sleep(self.interval)
+        with self.lock:
+            img, self.latest = self.latest, None
+        if img is None:
+            self.stop()
+            raise Exception('Live view acquisition failed.') from self.error
+        plt = pyplot()
+        self.fig = plt.figure(self.fignum)
+        self.fig.clf()
+        self.ax = self.fig.add_subplot(111)
+        self.ax.set_title('Real Time Picture')
+        self.image = self.ax.imshow(img, origin='lower', animated=True)
+        self.fig.colorbar(self.image)
+        self.text = self.ax.text(0.02, 0.98, '', transform=self.ax.transAxes, color='w',
+                va='top', animated=True)
+        self.fig.canvas.mpl_connect('draw_event', self.onDraw)
+        self.fig.canvas.mpl_connect('close_event', lambda event: self.stop())
+        self.startTime = time.perf_counter()
+        self.timer = self.fig.canvas.new_timer(interval=int(self.interval * 1e3))
+        self.timer.add_callback(self.update)
+        self.timer.start()
+        plt.show(block=False)
+        self.fig.canvas.draw()
+        if block:
+            while self.running.is_set() and self.error is None \
+                    and pyplot().fignum_exists(self.fignum):
+                self.fig.canvas.start_event_loop(self.interval)
+            self.stop()
+            # errors of the acquisition thread, also when not raised by the timer
+            if self.error is not None:
+                raise Exception('Live view acquisition stopped.') from self.error
+    
+    def onDraw(self, event):
+        """
+        Saves the background after a full redraw (e.g. resizing the window)
+        """
+        self.background = self.fig.canvas.copy_from_bbox(self.fig.bbox)
+        self.blit()
+    
+    def blit(self):
+        """
+        Redraws the image and the frame rates over the saved background
+        """
+        self.fig.canvas.restore_region(self.background)
+        self.ax.draw_artist(self.image)
+        self.ax.draw_artist(self.text)
+        self.fig.canvas.blit(self.fig.bbox)
+    
+    def update(self):
+        """
+        Displays the latest image, if any. Errors of the acquisition thread 
+        stop the live view, and are raised here, in the GUI thread.
+        """
+        if self.error is not None:
+            self.stop()
+            raise Exception('Live view acquisition stopped.') from self.error
+        with self.lock:
+            img, self.latest = self.latest, None
+        if img is None or not hasattr(self, 'background'):
+            return
+        self.image.set_data(img)
+        self.displayed += 1
+        elapsed = time.perf_counter() - self.startTime
+        self.text.set_text('acquisition %.1f fps, display %.1f fps'%(
+                self.acquired / elapsed, self.displayed / elapsed))
+        self.blit()
+    
+    def stop(self):
+        """
+        Stops the acquisition thread and the display
+        """
+        self.running.clear()
+        if hasattr(self, 'timer'):
+            self.timer.stop()
+        if hasattr(self, 'thread'):
+            self.thread.join()
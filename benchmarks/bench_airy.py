@@ -0,0 +1,73 @@
+"""Benchmark of fit_airy_2D: legacy model (scipy.special.jn, full-image null 
+search, numerical derivatives) versus the Airy kernel with analytic Jacobian,
+using either scipy.special.j1 or the tabulated Bessel functions.
+
+Usage:
+    python -m benchmarks.bench_airy [repeat]
+"""
+import sys, time
+import numpy as np
+import scipy.optimize as opt
+import scipy.special as spe
+from HCIFS.util import img_processing as ip
+
+SIZES = [32, 64, 128, 256]
+
+
+def legacy_twoD_Airy(xy, amplitude, xo, yo, F):
+    ''' twoD_Airy as implemented before the Airy kernel (reference).
+    '''
+    (x, y) = xy
+    r = np.sqrt((x-xo)**2+(y-yo)**2)*F
+    nx=r.shape[1]
+    ny=r.shape[0]
+    maxmap=np.where(r==0, np.ones((ny,nx)), np.zeros((ny,nx)))
+    nbmax=np.sum(maxmap)
+    if nbmax == 1:
+        indmax=np.unravel_index(maxmap.argmax(), maxmap.shape)
+        r[indmax]=1.
+    J=spe.jn(1, r)
+    Airy=amplitude*(2*J/r)**2
+    if nbmax == 1 :
+        Airy[indmax]=amplitude
+    return Airy.ravel()
+
+def legacy_fit(img):
+    xy = ip.get_grid(img.shape)
+    (iy, ix) = np.unravel_index(img.argmax(), img.shape)
+    popt, pcov = opt.curve_fit(legacy_twoD_Airy, xy, img.ravel(), p0=(img.max(), ix, iy, .4))
+    return popt
+
+def best_time(func, repeat):
+    best, result = float('inf'), None
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        result = func()
+        best = min(best, time.perf_counter() - t0)
+    return best, result
+
+if __name__ == '__main__':
+    repeat = int(sys.argv[1]) if len(sys.argv) > 1 else 3
+    rng = np.random.default_rng(0)
+    print('%6s %12s %12s %12s %14s %14s'%('size', 'legacy [ms]', 'j1 [ms]', 
+            'table [ms]', 'param err j1', 'param err tab'))
+    for n in SIZES:
+        xy = ip.get_grid((n, n))
+        true = np.array([1e4, n/2 + 0.3, n/2 - 0.2, 0.45])
+        img = legacy_twoD_Airy(xy, *true).reshape(n, n) + rng.normal(0, 1, (n, n))
+        t_legacy, p_legacy = best_time(lambda: legacy_fit(img), repeat)
+        ip.set_airy_method('j1')
+        t_j1, p_j1 = best_time(lambda: ip.fit_airy_2D(img), repeat)
+        ip.set_airy_method('table')
+        t_tab, p_tab = best_time(lambda: ip.fit_airy_2D(img), repeat)
+        ip.set_airy_method('j1')
+        print('%6d %12.2f %12.2f %12.2f %14.2e %14.2e'%(n, t_legacy*1e3, t_j1*1e3, 
+                t_tab*1e3, np.max(np.abs(p_j1 - p_legacy)/np.abs(true)), 
+                np.max(np.abs(p_tab - p_legacy)/np.abs(true))))
+    # accuracy of the model itself
+    r = np.linspace(0, 150, 100001)
+    ref = (2*spe.jn(1, r[1:])/r[1:])**2
+    ip.set_airy_method('table')
+    print('max model error, table: %.2e'%np.max(np.abs(ip.airy_kernel(r[1:]) - ref)))
+    ip.set_airy_method('j1')
+    print('max model error, j1:    %.2e'%np.max(np.abs(ip.airy_kernel(r[1:]) - ref)))
@@ -0,0 +1,57 @@
+"""Benchmark of the EFC controller: per-iteration solve of the regularized normal
+equations (np.linalg.solve, as a naive loop would do) versus the cached SVD of
+the Jacobian, for a synthetic two-DM Jacobian over two wavelengths.
+
+Usage:
+    python -m benchmarks.bench_efc [npix] [numAct] [repeat]
+"""
+import sys, time
+import numpy as np
+from HCIFS.WavefrontControl.ElectricFieldConjugation import ElectricFieldConjugation
+
+
+def naive_efc(J, E, beta):
+    ''' EFC update from the normal equations, solved at every iteration.
+    '''
+    G = np.concatenate([np.concatenate((Jl.real, Jl.imag)) for Jl in J])
+    e = np.concatenate([np.concatenate((El.real, El.imag)) for El in E])
+    GtG = G.T @ G
+    alpha2 = np.linalg.norm(G, 2)**2 * 10.**beta
+    return -np.linalg.solve(GtG + alpha2 * np.eye(len(GtG)), G.T @ e)
+
+def best_time(func, repeat):
+    best, result = float('inf'), None
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        result = func()
+        best = min(best, time.perf_counter() - t0)
+    return best, result
+
+if __name__ == '__main__':
+    npix = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+    numAct = int(sys.argv[2]) if len(sys.argv) > 2 else 1904
+    repeat = int(sys.argv[3]) if len(sys.argv) > 3 else 3
+    rng = np.random.default_rng(0)
+    nlam = 2
+    J = rng.normal(size=(nlam, npix, numAct)) + 1j*rng.normal(size=(nlam, npix, numAct))
+    E = rng.normal(size=(nlam, npix)) + 1j*rng.normal(size=(nlam, npix))
+    actuators = [('DM1', np.arange(numAct//2), numAct//2),
+            ('DM2', np.arange(numAct - numAct//2), numAct - numAct//2)]
+    print('Jacobian: %d wavelengths x %d pixels x %d actuators'%(nlam, npix, numAct))
+
+    t_naive, ref = best_time(lambda: naive_efc(J, E, -3.), repeat)
+    efc = ElectricFieldConjugation(J, actuators, beta=-3.)
+    t0 = time.perf_counter()
+    efc.factorize()
+    t_svd = time.perf_counter() - t0
+    t_solve, du = best_time(lambda: efc.computeCommand(E), repeat)
+    def new_beta(betas=iter(np.linspace(-1, -6, 10000))):
+        return efc.computeCommand(E, beta=next(betas))
+    t_beta, _ = best_time(new_beta, repeat)
+
+    print('%-34s %10.1f ms'%('naive solve, per iteration', t_naive*1e3))
+    print('%-34s %10.1f ms'%('SVD factorization, once', t_svd*1e3))
+    print('%-34s %10.2f ms'%('cached SVD solve, per iteration', t_solve*1e3))
+    print('%-34s %10.2f ms'%('cached SVD solve, new beta', t_beta*1e3))
+    print('relative difference to the naive update: %.1e'%(
+            np.linalg.norm(du - ref) / np.linalg.norm(ref)))
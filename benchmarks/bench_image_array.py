@@ -0,0 +1,40 @@
+"""Benchmark of the ImageArray conversion: np.array on nested tuples (legacy)
+versus util.LabControl.array_from_com.
+
+Synthetic frames are fed as nested tuples (what win32com returns), and as an
+array exposing the buffer protocol (SAFEARRAY fast path).
+
+Usage:
+    python -m benchmarks.bench_image_array [repeat]
+"""
+import sys, time
+import numpy as np
+from HCIFS.util.LabControl import array_from_com
+
+# full frames of the cameras, as returned by 'ImageArray'
+SIZES = {'QSIrs61': (2758, 2208), 'SXvrh9': (1392, 1040)}
+
+
+def best_time(func, repeat=3):
+    best = float('inf')
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        func()
+        best = min(best, time.perf_counter() - t0)
+    return best
+
+if __name__ == '__main__':
+    repeat = int(sys.argv[1]) if len(sys.argv) > 1 else 3
+    for camera, shape in SIZES.items():
+        frame = np.random.randint(0, 65535, shape).astype(np.int32)
+        nested = tuple(tuple(row) for row in frame.tolist())
+        out = np.empty(shape, np.int32)
+        assert np.array_equal(array_from_com(nested), frame)
+        results = [
+            ('np.array(nested tuples)', lambda: np.array(nested)),
+            ('array_from_com(nested tuples)', lambda: array_from_com(nested)),
+            ('array_from_com(nested tuples, out)', lambda: array_from_com(nested, out=out)),
+            ('array_from_com(buffer, out)', lambda: array_from_com(frame, out=out))]
+        print('%s %dx%d int32'%(camera, *shape))
+        for name, func in results:
+            print('  %-36s %8.2f ms'%(name, best_time(func, repeat)*1e3))
@@ -0,0 +1,51 @@
+"""Startup benchmark: module lookups made while building an Experiment.
+
+Compares the legacy repository search of 'get_module' (recursive glob, 
+walk_packages and load_source for every call) with the cached module registry.
+
+Usage:
+    python -m benchmarks.bench_imports [scriptfile] [repeat]
+"""
+import os.path, json, inspect, sys, time
+import HCIFS
+from HCIFS.util import imports
+
+
+def get_lookups(scriptfile='sampleScript'):
+    """Returns the list of (modname, folder) lookups an Experiment makes at startup:
+    one per device, and one per stage axis of every device.
+    """
+    path = os.path.join(os.path.dirname(inspect.getfile(HCIFS)), 'script', 
+            scriptfile + '.json')
+    specs = json.loads(open(path).read())
+    lookups = []
+    for dev in specs['Devices']:
+        lookups.append((dev.get('device', 'Device'), ''))
+        for stageType in dev.get('stageTypes', [None, None, None]):
+            lookups.append((stageType if stageType is not None else 'Stage', 'Stage'))
+    
+    return lookups
+
+def run(lookups, cached, repeat=5):
+    """Returns the best time in seconds to resolve all lookups.
+    """
+    best = float('inf')
+    for _ in range(repeat):
+        imports.clear_module_cache()
+        t0 = time.perf_counter()
+        for modname, folder in lookups:
+            imports.get_module(modname, folder, cached=cached)
+        best = min(best, time.perf_counter() - t0)
+    
+    return best
+
+if __name__ == '__main__':
+    scriptfile = sys.argv[1] if len(sys.argv) > 1 else 'sampleScript'
+    repeat = int(sys.argv[2]) if len(sys.argv) > 2 else 5
+    lookups = get_lookups(scriptfile)
+    legacy = run(lookups, cached=False, repeat=repeat)
+    registry = run(lookups, cached=True, repeat=repeat)
+    print('%d module lookups (%s)'%(len(lookups), scriptfile))
+    print('legacy search:   %8.2f ms'%(legacy*1e3))
+    print('module registry: %8.2f ms  (x%.0f faster, cold registry)'%(registry*1e3, 
+            legacy/registry))
@@ -0,0 +1,45 @@
+"""Convergence check of the simulated wavefront control loop.
+
+Runs the default 'runFPWC' call of a non-lab Experiment from flat DMs, pairwise
+probing and a controller driven by the optical model of the script, for each
+controller, and exits with status 1 if the dark hole contrast does not drop at
+each of the first iterations, or if the last contrast is not below half the
+initial one.
+The Jacobian is built on the first run and cached like in any other run.
+
+Usage:
+    python -m benchmarks.check_fpwc [scriptfile] [nbIter]
+"""
+import sys
+import numpy as np
+from HCIFS.Experiment import Experiment
+
+CONTROLLERS = ['EFC', 'SM']
+# iterations that must each lower the contrast
+MONOTONIC = 5
+
+
+def main(scriptfile='sampleScript', nbIter=None):
+    ok = True
+    for controller in CONTROLLERS:
+        expt = Experiment(scriptfile)
+        for dm in expt.getDMs():
+            dm.flatten()
+        contrast, _ = expt.runFPWC('Imag', controller=controller, nbIter=nbIter)
+        print('%s: %d iterations, contrast %.2e -> %.2e'%(controller,
+                len(contrast) - 1, contrast[0], contrast[-1]))
+        print('    ' + ' '.join('%.1e'%c for c in contrast))
+        steps = np.diff(contrast[:MONOTONIC + 1])
+        if np.any(steps >= 0):
+            print('    FAIL: contrast rises at iteration %d'%np.argmax(steps >= 0))
+            ok = False
+        if not contrast[-1] < contrast[0] / 2:
+            print('    FAIL: contrast not halved')
+            ok = False
+
+    return ok
+
+if __name__ == '__main__':
+    args = sys.argv[1:]
+    ok = main(*args[:1], *[int(a) for a in args[1:2]])
+    sys.exit(0 if ok else 1)
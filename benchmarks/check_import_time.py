@@ -0,0 +1,61 @@
+"""Import-time budget: fails if a headless Experiment loads matplotlib.pyplot.
+
+Runs 'python -X importtime' in a fresh interpreter on 'import HCIFS.Experiment'
+and on building a non-lab Experiment from a script file, reports the slowest
+imports, and exits with status 1 if pyplot was imported or if the cumulative
+import time of HCIFS.Experiment exceeds the budget.
+
+Usage:
+    python -m benchmarks.check_import_time [scriptfile] [budget_ms]
+"""
+import subprocess, sys
+
+FORBIDDEN = ['matplotlib.pyplot']
+
+
+def importtime(code):
+    """Returns the list of (module, self_us, cumulative_us) imported by code, 
+    run in a fresh interpreter with -X importtime.
+    """
+    proc = subprocess.run([sys.executable, '-X', 'importtime', '-W', 'ignore', 
+            '-c', code], capture_output=True, text=True)
+    if proc.returncode != 0:
+        raise Exception(proc.stderr)
+    imports = []
+    for line in proc.stderr.splitlines():
+        if not line.startswith('import time:') or 'self [us]' in line:
+            continue
+        self_us, cumul_us, name = line[len('import time:'):].split('|')
+        imports.append((name.strip(), int(self_us), int(cumul_us)))
+    
+    return imports
+
+def main(scriptfile='sampleScript', budget_ms=2000.):
+    ok = True
+    cases = [('import HCIFS.Experiment', 'import HCIFS.Experiment'),
+             ("Experiment('%s')"%scriptfile, 'from HCIFS.Experiment import '
+                    "Experiment; Experiment('%s')"%scriptfile)]
+    for label, code in cases:
+        imports = importtime(code)
+        names = set(name for name, _, _ in imports)
+        pulled = [mod for mod in FORBIDDEN if mod in names]
+        print('%s: %d modules imported'%(label, len(imports)))
+        for name, self_us, cumul_us in sorted(imports, key=lambda i: -i[1])[:5]:
+            print('    %8.1f ms  %s'%(self_us / 1e3, name))
+        if pulled:
+            print('    FAIL: imports %s'%', '.join(pulled))
+            ok = False
+        total = [cumul for name, _, cumul in imports if name == 'HCIFS.Experiment']
+        if total:
+            print('    HCIFS.Experiment cumulative: %.1f ms (budget %.0f ms)'%(
+                    total[0] / 1e3, budget_ms))
+            if total[0] / 1e3 > budget_ms:
+                print('    FAIL: over the import-time budget')
+                ok = False
+    
+    return ok
+
+if __name__ == '__main__':
+    args = sys.argv[1:]
+    ok = main(*args[:1], *[float(a) for a in args[1:2]])
+    sys.exit(0 if ok else 1)
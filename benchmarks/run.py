@@ -0,0 +1,191 @@
+"""Benchmark suite of the img_processing and camera reduction kernels.
+
+Each case is timed (best of 'repeat' runs, after one warm-up run) across image
+and batch sizes, and its peak memory allocated by numpy/Python is measured 
+with tracemalloc in a separate run. Results are written as JSON, by default to
+benchmarks/results/<commit>.json, and can be compared with a previous run to 
+spot regressions between commits.
+
+Usage:
+    python -m benchmarks.run [--quick] [--filter NAME] [--repeat N] 
+            [--output FILE] [--compare FILE] [--threshold RATIO]
+"""
+import argparse, json, os, platform, subprocess, sys, time, tracemalloc
+import numpy as np
+from HCIFS.util import img_processing as ip
+from HCIFS.util.psf_fitting import fit_gauss_2D_batch
+from HCIFS.util.centroid import centroid
+from HCIFS.Device.Camera.Camera import FrameAccumulator
+from HCIFS.util.DMSurface import DMSurface
+from HCIFS.WavefrontControl.OpticalModel import OpticalModel
+from benchmarks import synthetic
+
+RESULTS = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'results')
+
+
+def cases(quick=False):
+    """Yields (name, params, setup): setup() returns the function to benchmark.
+    Data are generated in setup, outside of the timed and traced runs.
+    """
+    sizes = [256, 1024] if quick else [256, 1024, 2048]
+    for n in sizes:
+        def setup(n=n):
+            img = synthetic.coronagraphic_frame((n, n))
+            return lambda: ip.get_radial_profile(img, ((n-1)/2, (n-1)/2), 1)
+        yield 'get_radial_profile', {'size': n, 'stat': 'mean'}, setup
+        def setup(n=n):
+            img = synthetic.coronagraphic_frame((n, n))
+            return lambda: ip.radial_profile(img, ((n-1)/2, (n-1)/2), 1, stat='median')
+        yield 'get_radial_profile', {'size': n, 'stat': 'median'}, setup
+    
+    for n in [16, 32] if quick else [16, 32, 64]:
+        def setup(n=n):
+            img = synthetic.gaussian_psf((n, n), ((n-1)/2 + .3, (n-1)/2 - .2))
+            return lambda: ip.fit_gauss_2D(img)
+        yield 'fit_gauss_2D', {'size': n}, setup
+    for batch in [100] if quick else [100, 1000]:
+        def setup(batch=batch):
+            stack, _ = synthetic.psf_stack(batch, 20)
+            return lambda: fit_gauss_2D_batch(stack, processes=1)
+        yield 'fit_gauss_2D_batch', {'size': 20, 'batch': batch}, setup
+        for method in ['com', 'quadratic', 'xcorr']:
+            def setup(batch=batch, method=method):
+                stack, _ = synthetic.psf_stack(batch, 20)
+                return lambda: centroid(stack, method)
+            yield 'centroid', {'size': 20, 'batch': batch, 'method': method}, setup
+    
+    for n in [32, 64] if quick else [32, 64, 128]:
+        def setup(n=n):
+            img = synthetic.airy_psf((n, n), ((n-1)/2 + .3, (n-1)/2 - .2), F=12./n)
+            return lambda: ip.fit_airy_2D(img)
+        yield 'fit_airy_2D', {'size': n}, setup
+    
+    for batch in [1, 32]:
+        for method in ['sparse', 'fft']:
+            def setup(batch=batch, method=method):
+                dm = DMSurface(cacheDir=None)
+                dm.getOperator()
+                commands = np.random.default_rng(0).normal(size=(batch, dm.numAct))
+                return lambda: dm.surface(commands, method)
+            yield 'DMSurface', {'npix': 256, 'batch': batch, 'method': method}, setup
+    
+    for npix in [128] if quick else [128, 256]:
+        for dm in [0, 1]:
+            def setup(npix=npix, dm=dm):
+                surfaces = [DMSurface(npix=npix, gain=1e-9, cacheDir=None) for i in range(2)]
+                model = OpticalModel(surfaces, ['DM1', 'DM2'], [0., .3], [635e-9])
+                model.columns(dm, np.arange(32))
+                return lambda: model.columns(dm, np.arange(32))
+            yield 'Jacobian_columns', {'npix': npix, 'batch': 32, 'DM': dm + 1}, setup
+    
+    cameras = ['SXvrh9'] if quick else list(synthetic.CAMERAS)
+    for camera in cameras:
+        shape = synthetic.CAMERAS[camera]
+        center = ((shape[1]-1)/2, (shape[0]-1)/2)
+        for method in ['partition', 'histogram', 'sigmaclip', 'plane']:
+            def setup(shape=shape, method=method):
+                img = synthetic.coronagraphic_frame(shape)
+                return lambda: ip.adjust_bckgr_level(img, *center, R=200, method=method)
+            yield 'adjust_bckgr_level', {'camera': camera, 'method': method}, setup
+        def setup(shape=shape):
+            stack = synthetic.camera_frames(camera, 4)
+            return lambda: ip.adjust_bckgr_level(stack, *center, R=200)
+        yield 'adjust_bckgr_level', {'camera': camera, 'method': 'partition', 
+                'batch': 4}, setup
+        
+        for numIm in [5] if quick else [5, 20]:
+            for crop in ['full', 'half']:
+                def setup(camera=camera, numIm=numIm, crop=crop):
+                    frames = synthetic.camera_frames(camera, 4)
+                    (ny, nx) = shape
+                    roi = (slice(None), slice(None)) if crop == 'full' else \
+                            (slice(ny//4, 3*ny//4), slice(nx//4, 3*nx//4))
+                    cam = synthetic.SyntheticCamera(frames)
+                    return lambda: cam.stackFrames(0., numIm, roi)
+                yield 'avgImg_stack', {'camera': camera, 'numIm': numIm, 
+                        'crop': crop}, setup
+            def setup(camera=camera, numIm=numIm):
+                frames = synthetic.camera_frames(camera, 4)
+                def run():
+                    acc = FrameAccumulator((slice(None), slice(None)), np.float64, 65000)
+                    for i in range(numIm):
+                        acc.add(frames[i % len(frames)])
+                    return acc.result()
+                return run
+            yield 'FrameAccumulator', {'camera': camera, 'numIm': numIm}, setup
+
+def measure(func, repeat):
+    """Returns the best and median times in seconds over repeat runs, after a
+    warm-up run, and the peak traced memory in bytes of one more run.
+    """
+    func()
+    times = []
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        func()
+        times.append(time.perf_counter() - t0)
+    tracemalloc.start()
+    func()
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return min(times), float(np.median(times)), peak
+
+def key(result):
+    return result['name'] + json.dumps(result['params'], sort_keys=True)
+
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], 
+                capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return 'unknown'
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--quick', action='store_true', help='fewer and smaller cases')
+    parser.add_argument('--filter', default='', help='run cases whose name contains this')
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--output', help='JSON results file')
+    parser.add_argument('--compare', help='previous JSON results file')
+    parser.add_argument('--threshold', type=float, default=1.2, 
+            help='time ratio reported as a regression')
+    args = parser.parse_args(argv)
+    
+    commit = git_commit()
+    results = []
+    for name, params, setup in cases(args.quick):
+        if args.filter not in name:
+            continue
+        best, median, peak = measure(setup(), args.repeat)
+        results.append({'name': name, 'params': params, 'best': best, 
+                'median': median, 'peak_memory': peak})
+        print('%-20s %-55s %10.2f ms %10.1f MB'%(name, json.dumps(params), 
+                best*1e3, peak/1e6))
+    
+    output = args.output or os.path.join(RESULTS, commit + '.json')
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, 'w') as f:
+        json.dump({'commit': commit, 'date': time.strftime('%Y-%m-%dT%H:%M:%S'),
+                'python': platform.python_version(), 'numpy': np.__version__,
+                'machine': platform.platform(), 'repeat': args.repeat, 
+                'results': results}, f, indent=1)
+    print('Results saved in %s'%output)
+    
+    regressions = 0
+    if args.compare:
+        with open(args.compare) as f:
+            previous = dict((key(r), r) for r in json.load(f)['results'])
+        print('\nComparison with %s (time ratio new/old):'%args.compare)
+        for r in results:
+            old = previous.get(key(r))
+            if old is None:
+                continue
+            ratio = r['best'] / old['best']
+            flag = '  REGRESSION' if ratio > args.threshold else ''
+            regressions += bool(flag)
+            print('%-20s %-55s %6.2f%s'%(r['name'], json.dumps(r['params']), ratio, flag))
+    
+    return regressions
+
+if __name__ == '__main__':
+    sys.exit(1 if main() else 0)
@@ -0,0 +1,114 @@
+"""Synthetic data for the benchmarks: Gaussian and Airy PSFs, stacks of PSF
+cutouts with sub-pixel offsets, and coronagraphic frames (bright core, bowtie
+dark hole, speckles, background and noise) at the sizes of the lab cameras.
+
+A SyntheticCamera replays pregenerated frames through the Camera acquisition 
+path (stackFrames / FrameAccumulator), without hardware.
+"""
+import numpy as np
+from HCIFS.util import img_processing as ip
+from HCIFS.Device.Camera.Camera import Camera
+
+# full frames (ny, nx) of the cameras, as returned by 'ImageArray'
+CAMERAS = {'QSIrs61': (2758, 2208), 'SXvrh9': (1392, 1040)}
+
+
+def gaussian_psf(shape, xoyo=None, sigma=2., amplitude=1e4, background=100., 
+            noise=True, seed=0):
+    """Returns a float64 image of a 2D Gaussian PSF, with background and 
+    Poisson noise.
+    """
+    (ny, nx) = shape
+    (xo, yo) = xoyo if xoyo is not None else ((nx-1)/2, (ny-1)/2)
+    img = ip.twoD_Gaussian(ip.get_grid(shape), amplitude, xo, yo, sigma, sigma, 
+            0, background).reshape(shape)
+    return add_noise(img, seed) if noise else img
+
+def airy_psf(shape, xoyo=None, F=.4, amplitude=1e4, background=100., noise=True, 
+            seed=0):
+    """Returns a float64 image of an Airy PSF, with background and Poisson 
+    noise. F scales the radius (first dark ring at 3.83/F pixels).
+    """
+    (ny, nx) = shape
+    (xo, yo) = xoyo if xoyo is not None else ((nx-1)/2, (ny-1)/2)
+    img = ip.twoD_Airy(ip.get_grid(shape), amplitude, xo, yo, F).reshape(shape)
+    img += background
+    return add_noise(img, seed) if noise else img
+
+def psf_stack(n, size, kind='gauss', seed=0, **kwargs):
+    """Returns a stack (n, size, size) of PSF cutouts with random sub-pixel 
+    offsets of up to 2 pixels from the center, and the true (x, y) centers.
+    """
+    rng = np.random.default_rng(seed)
+    centers = (size-1)/2 + rng.uniform(-2, 2, (n, 2))
+    psf = gaussian_psf if kind == 'gauss' else airy_psf
+    stack = np.stack([psf((size, size), c, seed=seed+i, **kwargs) 
+            for i, c in enumerate(centers)])
+    return stack, centers
+
+def coronagraphic_frame(shape, F=.05, contrast=1e-6, nspeckles=200, 
+            bowtieAngle=60, peak=6e4, background=100., seed=0):
+    """Returns a float64 coronagraphic frame: an Airy core attenuated by the 
+    focal plane mask, a bowtie dark hole of the given opening angle where the
+    halo is suppressed to 'contrast', speckles, background and noise.
+    """
+    rng = np.random.default_rng(seed)
+    (ny, nx) = shape
+    (xo, yo) = ((nx-1)/2, (ny-1)/2)
+    (x, y) = ip.get_grid(shape)
+    r = np.sqrt(ip.get_r2(shape, (xo, yo)))
+    # halo: Airy envelope, suppressed in the two lobes of the bowtie
+    halo = peak * np.minimum((1.2 / (1 + r*F))**3, 1e-2)
+    theta = np.degrees(np.arctan2(y - yo, x - xo)) % 180
+    lobes = np.abs(theta - 90) > 90 - bowtieAngle/2
+    halo[lobes & (r*F > 3.83) & (r*F < 20)] *= contrast * 1e2
+    # speckles: small Gaussians at random positions of the dark hole
+    for i in range(nspeckles):
+        sx, sy = rng.uniform(0, nx), rng.uniform(0, ny)
+        i0, i1 = int(max(sy-6, 0)), int(min(sy+7, ny))
+        j0, j1 = int(max(sx-6, 0)), int(min(sx+7, nx))
+        halo[i0:i1, j0:j1] += peak * contrast * rng.uniform(1, 10) * np.exp(
+                -((x[i0:i1, j0:j1]-sx)**2 + (y[i0:i1, j0:j1]-sy)**2) / (2 * 1.5**2))
+    return add_noise(halo + background, seed)
+
+def add_noise(img, seed=0, readnoise=5.):
+    """Adds Poisson and read noise to an image, in place.
+    """
+    rng = np.random.default_rng(seed)
+    img[...] = rng.poisson(np.maximum(img, 0)) + rng.normal(0, readnoise, img.shape)
+    return img
+
+
+class SyntheticCamera(Camera):
+    """
+    A Camera which replays pregenerated int32 frames, with no exposure or 
+    readout delay, to benchmark the image stacking path of avgImg.
+    """
+    
+    def __init__(self, frames, **specs):
+        specs.setdefault('name', 'SyntheticCamera')
+        super().__init__(**specs)
+        self.frames = frames
+        self.index = 0
+        self.readoutTime = 0.
+    
+    def startExposure(self, expTime):
+        pass
+    
+    def waitForImage(self, expTime, timeout=None, attribute='ImageReady'):
+        pass
+    
+    def readImage(self, out=None):
+        frame = self.frames[self.index % len(self.frames)]
+        self.index += 1
+        if out is None:
+            return frame.copy()
+        np.copyto(out, frame)
+        return out
+
+def camera_frames(camera='SXvrh9', n=4, seed=0):
+    """Returns n int32 coronagraphic frames (n, ny, nx) at the size of a camera.
+    """
+    shape = CAMERAS[camera]
+    return np.stack([coronagraphic_frame(shape, seed=seed+i) 
+            for i in range(n)]).clip(0, 65535).astype(np.int32)